@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vi:ts=4:sw=4:syn=python
+
+# koemyd.struct.HTTPHeaders vs. its former, scan-based, implementation
+# on realistic 20-40 header messages: parse, look up, serialize.
+
+import os
+import sys
+import timeit
+import optparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import koemyd.const
+import koemyd.struct
+
+class LegacyHTTPHeaders(dict): # i.e., as of koemyd 1.0
+    def __contains__(self, k): return k.title() in map(str.title, self.keys())
+
+    def __getitem__(self, k):
+        for cs_k in self.keys():
+            if k.title() == cs_k.title(): k = cs_k
+        return super(LegacyHTTPHeaders, self).__getitem__(k)
+
+    def __setitem__(self, k, v):
+        for cs_k in self.keys():
+            if k.title() == cs_k.title(): k = cs_k
+        super(LegacyHTTPHeaders, self).__setitem__(k, v.strip())
+
+    def __fn_order(self, i, p=koemyd.const.HTTP_HEADERS_SORT_PRIO_KEYS):
+        k, v = map(str.title, i)
+        p = tuple(map(str.title, p))
+        return (p.index(k) if k in p else len(p), i)
+
+    def iteritems(self):
+        i = super(LegacyHTTPHeaders, self).iteritems()
+        headers = sorted(i, key=self.__fn_order)
+        for k, v in headers: yield (k, v)
+
+RESPONSE_HEADERS = [
+    "Date: Sun, 18 Oct 2026 10:00:00 GMT",
+    "Server: Apache/2.4.41 (Ubuntu)",
+    "Content-Type: text/html; charset=UTF-8",
+    "Content-Length: 48213",
+    "Connection: keep-alive",
+    "Keep-Alive: timeout=5, max=100",
+    "Cache-Control: public, max-age=3600",
+    "Expires: Sun, 18 Oct 2026 11:00:00 GMT",
+    "Last-Modified: Sat, 17 Oct 2026 22:13:08 GMT",
+    "ETag: \"bc55-5b1e8f1c2d4c0\"",
+    "Accept-Ranges: bytes",
+    "Vary: Accept-Encoding, Cookie",
+    "Content-Encoding: gzip",
+    "X-Frame-Options: SAMEORIGIN",
+    "X-Content-Type-Options: nosniff",
+    "X-XSS-Protection: 1; mode=block",
+    "Strict-Transport-Security: max-age=31536000; includeSubDomains",
+    "Referrer-Policy: strict-origin-when-cross-origin",
+    "Set-Cookie: session=3a7f9c; Path=/; HttpOnly",
+    "Set-Cookie: prefs=dark; Path=/; Max-Age=31536000",
+    "Set-Cookie: ab=variant-b; Path=/",
+    "Age: 120",
+    "Via: 1.1 varnish",
+    "X-Cache: HIT",
+    "X-Cache-Hits: 3",
+    "X-Served-By: cache-fra19142-FRA",
+    "X-Timer: S1600000000.123456,VS0,VE0",
+    "Access-Control-Allow-Origin: *",
+    "Access-Control-Allow-Methods: GET, HEAD, OPTIONS",
+    "Access-Control-Max-Age: 86400",
+    "Content-Security-Policy: default-src 'self'; img-src *",
+    "Permissions-Policy: geolocation=()",
+    "Alt-Svc: h3=\":443\"; ma=86400",
+    "Report-To: {\"group\":\"default\",\"max_age\":31536000}",
+    "NEL: {\"report_to\":\"default\",\"max_age\":31536000}",
+    "X-Request-Id: 5f0c6a1e-9d2b-4f7a-8e1c-3b2a1d0e9f8c",
+    "X-Runtime: 0.042117",
+    "X-Powered-By: PHP/7.4.3",
+    "Link: </style.css>; rel=preload; as=style",
+    "Pragma: no-cache",
+]
+
+LOOKUPS = [
+    "Transfer-Encoding", "Content-Length", "Connection",
+    "connection", "Proxy-Connection", "content-length",
+]
+
+def run(cls, lines, add):
+    h = cls()
+    for line in lines:
+        k, v = koemyd.struct.HTTPHeaders.parse(line)
+        if add: h.add(k, v)
+        else:
+            h[k] = v
+
+    for k in LOOKUPS:
+        if k in h: h[k]
+
+    h["Connection"] = "keep-alive"
+
+    if add: return h.wire(koemyd.const.HTTP_HEADERS_SKIP_TO_CLIENT_KEYS)
+
+    return str().join([
+        "%s: %s%s" % (k, v, koemyd.const.CRLF) for k, v in h.iteritems()
+        if k.lower() not in map(str.lower, koemyd.const.HTTP_HEADERS_SKIP_TO_CLIENT)
+    ])
+
+def main(argv):
+    parser = optparse.OptionParser(usage="%prog [-n NUMBER]")
+    parser.add_option("-n", "--number", type="int", default=5000, help="messages per measurement")
+    options, _ = parser.parse_args(argv)
+
+    for n in [20, 30, 40]:
+        lines = RESPONSE_HEADERS[:n]
+
+        r = []
+        for cls, add in [(LegacyHTTPHeaders, False), (koemyd.struct.HTTPHeaders, True)]:
+            t = min(timeit.repeat(lambda: run(cls, lines, add), number=options.number, repeat=3))
+            r.append(options.number / t)
+
+        print "%2d headers: legacy %9.0f msg/s, current %9.0f msg/s (x%.1f)" % (n, r[0], r[1], r[1] / r[0])
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vi:ts=4:sw=4:syn=python
+
+# koemyd.daemon.Server's resident memory per client connection: keep-alive
+# connections left idle after their response, and connections held mid-body
+# by an origin that stalls halfway; the proxy's VmRSS with all of them open,
+# less what it was before, over their count; results are JSON.
+#
+#   bench/memory.py -n 400 -o base.json
+#   bench/memory.py -n 400 -o head.json
+#   bench/memory.py compare base.json head.json
+
+import os
+import sys
+import json
+import time
+import shutil
+import signal
+import socket
+import platform
+import tempfile
+import optparse
+
+import proxy as bench # i.e., bench/proxy.py, its origin, proxy and runner
+
+SCENARIOS = ["idle", "active"]
+
+WARMUP = 32 # i.e., connections through before the baseline, so imports, free lists and idle handlers' stacks aren't counted
+
+# (metric, True if higher is better)
+METRICS = [
+    ("bytes_per_connection", False),
+    ("rss_kb", False),
+]
+
+def rss_kb(pid):
+    with open("/proc/%d/status" % pid) as f:
+        for line in f:
+            if line.startswith("VmRSS:"): return int(line.split()[1])
+
+    return None
+
+def hold(name, options, proxy_address, origin_address): # i.e., a client connection, left where the scenario wants it
+    sock = socket.create_connection(proxy_address)
+    sock.settimeout(options.timeout)
+
+    kind = "stalled" if name == "active" else "plain"
+    sock.sendall(bench.request(origin_address, "/%s/%d" % (kind, options.size), True))
+
+    f = sock.makefile("rb")
+    try:
+        line, headers = bench.read_head(f)
+        if line is None or not line.split(None, 2)[1] == "200": raise EOFError
+
+        if name == "active":
+            n = options.size // 2
+            if not len(f.read(n)) == n: raise EOFError
+        else:
+            bench.read_body(f, headers)
+    except:
+        sock.close()
+        raise
+    finally:
+        f.close()
+
+    return sock
+
+def stop(pid, timeout=5.0):
+    os.kill(pid, signal.SIGINT)
+
+    time_due = time.time() + timeout
+    while time.time() < time_due:
+        if os.waitpid(pid, os.WNOHANG)[0]: return
+        time.sleep(0.05)
+
+    os.kill(pid, signal.SIGKILL)
+    os.waitpid(pid, 0)
+
+def scenario(name, options, directory, origin_address):
+    sock = bench.listener()
+    proxy_address = sock.getsockname()
+    log_path = os.path.join(directory, "%s.log" % name)
+
+    admin = bench.listener() # i.e., a free port, for the proxy's tuning, up before the baseline
+    admin_address = admin.getsockname()
+    admin.close()
+
+    settings = [
+        ("engine", options.engine),
+        ("admin_port", admin_address[1]),
+        ("handler_pool_size", WARMUP + (options.connections if name == "active" else 0)), # i.e., threaded, each active one holds a handler
+        ("accept_queue_size", options.connections + WARMUP),
+        ("keepalive_timeout", 3600), ("idle_timeout", 3600),
+    ] + options.settings
+
+    proxy_pid = bench.fork(bench.proxy, sock, directory, log_path, settings)
+    sock.close()
+
+    socks, errors = [], 0
+    try:
+        bench.ready(proxy_address, origin_address)
+        effective = bench.tuning(admin_address)
+
+        for _ in xrange(WARMUP):
+            try:
+                hold(name, options, proxy_address, origin_address).close()
+            except (socket.error, EOFError, ValueError, IndexError): pass
+
+        time.sleep(options.settle)
+        rss_started = rss_kb(proxy_pid)
+
+        for _ in xrange(options.connections):
+            try:
+                socks.append(hold(name, options, proxy_address, origin_address))
+            except (socket.error, EOFError, ValueError, IndexError):
+                errors += 1
+
+        time.sleep(options.settle)
+        rss_finished = rss_kb(proxy_pid)
+    finally:
+        for s in socks: s.close()
+        stop(proxy_pid)
+
+    return {
+        "connections": len(socks),
+        "errors": errors,
+        "rss_started_kb": rss_started,
+        "rss_kb": rss_finished,
+        "bytes_per_connection": int(round((rss_finished - rss_started) * 1024.0 / len(socks))) if socks else None,
+        "tuning": effective,
+    }
+
+def run(options):
+    http_sock, echo_sock = bench.listener(), bench.listener()
+    origin_address = http_sock.getsockname()
+
+    origin_pid = bench.fork(bench.origin, http_sock, echo_sock)
+    http_sock.close()
+    echo_sock.close()
+
+    directory = tempfile.mkdtemp(prefix="koemyd-bench-")
+
+    report = {
+        "meta": {
+            "revision": bench.revision(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "engine": options.engine,
+            "settings": dict(options.settings),
+            "connections": options.connections,
+            "repeat": options.repeat,
+            "size": options.size,
+        },
+        "scenarios": dict(),
+    }
+
+    try:
+        for name in options.scenarios:
+            runs = sorted((scenario(name, options, directory, origin_address)
+                           for _ in xrange(options.repeat)), key=lambda r: r["bytes_per_connection"])
+
+            r = runs[len(runs) // 2] # i.e., the median run
+            report["scenarios"][name] = r
+            report["meta"]["tuning"] = r.pop("tuning") or report["meta"].get("tuning")
+
+            sys.stderr.write("%-8s %6d connections %9s bytes/connection  rss %7dkB -> %7dkB  errors %d\n" % (
+                name, r["connections"], r["bytes_per_connection"], r["rss_started_kb"], r["rss_kb"], r["errors"],
+            ))
+    finally:
+        os.kill(origin_pid, signal.SIGTERM)
+        os.waitpid(origin_pid, 0)
+
+        if options.log:
+            for name in options.scenarios:
+                log_path = os.path.join(directory, "%s.log" % name)
+                if os.path.exists(log_path): shutil.copy(log_path, "%s.%s" % (options.log, name))
+
+        shutil.rmtree(directory, True)
+
+    return report
+
+def main(argv):
+    if argv and argv[0] == "compare":
+        parser = optparse.OptionParser(usage="%prog compare [-t PERCENT] BASE.json HEAD.json")
+        parser.add_option("-t", "--threshold", type="float", default=5.0, help="tolerated change, in percent")
+        options, args = parser.parse_args(argv[1:])
+        if not len(args) == 2: parser.error("two reports are required")
+
+        with open(args[0]) as b, open(args[1]) as h:
+            return bench.compare(json.load(b), json.load(h), options.threshold, METRICS)
+
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("-n", "--connections", type="int", default=400, help="client connections held open")
+    parser.add_option("-r", "--repeat", type="int", default=1, help="runs per scenario, the median one is reported")
+    parser.add_option("-s", "--size", type="int", default=0x10000, help="body size, in bytes, active ones get half of it")
+    parser.add_option("-w", "--settle", type="float", default=1.0, help="seconds to wait before each RSS reading")
+    parser.add_option("-T", "--timeout", type="float", default=10.0, help="seconds a client waits on the proxy")
+    parser.add_option("-e", "--engine", choices=["threaded", "reactor"], default="threaded")
+    parser.add_option("-S", "--scenario", dest="scenarios", action="append", choices=SCENARIOS, help="repeatable, all by default")
+    parser.add_option("-D", "--set", dest="settings", action="callback", callback=bench.setting, type="string", default=[], help="extra [daemon] key=value, repeatable")
+    parser.add_option("-l", "--log", help="keep the proxy logs as LOG.<scenario>")
+    parser.add_option("-o", "--output", help="write the JSON report here instead of stdout")
+    options, _ = parser.parse_args(argv)
+
+    if min(options.connections, options.repeat) < 1: parser.error("connections and repeat must be positive")
+    if not 0 <= options.size <= len(bench.PAYLOAD): parser.error("size must be at most %d" % len(bench.PAYLOAD))
+    if not os.path.exists("/proc/self/status"): parser.error("VmRSS is read off /proc/<pid>/status")
+
+    options.scenarios = options.scenarios or SCENARIOS
+
+    report = run(options)
+
+    if options.output:
+        with open(options.output, "w") as f: json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        print json.dumps(report, indent=2, sort_keys=True)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
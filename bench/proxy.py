@@ -0,0 +1,572 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vi:ts=4:sw=4:syn=python
+
+# koemyd.daemon.Server on loopback against a local stand-in origin:
+# Content-Length, chunked and unframed (chunked by the proxy) bodies,
+# keep-alive reuse and a CONNECT echo target, driven by concurrent
+# clients; results are JSON.
+#
+#   bench/proxy.py -c 16 -d 10 -o base.json
+#   bench/proxy.py -c 16 -d 10 -o head.json
+#   bench/proxy.py compare base.json head.json
+
+import os
+import sys
+import json
+import time
+import errno
+import shutil
+import signal
+import socket
+import platform
+import tempfile
+import threading
+import subprocess
+import multiprocessing
+import optparse
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+SCENARIOS = ["plain", "chunked", "encoded", "keepalive", "connect"]
+
+CHUNK_SIZE = 0x4000
+PAYLOAD = "x" * 0x100000
+
+CRLF = "\r\n"
+
+# (metric, True if higher is better)
+METRICS = [
+    ("requests_per_second", True),
+    ("mb_per_second", True),
+    ("latency_p50_ms", False),
+    ("latency_p99_ms", False),
+    ("cpu_ms_per_request", False),
+    ("send_syscalls_per_request", False),
+    ("peak_rss_kb", False),
+]
+
+def listener(backlog=socket.SOMAXCONN):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("127.0.0.1", 0))
+    sock.listen(backlog)
+
+    return sock
+
+def serve_threads(sock, fn):
+    while True:
+        try:
+            conn, _ = sock.accept()
+        except socket.error as e:
+            if e.errno in [errno.EINTR, errno.ECONNABORTED]: continue
+            raise
+
+        t = threading.Thread(target=fn, args=(conn,))
+        t.daemon = True
+        t.start()
+
+def read_head(f):
+    line = f.readline()
+    if not line: return (None, None)
+
+    headers = dict()
+    while True:
+        h = f.readline()
+        if h in [CRLF, str()]: break
+
+        k, _, v = h.partition(':')
+        headers[k.strip().lower()] = v.strip()
+
+    return (line, headers)
+
+# --- origin ------------------------------------------------------------------
+
+def origin_http(conn):
+    f = conn.makefile("rb")
+    try:
+        while True:
+            line, headers = read_head(f)
+            if line is None: return
+
+            _, path, _ = line.split()
+            kind, _, size = path.lstrip('/').partition('/')
+            size = min(int(size or 0), len(PAYLOAD))
+
+            is_persistent = not headers.get("connection", str()).lower() == "close"
+            connection = "Connection: %s%s" % ("keep-alive" if is_persistent else "close", CRLF)
+
+            if kind == "chunked":
+                conn.sendall("HTTP/1.1 200 OK" + CRLF + "Transfer-Encoding: chunked" + CRLF + connection + CRLF)
+                for i in xrange(0, size, CHUNK_SIZE):
+                    c = PAYLOAD[i:min(i + CHUNK_SIZE, size)]
+                    conn.sendall("%x%s%s%s" % (len(c), CRLF, c, CRLF))
+                conn.sendall("0" + CRLF + CRLF)
+            elif kind == "unframed": # i.e., delimited by close, the proxy chunks it
+                conn.sendall("HTTP/1.1 200 OK" + CRLF + "Connection: close" + CRLF + CRLF)
+                for i in xrange(0, size, CHUNK_SIZE):
+                    conn.sendall(buffer(PAYLOAD, i, min(CHUNK_SIZE, size - i)))
+                return
+            elif kind == "stalled": # i.e., half the body, then nothing until the proxy lets go, cf. bench/memory.py
+                conn.sendall("HTTP/1.1 200 OK" + CRLF + "Content-Length: %d%s" % (size, CRLF) + connection + CRLF)
+                conn.sendall(buffer(PAYLOAD, 0, size // 2))
+                while conn.recv(0x10000): pass
+                return
+            else:
+                conn.sendall("HTTP/1.1 200 OK" + CRLF + "Content-Length: %d%s" % (size, CRLF) + connection + CRLF)
+                conn.sendall(buffer(PAYLOAD, 0, size))
+
+            if not is_persistent: return
+    except (socket.error, ValueError): pass
+    finally:
+        f.close()
+        conn.close()
+
+def origin_echo(conn):
+    try:
+        while True:
+            d = conn.recv(0x10000)
+            if not d: return
+            conn.sendall(d)
+    except socket.error: pass
+    finally:
+        conn.close()
+
+def origin(http_sock, echo_sock):
+    t = threading.Thread(target=serve_threads, args=(echo_sock, origin_echo))
+    t.daemon = True
+    t.start()
+
+    serve_threads(http_sock, origin_http)
+
+# --- proxy -------------------------------------------------------------------
+
+def proxy(sock, directory, log_path, settings):
+    os.chdir(directory) # i.e., koemyd.conf is read from the working directory on import
+
+    with open("koemyd.conf", "w") as f:
+        f.write("[daemon]\n")
+        f.write("listen_addr = 127.0.0.1\n")
+        f.write("listen_port = %d\n" % sock.getsockname()[1])
+        for k, v in settings: f.write("%s = %s\n" % (k, v))
+
+    fd = os.open(log_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0644)
+    os.dup2(fd, sys.stdout.fileno())
+    os.dup2(fd, sys.stderr.fileno())
+
+    sys.path.insert(0, ROOT)
+
+    import koemyd.daemon
+    import koemyd.logger
+
+    koemyd.daemon.Server(sock).start()
+
+    koemyd.logger.flush()
+
+# --- clients -----------------------------------------------------------------
+
+def request(origin_address, path, is_persistent):
+    return str().join([
+        "GET http://%s:%d%s HTTP/1.1%s" % (origin_address + (path, CRLF)),
+        "Host: %s:%d%s" % (origin_address + (CRLF,)),
+        "User-Agent: koemyd-bench%s" % CRLF,
+        "Connection: %s%s" % ("keep-alive" if is_persistent else "close", CRLF),
+        CRLF,
+    ])
+
+def read_body(f, headers):
+    if "content-length" in headers:
+        n = int(headers["content-length"])
+        if not len(f.read(n)) == n: raise EOFError
+        return n
+
+    if headers.get("transfer-encoding", str()).lower() == "chunked":
+        n = 0
+        while True:
+            size = int(f.readline().split(';', 1)[0], 16)
+            if not size:
+                while f.readline() not in [CRLF, str()]: pass
+                return n
+
+            if not len(f.read(size)) == size: raise EOFError
+            f.readline()
+            n += size
+
+    return len(f.read())
+
+class Client(threading.Thread):
+    def __init__(self, scenario, options, proxy_address, origin_address, echo_address, deadline):
+        super(Client, self).__init__()
+        self.daemon = True
+
+        self.scenario = scenario
+        self.options = options
+        self.proxy_address = proxy_address
+        self.origin_address = origin_address
+        self.echo_address = echo_address
+        self.deadline = deadline
+
+        self.latencies = []
+        self.bytes = 0
+        self.errors = 0
+
+    def __http(self, path, is_persistent):
+        r = request(self.origin_address, path, is_persistent)
+
+        sock = f = None
+        while time.time() < self.deadline:
+            t = time.time()
+            try:
+                if sock is None:
+                    sock = socket.create_connection(self.proxy_address)
+                    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                    f = sock.makefile("rb", 0x10000)
+
+                sock.sendall(r)
+
+                line, headers = read_head(f)
+                if line is None or not line.split(None, 2)[1] == "200": raise EOFError
+
+                self.bytes += read_body(f, headers)
+                self.latencies.append(time.time() - t)
+
+                if not is_persistent or headers.get("connection", str()).lower() == "close":
+                    f, sock = self.__close(f, sock)
+            except (socket.error, EOFError, ValueError, IndexError):
+                self.errors += 1
+                f, sock = self.__close(f, sock)
+
+        self.__close(f, sock)
+
+    @staticmethod
+    def __close(f, sock):
+        if f: f.close()
+        if sock: sock.close()
+        return (None, None)
+
+    def __connect(self):
+        size = self.options.size
+        r = "CONNECT %s:%d HTTP/1.1%sHost: %s:%d%s%s" % (
+            self.echo_address + (CRLF,) + self.echo_address + (CRLF, CRLF)
+        )
+
+        while time.time() < self.deadline:
+            t = time.time()
+            sock = None
+            try:
+                sock = socket.create_connection(self.proxy_address)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                sock.sendall(r)
+
+                f = sock.makefile("rb", 0)
+                line, _ = read_head(f)
+                if line is None or not line.split(None, 2)[1] == "200": raise EOFError
+
+                sock.sendall(buffer(PAYLOAD, 0, size))
+
+                n = 0
+                while n < size:
+                    d = sock.recv(0x10000)
+                    if not d: raise EOFError
+                    n += len(d)
+
+                self.bytes += n
+                self.latencies.append(time.time() - t)
+            except (socket.error, EOFError, ValueError, IndexError):
+                self.errors += 1
+            finally:
+                if sock: sock.close()
+
+    def run(self):
+        if self.scenario == "connect": return self.__connect()
+
+        kind = {"chunked": "chunked", "encoded": "unframed"}.get(self.scenario, "plain")
+        self.__http("/%s/%d" % (kind, self.options.size), self.scenario == "keepalive")
+
+def clients(pipe, n, *args):
+    threads = [Client(*args) for _ in xrange(n)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+
+    pipe.send({
+        "latencies": [l for t in threads for l in t.latencies],
+        "bytes": sum(t.bytes for t in threads),
+        "errors": sum(t.errors for t in threads),
+    })
+    pipe.close()
+
+# --- runner ------------------------------------------------------------------
+
+def fork(fn, *args):
+    pid = os.fork()
+    if pid: return pid
+
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    ex_code = 0
+    try:
+        fn(*args)
+    except KeyboardInterrupt: pass
+    except:
+        import traceback; traceback.print_exc()
+        ex_code = 1
+    finally:
+        os._exit(ex_code)
+
+def scrape(admin_address): # i.e., the proxy's metrics, one line each
+    try:
+        sock = socket.create_connection(admin_address)
+        try:
+            sock.sendall("GET /metrics HTTP/1.0%s%s" % (CRLF, CRLF))
+            f = sock.makefile("rb")
+            lines = f.read().splitlines()
+            f.close()
+        finally:
+            sock.close()
+    except socket.error:
+        return []
+
+    return lines
+
+def send_syscalls(admin_address): # i.e., as counted by the proxy, None if it doesn't
+    samples = [float(l.split()[-1]) for l in scrape(admin_address) if l.startswith("koemyd_send_syscalls_total{")]
+    return int(sum(samples)) if samples else None
+
+def tuning(admin_address): # i.e., the socket options in effect, as the proxy read them back
+    prefix = "koemyd_tuning_"
+    return dict((l.split()[0][len(prefix):], int(float(l.split()[-1])))
+                for l in scrape(admin_address) if l.startswith(prefix)) or None
+
+def ready(proxy_address, origin_address): # i.e., one request through, so startup isn't measured
+    for _ in xrange(100):
+        try:
+            sock = socket.create_connection(proxy_address)
+            try:
+                sock.sendall(request(origin_address, "/plain/0", False))
+                while sock.recv(0x10000): pass
+                return
+            finally:
+                sock.close()
+        except socket.error:
+            time.sleep(0.05)
+
+def percentile(s, q):
+    if not s: return 0.0
+    return s[min(len(s) - 1, int(round(q * (len(s) - 1))))]
+
+def scenario(name, options, directory, origin_address, echo_address):
+    sock = listener()
+    proxy_address = sock.getsockname()
+    log_path = os.path.join(directory, "%s.log" % name)
+
+    admin = listener() # i.e., a free port, for the proxy's metrics
+    admin_address = admin.getsockname()
+    admin.close()
+
+    settings = [("engine", options.engine), ("admin_port", admin_address[1])] + options.settings
+
+    proxy_pid = fork(proxy, sock, directory, log_path, settings)
+    sock.close()
+
+    ready(proxy_address, origin_address)
+    syscalls_started = send_syscalls(admin_address)
+    effective = tuning(admin_address)
+
+    processes = min(options.concurrency, options.processes)
+    deadline = time.time() + options.duration
+
+    started = time.time()
+
+    workers = []
+    for i in xrange(processes):
+        n = options.concurrency // processes + (1 if i < options.concurrency % processes else 0)
+
+        r, w = multiprocessing.Pipe(duplex=False)
+        pid = fork(clients, w, n, name, options, proxy_address, origin_address, echo_address, deadline)
+        w.close()
+        workers.append((pid, r))
+
+    results = []
+    for pid, r in workers:
+        try:
+            results.append(r.recv())
+        except EOFError:
+            results.append({"latencies": [], "bytes": 0, "errors": 0})
+        os.waitpid(pid, 0)
+
+    elapsed = time.time() - started
+
+    syscalls_finished = send_syscalls(admin_address)
+
+    os.kill(proxy_pid, signal.SIGINT)
+    _, _, rusage = os.wait4(proxy_pid, 0)
+
+    latencies = sorted(l for r in results for l in r["latencies"])
+    requests = len(latencies)
+    cpu = rusage.ru_utime + rusage.ru_stime
+
+    n_syscalls = None
+    if syscalls_started is not None and syscalls_finished is not None:
+        n_syscalls = syscalls_finished - syscalls_started
+
+    return {
+        "requests": requests,
+        "errors": sum(r["errors"] for r in results),
+        "bytes": sum(r["bytes"] for r in results),
+        "elapsed": round(elapsed, 3),
+        "requests_per_second": round(requests / elapsed, 1),
+        "mb_per_second": round(sum(r["bytes"] for r in results) / elapsed / 1e6, 2),
+        "latency_p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "latency_p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "cpu_user_seconds": round(rusage.ru_utime, 3),
+        "cpu_system_seconds": round(rusage.ru_stime, 3),
+        "cpu_ms_per_request": round(cpu * 1000 / requests, 4) if requests else None,
+        "send_syscalls_per_request": round(float(n_syscalls) / requests, 2) if requests and n_syscalls is not None else None,
+        "peak_rss_kb": rusage.ru_maxrss, # i.e., kilobytes on linux
+        "tuning": effective,
+    }
+
+def revision():
+    try:
+        return subprocess.check_output(["git", "-C", ROOT, "describe", "--always", "--dirty"], stderr=open(os.devnull, "w")).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(options):
+    http_sock, echo_sock = listener(), listener()
+    origin_address, echo_address = http_sock.getsockname(), echo_sock.getsockname()
+
+    origin_pid = fork(origin, http_sock, echo_sock)
+    http_sock.close()
+    echo_sock.close()
+
+    directory = tempfile.mkdtemp(prefix="koemyd-bench-")
+
+    report = {
+        "meta": {
+            "revision": revision(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": multiprocessing.cpu_count(),
+            "engine": options.engine,
+            "settings": dict(options.settings),
+            "concurrency": options.concurrency,
+            "processes": min(options.concurrency, options.processes),
+            "duration": options.duration,
+            "repeat": options.repeat,
+            "size": options.size,
+        },
+        "scenarios": dict(),
+    }
+
+    try:
+        for name in options.scenarios:
+            runs = sorted((scenario(name, options, directory, origin_address, echo_address)
+                           for _ in xrange(options.repeat)), key=lambda r: r["requests_per_second"])
+
+            r = runs[len(runs) // 2] # i.e., the median run, by throughput
+            report["scenarios"][name] = r
+            report["meta"]["tuning"] = r.pop("tuning") or report["meta"].get("tuning") # i.e., the same for every scenario
+
+            sys.stderr.write("%-10s %9.1f req/s %9.2f MB/s  p50 %8.3fms  p99 %8.3fms  cpu %7.3fs  sends/req %7s  rss %7dkB  errors %d\n" % (
+                name, r["requests_per_second"], r["mb_per_second"], r["latency_p50_ms"], r["latency_p99_ms"],
+                r["cpu_user_seconds"] + r["cpu_system_seconds"], r["send_syscalls_per_request"], r["peak_rss_kb"], r["errors"],
+            ))
+    finally:
+        os.kill(origin_pid, signal.SIGTERM)
+        os.waitpid(origin_pid, 0)
+
+        if options.log:
+            for name in options.scenarios:
+                log_path = os.path.join(directory, "%s.log" % name)
+                if os.path.exists(log_path): shutil.copy(log_path, "%s.%s" % (options.log, name))
+
+        shutil.rmtree(directory, True)
+
+    return report
+
+def compare(base, head, threshold, metrics=METRICS):
+    regressions = []
+
+    for name in sorted(set(base["scenarios"]) & set(head["scenarios"])):
+        b, h = base["scenarios"][name], head["scenarios"][name]
+
+        for metric, is_higher_better in metrics:
+            if not b.get(metric) or h.get(metric) is None: continue
+
+            change = (h[metric] - b[metric]) * 100.0 / b[metric]
+            is_regression = (-change if is_higher_better else change) > threshold
+            if is_regression: regressions.append((name, metric))
+
+            print "%-10s %-20s %12s %12s %+8.1f%%%s" % (
+                name, metric, b[metric], h[metric], change, "  REGRESSION" if is_regression else str()
+            )
+
+        if h["errors"] > b["errors"]:
+            regressions.append((name, "errors"))
+            print "%-10s %-20s %12s %12s %9s  REGRESSION" % (name, "errors", b["errors"], h["errors"], str())
+
+    for k in sorted(set(base["meta"]) | set(head["meta"])):
+        if k in ["time", "revision"]: continue
+        b, h = base["meta"].get(k), head["meta"].get(k)
+        if b == h: continue
+
+        if isinstance(b, dict) and isinstance(h, dict): # e.g., tuning, only the options that differ
+            for o in sorted(set(b) | set(h)):
+                if not b.get(o) == h.get(o): print "meta:%s:%s differs: %r vs. %r" % (k, o, b.get(o), h.get(o))
+        else:
+            print "meta:%s differs: %r vs. %r" % (k, b, h)
+
+    print "%d regression(s) beyond %.1f%% (%s vs. %s)" % (
+        len(regressions), threshold, base["meta"].get("revision"), head["meta"].get("revision")
+    )
+
+    return 1 if regressions else 0
+
+def setting(option, opt, value, parser):
+    k, _, v = value.partition('=')
+    if not (k.strip() and v.strip()): raise optparse.OptionValueError("%s: expected key=value" % opt)
+    parser.values.settings.append((k.strip(), v.strip()))
+
+def main(argv):
+    if argv and argv[0] == "compare":
+        parser = optparse.OptionParser(usage="%prog compare [-t PERCENT] BASE.json HEAD.json")
+        parser.add_option("-t", "--threshold", type="float", default=5.0, help="tolerated change, in percent")
+        options, args = parser.parse_args(argv[1:])
+        if not len(args) == 2: parser.error("two reports are required")
+
+        with open(args[0]) as b, open(args[1]) as h:
+            return compare(json.load(b), json.load(h), options.threshold)
+
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("-c", "--concurrency", type="int", default=8, help="concurrent clients")
+    parser.add_option("-p", "--processes", type="int", default=multiprocessing.cpu_count(), help="client processes")
+    parser.add_option("-d", "--duration", type="float", default=5.0, help="seconds per scenario")
+    parser.add_option("-r", "--repeat", type="int", default=1, help="runs per scenario, the median one is reported")
+    parser.add_option("-s", "--size", type="int", default=0x10000, help="body size, in bytes")
+    parser.add_option("-e", "--engine", choices=["threaded", "reactor"], default="threaded")
+    parser.add_option("-S", "--scenario", dest="scenarios", action="append", choices=SCENARIOS, help="repeatable, all by default")
+    parser.add_option("-D", "--set", dest="settings", action="callback", callback=setting, type="string", default=[], help="extra [daemon] key=value, repeatable")
+    parser.add_option("-l", "--log", help="keep the proxy logs as LOG.<scenario>")
+    parser.add_option("-o", "--output", help="write the JSON report here instead of stdout")
+    options, _ = parser.parse_args(argv)
+
+    if min(options.concurrency, options.processes, options.repeat) < 1:
+        parser.error("concurrency, processes and repeat must be positive")
+    if not 0 <= options.size <= len(PAYLOAD): parser.error("size must be at most %d" % len(PAYLOAD))
+
+    options.scenarios = options.scenarios or SCENARIOS
+
+    report = run(options)
+
+    if options.output:
+        with open(options.output, "w") as f: json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        print json.dumps(report, indent=2, sort_keys=True)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,12 +1,24 @@
 # vi:ts=4:sw=4:syn=python
 
-import uuid
+import random
+import itertools
 
 class Base(object):
+    __slots__ = ()
+
     def __init__(self): pass
 
+def reseed(): # i.e., in a forked worker, or it would hand out its siblings' ids
+    global ids
+    ids = itertools.count(random.SystemRandom().getrandbits(16))
+
+ids = None
+reseed()
+
 class UUIDObject(Base):
-    def __init__(self): self.__uuid = uuid.uuid4()
+    __slots__ = ("__uuid",)
+
+    def __init__(self): self.__uuid = next(ids) & 0xFFFF # i.e., monotonic, wrapping around within the four hex digits logged
 
     @property
-    def uuid(self): return self.__uuid.hex[:4]
+    def uuid(self): return "%04x" % self.__uuid
@@ -0,0 +1,365 @@
+# vi:ts=4:sw=4:syn=python
+
+import os
+import mmap
+import time
+import atexit
+import shutil
+import tempfile
+import threading
+import collections
+import email.utils
+
+import koemyd.conf
+import koemyd.const
+import koemyd.struct
+import koemyd.logger
+import koemyd.metrics
+
+def parse_cache_control(headers):
+    directives = dict()
+    for value in headers.getall("Cache-Control"):
+        for d in value.split(','):
+            k, _, a = d.strip().partition('=')
+            if k: directives[k.lower()] = a.strip().strip('"') if a else True
+
+    if not directives and "no-cache" in headers.get("Pragma", str()).lower():
+        directives["no-cache"] = True # cf. Section 5.4 of [RFC7234]
+
+    return directives
+
+def parse_delta_seconds(value):
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        return 0 # i.e., invalid means stale
+
+def parse_http_date(value):
+    if not value: return None
+
+    t = email.utils.parsedate_tz(value)
+    return email.utils.mktime_tz(t) if t else None
+
+class CacheEntry(object):
+    def __init__(self, key, request, response, time_requested, time_responded, max_size):
+        self.key = key
+        self.line = response.line
+        self.code = response.code
+
+        self.vary = tuple((k, request.headers.get(k)) for k in self.__vary(response.headers))
+
+        self.body = bytearray()
+        self.path = None # i.e., demoted to the disk tier
+        self.size = 0
+        self.max_size = max_size
+
+        self.headers = koemyd.struct.HTTPHeaders()
+        for k, v in response.headers.iteritems():
+            if k.lower() not in koemyd.const.CACHE_HEADERS_SKIP_KEYS:
+                self.headers.add(k, v)
+
+        self.__setup_freshness(time_requested, time_responded, response.headers.get("Age"))
+
+    @staticmethod
+    def __vary(headers):
+        return sorted(set(k.strip().lower() for v in headers.getall("Vary") for k in v.split(',') if k.strip()))
+
+    def __setup_freshness(self, time_requested, time_responded, age): # i.e., Age as received, it isn't kept in headers
+        cc = parse_cache_control(self.headers)
+
+        self.time_responded = time_responded
+        self.date = parse_http_date(self.headers.get("Date")) or time_responded
+
+        apparent_age = max(0, time_responded - self.date) # cf. Section 4.2.3 of [RFC7234]
+        corrected_age = parse_delta_seconds(age or 0) + (time_responded - time_requested)
+        self.initial_age = max(apparent_age, corrected_age)
+
+        self.etag = self.headers.get("ETag")
+        self.last_modified = self.headers.get("Last-Modified")
+
+        if "no-cache" in cc: self.lifetime = 0 # i.e., always revalidate
+        elif "s-maxage" in cc: self.lifetime = parse_delta_seconds(cc["s-maxage"])
+        elif "max-age" in cc: self.lifetime = parse_delta_seconds(cc["max-age"])
+        elif "Expires" in self.headers:
+            expires = parse_http_date(self.headers["Expires"])
+            self.lifetime = max(0, expires - self.date) if expires else 0
+        elif self.last_modified and self.code in koemyd.const.CACHE_HEURISTIC_STATUS_CODES:
+            last_modified = parse_http_date(self.last_modified) or self.date
+            self.lifetime = min(koemyd.const.CACHE_HEURISTIC_MAX_LIFETIME, max(0, self.date - last_modified) / 10)
+        else:
+            self.lifetime = 0
+
+    def freshen(self, response, time_requested, time_responded): # cf. Section 4.3.4 of [RFC7234]
+        headers = koemyd.struct.HTTPHeaders()
+
+        updated = set(k.lower() for k in response.headers.keys()) - koemyd.const.CACHE_HEADERS_SKIP_ON_FRESHEN_KEYS
+        for k, v in self.headers.iteritems():
+            if k.lower() not in updated: headers.add(k, v)
+        for k, v in response.headers.iteritems():
+            if k.lower() in updated: headers.add(k, v)
+
+        self.headers = headers # i.e., swapped, readers may still hold the former
+
+        self.__setup_freshness(time_requested, time_responded, response.headers.get("Age"))
+
+    def age(self, now): return self.initial_age + (now - self.time_responded)
+
+    def matches(self, request): return all(request.headers.get(k) == v for k, v in self.vary)
+
+    def is_fresh(self, request, now):
+        cc = parse_cache_control(request.headers)
+        if "no-cache" in cc: return False
+
+        age, lifetime = self.age(now), self.lifetime
+        if "max-age" in cc: lifetime = min(lifetime, parse_delta_seconds(cc["max-age"]))
+        if "min-fresh" in cc:
+            age += parse_delta_seconds(cc["min-fresh"])
+
+        return lifetime > age
+
+    def head(self, is_persistent, now):
+        return str().join([
+            self.line, koemyd.const.CRLF,
+            self.headers.wire(koemyd.const.CACHE_HEADERS_SKIP_KEYS),
+            "Age: %d%s" % (self.age(now), koemyd.const.CRLF),
+            "Connection: %s%s" % ("keep-alive" if is_persistent else "close", koemyd.const.CRLF),
+            koemyd.const.CRLF,
+        ])
+
+    def write(self, data): # i.e., tee of the body as relayed to the client
+        if self.body is None: return
+
+        self.body += data
+        if len(self.body) > self.max_size:
+            self.body = None
+
+    @property
+    def is_complete(self):
+        if self.body is None: return False
+
+        if "Content-Length" in self.headers:
+            return len(self.body) == parse_delta_seconds(self.headers["Content-Length"])
+
+        return True
+
+    def open(self):
+        if self.path is None: return self.body
+        if not self.size: return str() # i.e., mmap(2) won't map an empty file
+
+        try:
+            with open(self.path, "rb") as f:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, OSError, ValueError, mmap.error):
+            return None # i.e., evicted meanwhile
+
+    @staticmethod
+    def close(body): # i.e., once served, whatever open() mapped
+        if isinstance(body, mmap.mmap): body.close()
+
+class Cache(object):
+    def __init__(self, max_bytes, max_object_size, disk_path=None, disk_max_bytes=0):
+        self.max_bytes = max_bytes
+        self.max_object_size = max_object_size
+        self.disk_path = disk_path
+        self.disk_max_bytes = disk_max_bytes
+
+        self.__lock = threading.Lock()
+        self.__memory = collections.OrderedDict() # key: CacheEntry, least recently used first
+        self.__disk = collections.OrderedDict()
+        self.__disk_dir = None
+        self.__disk_pid = None
+
+        self.memory_bytes = self.disk_bytes = 0
+
+        self.hits = self.misses = self.stale = self.bypasses = 0
+        self.revalidations = self.stores = self.evictions = self.invalidations = 0
+        self.bytes_served = self.bytes_stored = 0
+
+    @staticmethod
+    def key(request): return "%s:%d%s" % (request.host, request.port, request.path)
+
+    @staticmethod
+    def __is_bypassed(request):
+        if not request.method == "GET": return True
+
+        for k in koemyd.const.CACHE_BYPASS_REQUEST_HEADERS:
+            if k in request.headers: return True
+
+        return "no-store" in parse_cache_control(request.headers)
+
+    def lookup(self, request):
+        if self.__is_bypassed(request):
+            with self.__lock: self.bypasses += 1
+            return (None, False)
+
+        key, now = self.key(request), time.time()
+
+        with self.__lock:
+            entry = self.__memory.pop(key, None)
+            if entry: self.__memory[key] = entry
+            else:
+                entry = self.__disk.pop(key, None)
+                if entry: self.__disk[key] = entry
+
+            if not (entry and entry.matches(request)):
+                self.misses += 1
+                return (None, False)
+
+            is_fresh = entry.is_fresh(request, now)
+            if is_fresh: self.hits += 1
+            else:
+                self.stale += 1
+
+        return (entry, is_fresh)
+
+    def store(self, request, response, time_requested, time_responded):
+        if not request.method == "GET": return None
+        if response.code not in koemyd.const.CACHE_STATUS_CODES: return None
+
+        c_cc = parse_cache_control(request.headers)
+        s_cc = parse_cache_control(response.headers)
+
+        if "no-store" in c_cc or "no-store" in s_cc or "private" in s_cc: return None
+
+        if "Authorization" in request.headers: # cf. Section 3.2 of [RFC7234]
+            if not any(d in s_cc for d in ["public", "s-maxage", "must-revalidate"]): return None
+
+        if "Set-Cookie" in response.headers: return None # i.e., per-client state, never shared
+        if "*" in response.headers.get("Vary", str()): return None
+
+        if "Content-Length" in response.headers:
+            if parse_delta_seconds(response.headers["Content-Length"]) > self.max_object_size: return None
+
+        entry = CacheEntry(self.key(request), request, response, time_requested, time_responded, self.max_object_size)
+        if not (entry.lifetime or entry.etag or entry.last_modified):
+            return None # i.e., neither fresh nor revalidatable
+
+        return entry
+
+    def commit(self, entry):
+        if not entry.is_complete: return False
+
+        entry.size = len(entry.body)
+
+        with self.__lock:
+            self.__discard(entry.key)
+
+            self.__memory[entry.key] = entry
+            self.memory_bytes += entry.size
+
+            self.stores += 1
+            self.bytes_stored += entry.size
+
+            demoted = self.__evict()
+
+        self.__demote(demoted)
+
+        return True
+
+    def freshen(self, entry, response, time_requested, time_responded):
+        entry.freshen(response, time_requested, time_responded)
+
+        with self.__lock: self.revalidations += 1
+
+    def invalidate(self, request): # cf. Section 4.4 of [RFC7234]
+        with self.__lock:
+            if self.__discard(self.key(request)): self.invalidations += 1
+
+    def served(self, size):
+        with self.__lock: self.bytes_served += size
+
+    def __discard(self, key):
+        entry = self.__memory.pop(key, None)
+        if entry:
+            self.memory_bytes -= entry.size
+            return True
+
+        entry = self.__disk.pop(key, None)
+        if entry:
+            self.disk_bytes -= entry.size
+            self.__unlink(entry)
+            return True
+
+        return False
+
+    def __evict(self):
+        demoted = []
+        while self.memory_bytes > self.max_bytes and self.__memory:
+            _, entry = self.__memory.popitem(last=False)
+            self.memory_bytes -= entry.size
+            self.evictions += 1
+
+            if self.disk_path and 0 < entry.size <= self.disk_max_bytes: # i.e., an empty one is not worth a file
+                demoted.append(entry)
+
+        while self.disk_bytes > self.disk_max_bytes and self.__disk:
+            _, entry = self.__disk.popitem(last=False)
+            self.disk_bytes -= entry.size
+            self.evictions += 1
+            self.__unlink(entry)
+
+        return demoted
+
+    def __demote(self, entries): # i.e., file i/o kept out of the lock
+        entries = collections.deque(entries)
+        while entries:
+            entry = entries.popleft()
+            try:
+                fd, path = tempfile.mkstemp(dir=self.__directory())
+                with os.fdopen(fd, "wb") as f: f.write(entry.body)
+            except (IOError, OSError) as e:
+                koemyd.logger.warn("cache", "disk:could not write (%s)" % str(e.strerror).lower())
+                continue
+
+            with self.__lock:
+                if entry.key in self.__memory or entry.key in self.__disk:
+                    os.unlink(path) # i.e., stored anew meanwhile
+                    continue
+
+                entry.path, entry.body = path, None
+
+                self.__disk[entry.key] = entry
+                self.disk_bytes += entry.size
+
+                entries.extend(self.__evict()) # i.e., pushed out of memory meanwhile, e.g., by a commit(), demoted all the same
+
+    def __directory(self):
+        if not self.__disk_pid == os.getpid(): # i.e., one per worker
+            if not os.path.isdir(self.disk_path): os.makedirs(self.disk_path)
+
+            self.__disk_dir = tempfile.mkdtemp(prefix="%s-" % koemyd.const.PROGRAM_NAME, dir=self.disk_path)
+            self.__disk_pid = os.getpid()
+
+            atexit.register(shutil.rmtree, self.__disk_dir, True)
+
+        return self.__disk_dir
+
+    @staticmethod
+    def __unlink(entry):
+        try: os.unlink(entry.path)
+        except OSError: pass
+
+    @property
+    def stats(self):
+        lookups = self.hits + self.misses + self.stale
+        return {
+            "hits": self.hits, "misses": self.misses, "stale": self.stale,
+            "bypasses": self.bypasses, "revalidations": self.revalidations,
+            "hit_rate": float(self.hits) / lookups if lookups else 0.0,
+            "stores": self.stores, "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "bytes_served": self.bytes_served, "bytes_stored": self.bytes_stored,
+            "memory_entries": len(self.__memory), "memory_bytes": self.memory_bytes,
+            "disk_entries": len(self.__disk), "disk_bytes": self.disk_bytes,
+        }
+
+cache = None
+if koemyd.conf.settings.cache:
+    cache = Cache(
+        koemyd.conf.settings.cache_max_bytes,
+        koemyd.conf.settings.cache_max_object_size,
+        koemyd.conf.settings.cache_disk_path,
+        koemyd.conf.settings.cache_disk_max_bytes,
+    )
+
+    koemyd.metrics.registry.stats("koemyd_cache", lambda: cache.stats)
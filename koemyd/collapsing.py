@@ -0,0 +1,183 @@
+# vi:ts=4:sw=4:syn=python
+
+import threading
+
+import koemyd.conf
+import koemyd.const
+import koemyd.caching
+import koemyd.metrics
+import koemyd.fetching
+
+def is_collapsible(request):
+    if not request.method == "GET" or "Authorization" in request.headers: return False
+
+    for k in koemyd.const.CACHE_BYPASS_REQUEST_HEADERS:
+        if k in request.headers: return False
+
+    return "no-store" not in koemyd.caching.parse_cache_control(request.headers)
+
+def is_shareable(response):
+    if response.code not in koemyd.const.CACHE_STATUS_CODES: return False
+
+    cc = koemyd.caching.parse_cache_control(response.headers)
+    if "no-store" in cc or "private" in cc: return False
+
+    if "Set-Cookie" in response.headers: return False # i.e., per-client state, never shared
+    return "*" not in response.headers.get("Vary", str())
+
+class Fetch(object): # i.e., one upstream response, fanned out as relayed to whoever asked for it meanwhile
+    def __init__(self, collapser, key, request, leader_uuid):
+        self.collapser = collapser
+        self.key = key
+        self.request = request
+        self.leader_uuid = leader_uuid
+
+        self.__cond = threading.Condition(threading.Lock())
+        self.__offsets = dict() # follower: offset of the next byte it takes
+
+        self.head = None # i.e., response line and headers, but Connection
+        self.vary = ()
+
+        self.body = bytearray()
+        self.base = 0 # i.e., offset of body[0], what every follower took is dropped
+
+        self.is_open = True # i.e., followers may join until the head is in
+        self.is_done = self.is_failed = False
+
+    def follow(self, follower):
+        with self.__cond:
+            if not self.is_open: return False
+
+            self.__offsets[follower] = 0
+
+        return True
+
+    def leave(self, follower):
+        with self.__cond:
+            if self.__offsets.pop(follower, None) is not None: self.__trim()
+
+    def is_wanted(self): return bool(self.__offsets)
+
+    def publish(self, response): # i.e., None if it can't be shared after all
+        if response:
+            self.head = response.line + koemyd.const.CRLF + response.headers.wire(koemyd.const.COLLAPSING_HEADERS_SKIP_KEYS)
+            self.vary = sorted(set(k.strip().lower() for v in response.headers.getall("Vary") for k in v.split(',') if k.strip()))
+
+        with self.__cond:
+            self.is_open = False
+            self.__cond.notify_all()
+
+        self.collapser.forget(self)
+
+    def matches(self, request): return all(request.headers.get(k) == self.request.headers.get(k) for k in self.vary)
+
+    def chain(self, tee): # i.e., a client tee, fanned out first, then on to whatever was teeing already
+        if not tee: return self.write
+
+        def write(data):
+            self.write(data)
+            tee(data)
+
+        return write
+
+    def write(self, data):
+        with self.__cond:
+            self.body += data
+            self.__trim()
+            self.__cond.notify_all()
+
+    def __trim(self):
+        end = self.base + len(self.body)
+
+        if len(self.body) > koemyd.const.COLLAPSING_MAX_LAG: # i.e., the slowest ones hold everyone's memory
+            for follower, offset in self.__offsets.items():
+                if end - offset > koemyd.const.COLLAPSING_MAX_LAG:
+                    del self.__offsets[follower]
+                    self.collapser.overruns += 1
+
+            self.__cond.notify_all()
+
+        n = min(self.__offsets.values() + [end]) - self.base
+        if n >= koemyd.const.COLLAPSING_TRIM_SIZE or n == len(self.body):
+            del self.body[:n]
+            self.base += n
+
+    def wait_head(self):
+        with self.__cond:
+            while self.is_open: self.__cond.wait()
+
+        return self.head
+
+    def read(self, follower, size):
+        with self.__cond:
+            while True:
+                offset = self.__offsets.get(follower)
+                if offset is None:
+                    raise koemyd.fetching.ConnectionError("collapse:c#%s:fell behind" % self.leader_uuid)
+
+                i = offset - self.base
+                if i < len(self.body):
+                    data = str(self.body[i:i + size])
+                    self.__offsets[follower] = offset + len(data)
+                    self.__trim()
+                    return data
+
+                if self.is_done: return str()
+                if self.is_failed:
+                    raise koemyd.fetching.ConnectionError("collapse:c#%s:upstream fetch failed" % self.leader_uuid)
+
+                self.__cond.wait()
+
+    def finish(self):
+        with self.__cond:
+            self.is_done = True
+            self.__cond.notify_all()
+
+    def close(self): # i.e., by the leader, however it went
+        with self.__cond:
+            if not self.is_done: self.is_failed = True
+            self.__cond.notify_all()
+
+        if self.is_open: self.publish(None)
+
+class Collapser(object):
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__fetches = dict() # key: Fetch, while it may still be followed
+
+        self.leaders = self.followers = self.fallbacks = self.overruns = 0
+
+    def join(self, request, follower, leader_uuid): # i.e., (fetch, True if it's up to the caller)
+        key = koemyd.caching.Cache.key(request)
+
+        with self.__lock:
+            fetch = self.__fetches.get(key)
+            if fetch and fetch.follow(follower):
+                self.followers += 1
+                return (fetch, False)
+
+            fetch = self.__fetches[key] = Fetch(self, key, request, leader_uuid)
+            self.leaders += 1
+
+        return (fetch, True)
+
+    def forget(self, fetch):
+        with self.__lock:
+            if self.__fetches.get(fetch.key) is fetch: del self.__fetches[fetch.key]
+
+    def fallback(self):
+        with self.__lock: self.fallbacks += 1
+
+    @property
+    def stats(self):
+        return {
+            "fetches": len(self.__fetches),
+            "leaders": self.leaders, "followers": self.followers,
+            "fallbacks": self.fallbacks, "overruns": self.overruns,
+        }
+
+collapser = None
+if koemyd.conf.settings.collapsed_forwarding:
+    collapser = Collapser()
+
+    koemyd.metrics.registry.stats("koemyd_collapser", lambda: collapser.stats)
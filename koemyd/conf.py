@@ -33,6 +33,7 @@ class Settings(object):
 
         self.__listen_addr = str(koemyd.const.SETTINGS_DEFAULT_LISTEN_ADDR)
         self.__listen_port = int(koemyd.const.SETTINGS_DEFAULT_LISTEN_PORT)
+        self.__engine      = str(koemyd.const.SETTINGS_DEFAULT_ENGINE)
 
         try:
             self.__setup()
@@ -43,6 +44,88 @@ class Settings(object):
         self.listen_addr = self.__kconf["daemon"]["listen_addr"]
         self.listen_port = self.__kconf["daemon"]["listen_port"]
 
+        self.engine = self.__option("engine", koemyd.const.SETTINGS_DEFAULT_ENGINE)
+
+        self.listen_backlog = self.__option("listen_backlog", koemyd.const.SETTINGS_DEFAULT_LISTEN_BACKLOG)
+        self.listen_defer_accept = self.__option("listen_defer_accept", koemyd.const.SETTINGS_DEFAULT_LISTEN_DEFER_ACCEPT)
+        self.listen_fastopen = self.__option("listen_fastopen", koemyd.const.SETTINGS_DEFAULT_LISTEN_FASTOPEN)
+
+        self.tcp_nodelay = self.__option("tcp_nodelay", koemyd.const.SETTINGS_DEFAULT_TCP_NODELAY)
+        self.tcp_quickack = self.__option("tcp_quickack", koemyd.const.SETTINGS_DEFAULT_TCP_QUICKACK)
+        self.tcp_fastopen = self.__option("tcp_fastopen", koemyd.const.SETTINGS_DEFAULT_TCP_FASTOPEN)
+        self.tcp_keepidle = self.__option("tcp_keepidle", koemyd.const.SETTINGS_DEFAULT_TCP_KEEPIDLE)
+        self.tcp_keepintvl = self.__option("tcp_keepintvl", koemyd.const.SETTINGS_DEFAULT_TCP_KEEPINTVL)
+        self.tcp_keepcnt = self.__option("tcp_keepcnt", koemyd.const.SETTINGS_DEFAULT_TCP_KEEPCNT)
+        self.socket_rcvbuf = self.__option("socket_rcvbuf", koemyd.const.SETTINGS_DEFAULT_SOCKET_RCVBUF)
+        self.socket_sndbuf = self.__option("socket_sndbuf", koemyd.const.SETTINGS_DEFAULT_SOCKET_SNDBUF)
+
+        self.pool_max_idle = self.__option("pool_max_idle", koemyd.const.SETTINGS_DEFAULT_POOL_MAX_IDLE)
+        self.pool_max_idle_per_host = self.__option("pool_max_idle_per_host", koemyd.const.SETTINGS_DEFAULT_POOL_MAX_IDLE_PER_HOST)
+        self.pool_idle_timeout = self.__option("pool_idle_timeout", koemyd.const.SETTINGS_DEFAULT_POOL_IDLE_TIMEOUT)
+
+        self.socket_bufsize = self.__option("socket_bufsize", koemyd.const.SETTINGS_DEFAULT_SOCKET_BUFSIZE)
+        self.relay_buffer_size = self.__option("relay_buffer_size", koemyd.const.SETTINGS_DEFAULT_RELAY_BUFFER_SIZE)
+        self.relay_high_water = self.__option("relay_high_water", koemyd.const.SETTINGS_DEFAULT_RELAY_HIGH_WATER)
+        self.relay_low_water = self.__option("relay_low_water", koemyd.const.SETTINGS_DEFAULT_RELAY_LOW_WATER)
+
+        self.chunk_passthrough = self.__option("chunk_passthrough", koemyd.const.SETTINGS_DEFAULT_CHUNK_PASSTHROUGH)
+        self.preconnect = self.__option("preconnect", koemyd.const.SETTINGS_DEFAULT_PRECONNECT)
+
+        self.resolver_max_entries = self.__option("resolver_max_entries", koemyd.const.SETTINGS_DEFAULT_RESOLVER_MAX_ENTRIES)
+        self.resolver_ttl = self.__option("resolver_ttl", koemyd.const.SETTINGS_DEFAULT_RESOLVER_TTL)
+        self.resolver_negative_ttl = self.__option("resolver_negative_ttl", koemyd.const.SETTINGS_DEFAULT_RESOLVER_NEGATIVE_TTL)
+
+        self.cache = self.__option("cache", koemyd.const.SETTINGS_DEFAULT_CACHE)
+        self.cache_max_bytes = self.__option("cache_max_bytes", koemyd.const.SETTINGS_DEFAULT_CACHE_MAX_BYTES)
+        self.cache_max_object_size = self.__option("cache_max_object_size", koemyd.const.SETTINGS_DEFAULT_CACHE_MAX_OBJECT_SIZE)
+        self.cache_disk_path = self.__option("cache_disk_path", koemyd.const.SETTINGS_DEFAULT_CACHE_DISK_PATH)
+        self.cache_disk_max_bytes = self.__option("cache_disk_max_bytes", koemyd.const.SETTINGS_DEFAULT_CACHE_DISK_MAX_BYTES)
+
+        self.collapsed_forwarding = self.__option("collapsed_forwarding", koemyd.const.SETTINGS_DEFAULT_COLLAPSED_FORWARDING)
+
+        self.handler_pool_size = self.__option("handler_pool_size", koemyd.const.SETTINGS_DEFAULT_HANDLER_POOL_SIZE)
+        self.accept_queue_size = self.__option("accept_queue_size", koemyd.const.SETTINGS_DEFAULT_ACCEPT_QUEUE_SIZE)
+        self.accept_queue_timeout = self.__option("accept_queue_timeout", koemyd.const.SETTINGS_DEFAULT_ACCEPT_QUEUE_TIMEOUT)
+
+        self.keepalive_max_requests = self.__option("keepalive_max_requests", koemyd.const.SETTINGS_DEFAULT_KEEPALIVE_MAX_REQUESTS)
+        self.keepalive_timeout = self.__option("keepalive_timeout", koemyd.const.SETTINGS_DEFAULT_KEEPALIVE_TIMEOUT)
+
+        self.header_timeout = self.__option("header_timeout", koemyd.const.SETTINGS_DEFAULT_HEADER_TIMEOUT)
+        self.connect_timeout = self.__option("connect_timeout", koemyd.const.SETTINGS_DEFAULT_CONNECT_TIMEOUT)
+        self.idle_timeout = self.__option("idle_timeout", koemyd.const.SETTINGS_DEFAULT_IDLE_TIMEOUT)
+        self.lifetime_timeout = self.__option("lifetime_timeout", koemyd.const.SETTINGS_DEFAULT_LIFETIME_TIMEOUT)
+
+        self.client_rate_limit = self.__option("client_rate_limit", koemyd.const.SETTINGS_DEFAULT_CLIENT_RATE_LIMIT)
+        self.server_rate_limit = self.__option("server_rate_limit", koemyd.const.SETTINGS_DEFAULT_SERVER_RATE_LIMIT)
+        self.global_rate_limit = self.__option("global_rate_limit", koemyd.const.SETTINGS_DEFAULT_GLOBAL_RATE_LIMIT)
+
+        self.breaker_threshold = self.__option("breaker_threshold", koemyd.const.SETTINGS_DEFAULT_BREAKER_THRESHOLD)
+        self.breaker_cooldown = self.__option("breaker_cooldown", koemyd.const.SETTINGS_DEFAULT_BREAKER_COOLDOWN)
+
+        self.admin_addr = self.__option("admin_addr", koemyd.const.SETTINGS_DEFAULT_ADMIN_ADDR)
+        self.admin_port = self.__option("admin_port", koemyd.const.SETTINGS_DEFAULT_ADMIN_PORT)
+
+    def __option(self, k, default, s="daemon"):
+        return self.__kconf[s].get(k) or default # i.e., optional
+
+    def __number(self, k, value, minimum=0, maximum=None, cast=int, s="daemon"):
+        try:
+            value = cast(value)
+        except ValueError:
+            koemyd.logger.crit("config", "%s:%s:%s:non-numeric value" % (s, k, value))
+
+        if value < minimum or (maximum is not None and value > maximum):
+            koemyd.logger.crit("config", "%s:%s:%s:value out of range" % (s, k, value))
+
+        return value
+
+    def __boolean(self, k, value, s="daemon"):
+        if value.lower() in koemyd.const.SETTINGS_BOOLEAN_TRUE: return True
+        if value.lower() in koemyd.const.SETTINGS_BOOLEAN_FALSE:
+            return False
+
+        koemyd.logger.crit("config", "%s:%s:%s:not a boolean value" % (s, k, value))
+
     @property
     def listen_addr(self): return self.__listen_addr
 
@@ -76,6 +159,341 @@ class Settings(object):
         else:
             raise kcp.MissingOptionError("%s:missing option value" % "listen_port")
 
+    @property
+    def engine(self): return self.__engine
+
+    @engine.setter
+    def engine(self, value):
+        if value.lower() in koemyd.const.DAEMON_ENGINES:
+            self.__engine = value.lower()
+        else:
+            koemyd.logger.crit("config", "daemon:engine:%s:unknown engine" % value)
+
+    @property
+    def listen_backlog(self): return self.__listen_backlog
+
+    @listen_backlog.setter
+    def listen_backlog(self, value): # i.e., capped by net.core.somaxconn
+        self.__listen_backlog = self.__number("listen_backlog", value, 1)
+
+    @property
+    def listen_defer_accept(self): return self.__listen_defer_accept
+
+    @listen_defer_accept.setter
+    def listen_defer_accept(self, value): # i.e., seconds accept(2) waits for the request to arrive, 0 means off
+        self.__listen_defer_accept = self.__number("listen_defer_accept", value)
+
+    @property
+    def listen_fastopen(self): return self.__listen_fastopen
+
+    @listen_fastopen.setter
+    def listen_fastopen(self, value): # i.e., pending fast open requests, 0 means off
+        self.__listen_fastopen = self.__number("listen_fastopen", value)
+
+    @property
+    def tcp_nodelay(self): return self.__tcp_nodelay
+
+    @tcp_nodelay.setter
+    def tcp_nodelay(self, value): # i.e., no nagle, heads and small bodies go out as they're written
+        self.__tcp_nodelay = self.__boolean("tcp_nodelay", value)
+
+    @property
+    def tcp_quickack(self): return self.__tcp_quickack
+
+    @tcp_quickack.setter
+    def tcp_quickack(self, value):
+        self.__tcp_quickack = self.__boolean("tcp_quickack", value)
+
+    @property
+    def tcp_fastopen(self): return self.__tcp_fastopen
+
+    @tcp_fastopen.setter
+    def tcp_fastopen(self, value): # i.e., upstream, the request head rides on the syn once a cookie is held
+        self.__tcp_fastopen = self.__boolean("tcp_fastopen", value)
+
+    @property
+    def tcp_keepidle(self): return self.__tcp_keepidle
+
+    @tcp_keepidle.setter
+    def tcp_keepidle(self, value): # i.e., seconds, 0 means the system's default
+        self.__tcp_keepidle = self.__number("tcp_keepidle", value, maximum=32767)
+
+    @property
+    def tcp_keepintvl(self): return self.__tcp_keepintvl
+
+    @tcp_keepintvl.setter
+    def tcp_keepintvl(self, value):
+        self.__tcp_keepintvl = self.__number("tcp_keepintvl", value, maximum=32767)
+
+    @property
+    def tcp_keepcnt(self): return self.__tcp_keepcnt
+
+    @tcp_keepcnt.setter
+    def tcp_keepcnt(self, value):
+        self.__tcp_keepcnt = self.__number("tcp_keepcnt", value, maximum=127)
+
+    @property
+    def socket_rcvbuf(self): return self.__socket_rcvbuf
+
+    @socket_rcvbuf.setter
+    def socket_rcvbuf(self, value): # i.e., bytes, 0 leaves it to the kernel's autotuning
+        self.__socket_rcvbuf = self.__number("socket_rcvbuf", value)
+
+    @property
+    def socket_sndbuf(self): return self.__socket_sndbuf
+
+    @socket_sndbuf.setter
+    def socket_sndbuf(self, value):
+        self.__socket_sndbuf = self.__number("socket_sndbuf", value)
+
+    @property
+    def pool_max_idle(self): return self.__pool_max_idle
+
+    @pool_max_idle.setter
+    def pool_max_idle(self, value): self.__pool_max_idle = self.__number("pool_max_idle", value)
+
+    @property
+    def pool_max_idle_per_host(self): return self.__pool_max_idle_per_host
+
+    @pool_max_idle_per_host.setter
+    def pool_max_idle_per_host(self, value):
+        self.__pool_max_idle_per_host = self.__number("pool_max_idle_per_host", value)
+
+    @property
+    def pool_idle_timeout(self): return self.__pool_idle_timeout
+
+    @pool_idle_timeout.setter
+    def pool_idle_timeout(self, value):
+        self.__pool_idle_timeout = self.__number("pool_idle_timeout", value, cast=float)
+
+    @property
+    def socket_bufsize(self):
+        if koemyd.const.DATA_DEBUGGING: return koemyd.const.SOCKET_BUFSIZE
+        return self.__socket_bufsize
+
+    @socket_bufsize.setter
+    def socket_bufsize(self, value):
+        self.__socket_bufsize = self.__number("socket_bufsize", value, 1)
+
+    @property
+    def relay_buffer_size(self): return self.__relay_buffer_size
+
+    @relay_buffer_size.setter
+    def relay_buffer_size(self, value):
+        self.__relay_buffer_size = self.__number("relay_buffer_size", value, 1)
+
+    @property
+    def relay_high_water(self): return self.__relay_high_water
+
+    @relay_high_water.setter
+    def relay_high_water(self, value):
+        value = self.__number("relay_high_water", value, 1)
+        if value > self.__relay_buffer_size:
+            koemyd.logger.warn("config", "daemon:relay_high_water:%d:exceeds relay_buffer_size" % value)
+            value = self.__relay_buffer_size
+        self.__relay_high_water = value
+
+    @property
+    def relay_low_water(self): return self.__relay_low_water # i.e., paused reads resume once drained to it
+
+    @relay_low_water.setter
+    def relay_low_water(self, value):
+        value = self.__number("relay_low_water", value, 0)
+        if value >= self.__relay_high_water:
+            koemyd.logger.warn("config", "daemon:relay_low_water:%d:not below relay_high_water" % value)
+            value = self.__relay_high_water // 2
+        self.__relay_low_water = value
+
+    @property
+    def chunk_passthrough(self): return self.__chunk_passthrough
+
+    @chunk_passthrough.setter
+    def chunk_passthrough(self, value):
+        self.__chunk_passthrough = self.__boolean("chunk_passthrough", value)
+
+    @property
+    def preconnect(self): return self.__preconnect
+
+    @preconnect.setter
+    def preconnect(self, value): # i.e., upstream connect set off as soon as the request line is in
+        self.__preconnect = self.__boolean("preconnect", value)
+
+    @property
+    def resolver_max_entries(self): return self.__resolver_max_entries
+
+    @resolver_max_entries.setter
+    def resolver_max_entries(self, value):
+        self.__resolver_max_entries = self.__number("resolver_max_entries", value)
+
+    @property
+    def resolver_ttl(self): return self.__resolver_ttl
+
+    @resolver_ttl.setter
+    def resolver_ttl(self, value):
+        self.__resolver_ttl = self.__number("resolver_ttl", value, cast=float)
+
+    @property
+    def resolver_negative_ttl(self): return self.__resolver_negative_ttl
+
+    @resolver_negative_ttl.setter
+    def resolver_negative_ttl(self, value):
+        self.__resolver_negative_ttl = self.__number("resolver_negative_ttl", value, cast=float)
+
+    @property
+    def cache(self): return self.__cache
+
+    @cache.setter
+    def cache(self, value): self.__cache = self.__boolean("cache", value)
+
+    @property
+    def cache_max_bytes(self): return self.__cache_max_bytes
+
+    @cache_max_bytes.setter
+    def cache_max_bytes(self, value):
+        self.__cache_max_bytes = self.__number("cache_max_bytes", value, cast=long)
+
+    @property
+    def cache_max_object_size(self): return self.__cache_max_object_size
+
+    @cache_max_object_size.setter
+    def cache_max_object_size(self, value):
+        self.__cache_max_object_size = self.__number("cache_max_object_size", value, cast=long)
+
+    @property
+    def cache_disk_path(self): return self.__cache_disk_path
+
+    @cache_disk_path.setter
+    def cache_disk_path(self, value): self.__cache_disk_path = value.strip() or None
+
+    @property
+    def cache_disk_max_bytes(self): return self.__cache_disk_max_bytes
+
+    @cache_disk_max_bytes.setter
+    def cache_disk_max_bytes(self, value):
+        self.__cache_disk_max_bytes = self.__number("cache_disk_max_bytes", value, cast=long)
+
+    @property
+    def collapsed_forwarding(self): return self.__collapsed_forwarding
+
+    @collapsed_forwarding.setter
+    def collapsed_forwarding(self, value): # i.e., identical concurrent GETs share one upstream fetch
+        self.__collapsed_forwarding = self.__boolean("collapsed_forwarding", value)
+
+    @property
+    def handler_pool_size(self): return self.__handler_pool_size
+
+    @handler_pool_size.setter
+    def handler_pool_size(self, value):
+        self.__handler_pool_size = self.__number("handler_pool_size", value, 1)
+
+    @property
+    def accept_queue_size(self): return self.__accept_queue_size
+
+    @accept_queue_size.setter
+    def accept_queue_size(self, value):
+        self.__accept_queue_size = self.__number("accept_queue_size", value, 1)
+
+    @property
+    def accept_queue_timeout(self): return self.__accept_queue_timeout
+
+    @accept_queue_timeout.setter
+    def accept_queue_timeout(self, value): # i.e., 0 waits for as long as it takes
+        self.__accept_queue_timeout = self.__number("accept_queue_timeout", value, cast=float)
+
+    @property
+    def keepalive_max_requests(self): return self.__keepalive_max_requests
+
+    @keepalive_max_requests.setter
+    def keepalive_max_requests(self, value): # i.e., 0 means unlimited
+        self.__keepalive_max_requests = self.__number("keepalive_max_requests", value)
+
+    @property
+    def keepalive_timeout(self): return self.__keepalive_timeout
+
+    @keepalive_timeout.setter
+    def keepalive_timeout(self, value): # i.e., 0 keeps idle clients for as long as they last
+        self.__keepalive_timeout = self.__number("keepalive_timeout", value, cast=float)
+
+    @property
+    def header_timeout(self): return self.__header_timeout
+
+    @header_timeout.setter
+    def header_timeout(self, value): # i.e., the whole request head, 0 waits for as long as it takes
+        self.__header_timeout = self.__number("header_timeout", value, cast=float)
+
+    @property
+    def connect_timeout(self): return self.__connect_timeout
+
+    @connect_timeout.setter
+    def connect_timeout(self, value): # i.e., name lookup included
+        self.__connect_timeout = self.__number("connect_timeout", value, cast=float)
+
+    @property
+    def idle_timeout(self): return self.__idle_timeout
+
+    @idle_timeout.setter
+    def idle_timeout(self, value): # i.e., without any progress, either way
+        self.__idle_timeout = self.__number("idle_timeout", value, cast=float)
+
+    @property
+    def lifetime_timeout(self): return self.__lifetime_timeout
+
+    @lifetime_timeout.setter
+    def lifetime_timeout(self, value): # i.e., 0 means unlimited
+        self.__lifetime_timeout = self.__number("lifetime_timeout", value, cast=float)
+
+    @property
+    def client_rate_limit(self): return self.__client_rate_limit
+
+    @client_rate_limit.setter
+    def client_rate_limit(self, value): # i.e., bytes per second, per client address, 0 means unlimited
+        self.__client_rate_limit = self.__number("client_rate_limit", value)
+
+    @property
+    def server_rate_limit(self): return self.__server_rate_limit
+
+    @server_rate_limit.setter
+    def server_rate_limit(self, value): # i.e., per upstream host
+        self.__server_rate_limit = self.__number("server_rate_limit", value)
+
+    @property
+    def global_rate_limit(self): return self.__global_rate_limit
+
+    @global_rate_limit.setter
+    def global_rate_limit(self, value): # i.e., all of them together
+        self.__global_rate_limit = self.__number("global_rate_limit", value)
+
+    @property
+    def breaker_threshold(self): return self.__breaker_threshold
+
+    @breaker_threshold.setter
+    def breaker_threshold(self, value): # i.e., consecutive upstream failures, 0 means never open
+        self.__breaker_threshold = self.__number("breaker_threshold", value)
+
+    @property
+    def breaker_cooldown(self): return self.__breaker_cooldown
+
+    @breaker_cooldown.setter
+    def breaker_cooldown(self, value): # i.e., seconds failing fast before a probe is let through
+        self.__breaker_cooldown = self.__number("breaker_cooldown", value, cast=float)
+
+    @property
+    def admin_addr(self): return self.__admin_addr
+
+    @admin_addr.setter
+    def admin_addr(self, value):
+        try:
+            self.__admin_addr = socket.inet_ntoa(socket.inet_aton(value))
+        except socket.error:
+            koemyd.logger.crit("config", "daemon:admin_addr:%s is a not a valid ip address" % value)
+
+    @property
+    def admin_port(self): return self.__admin_port
+
+    @admin_port.setter
+    def admin_port(self, value): # i.e., 0 disables the admin listener
+        self.__admin_port = self.__number("admin_port", value, maximum=65535)
+
     @property
     def listen_address(self): return (self.__listen_addr, self.__listen_port)
 
@@ -11,16 +11,106 @@ SETTINGS_PROGRAM_CONFIG_FILE = "koemyd.conf"
 
 SETTINGS_DEFAULT_LISTEN_ADDR = "0.0.0.0"
 SETTINGS_DEFAULT_LISTEN_PORT = "11811"
+SETTINGS_DEFAULT_ENGINE      = "threaded"
 
-DAEMON_MAX_CONCURRENCY = 128
+SETTINGS_DEFAULT_LISTEN_BACKLOG      = "128"
+SETTINGS_DEFAULT_LISTEN_DEFER_ACCEPT = "0"
+SETTINGS_DEFAULT_LISTEN_FASTOPEN     = "0"
+
+SETTINGS_DEFAULT_TCP_NODELAY   = "yes"
+SETTINGS_DEFAULT_TCP_QUICKACK  = "no"
+SETTINGS_DEFAULT_TCP_FASTOPEN  = "no"
+SETTINGS_DEFAULT_TCP_KEEPIDLE  = "0"
+SETTINGS_DEFAULT_TCP_KEEPINTVL = "0"
+SETTINGS_DEFAULT_TCP_KEEPCNT   = "0"
+SETTINGS_DEFAULT_SOCKET_RCVBUF = "0"
+SETTINGS_DEFAULT_SOCKET_SNDBUF = "0"
+
+SETTINGS_DEFAULT_POOL_MAX_IDLE          = "256"
+SETTINGS_DEFAULT_POOL_MAX_IDLE_PER_HOST = "8"
+SETTINGS_DEFAULT_POOL_IDLE_TIMEOUT      = "60"
+
+SETTINGS_DEFAULT_SOCKET_BUFSIZE    = "16384"
+SETTINGS_DEFAULT_RELAY_BUFFER_SIZE = "65536"
+SETTINGS_DEFAULT_RELAY_HIGH_WATER  = "49152"
+SETTINGS_DEFAULT_RELAY_LOW_WATER   = "16384"
+
+SETTINGS_DEFAULT_CHUNK_PASSTHROUGH = "yes"
+SETTINGS_DEFAULT_PRECONNECT        = "yes"
+
+SETTINGS_DEFAULT_RESOLVER_MAX_ENTRIES = "1024"
+SETTINGS_DEFAULT_RESOLVER_TTL         = "60"
+SETTINGS_DEFAULT_RESOLVER_NEGATIVE_TTL = "5"
+
+SETTINGS_DEFAULT_CACHE                 = "no"
+SETTINGS_DEFAULT_CACHE_MAX_BYTES       = "67108864"
+SETTINGS_DEFAULT_CACHE_MAX_OBJECT_SIZE = "1048576"
+SETTINGS_DEFAULT_CACHE_DISK_PATH       = ""
+SETTINGS_DEFAULT_CACHE_DISK_MAX_BYTES  = "1073741824"
+
+SETTINGS_DEFAULT_COLLAPSED_FORWARDING = "no"
+
+SETTINGS_DEFAULT_HANDLER_POOL_SIZE    = "128"
+SETTINGS_DEFAULT_ACCEPT_QUEUE_SIZE    = "256"
+SETTINGS_DEFAULT_ACCEPT_QUEUE_TIMEOUT = "5"
+
+SETTINGS_DEFAULT_KEEPALIVE_MAX_REQUESTS = "1000"
+SETTINGS_DEFAULT_KEEPALIVE_TIMEOUT      = "30"
+
+SETTINGS_DEFAULT_HEADER_TIMEOUT   = "30"
+SETTINGS_DEFAULT_CONNECT_TIMEOUT  = "30"
+SETTINGS_DEFAULT_IDLE_TIMEOUT     = "30"
+SETTINGS_DEFAULT_LIFETIME_TIMEOUT = "0"
+
+SETTINGS_DEFAULT_CLIENT_RATE_LIMIT = "0"
+SETTINGS_DEFAULT_SERVER_RATE_LIMIT = "0"
+SETTINGS_DEFAULT_GLOBAL_RATE_LIMIT = "0"
+
+SETTINGS_DEFAULT_BREAKER_THRESHOLD = "5"
+SETTINGS_DEFAULT_BREAKER_COOLDOWN  = "10"
+
+SETTINGS_DEFAULT_ADMIN_ADDR = "127.0.0.1"
+SETTINGS_DEFAULT_ADMIN_PORT = "11812"
+
+SETTINGS_BOOLEAN_TRUE  = ["yes", "on", "true", "1"]
+SETTINGS_BOOLEAN_FALSE = ["no", "off", "false", "0"]
+
+DAEMON_ENGINES = ["threaded", "reactor"]
+
+DAEMON_RESPAWN_DELAY = 1.0
+
+DISPATCHER_REAP_INTERVAL = 0.1
+
+REACTOR_MAX_CONCURRENCY = 16384
+REACTOR_RESOLVER_THREADS = 4 # i.e., resolver cache misses looked up at once, off the loop
+
+BREAKER_MAX_CIRCUITS = 4096 # i.e., closed ones beyond it are forgotten, then the ones open the longest
+
+TIMING_RESOLUTION   = 0.1 # i.e., seconds per tick
+TIMING_WHEEL_BITS   = 6   # i.e., 64 slots per level
+TIMING_WHEEL_LEVELS = 4   # i.e., up to 2^24 ticks, ~19 days, further ones are cascaded back
+
+SHAPING_BURST     = 0.25   # i.e., seconds worth of rate a bucket holds
+SHAPING_QUANTUM   = 0x1000 # i.e., bytes, no reads smaller than it while throttled
+SHAPING_MIN_DELAY = 0.005
 
 DATA_DEBUGGING = 0 # >.<
 
+LOGGER_QUEUE_SIZE     = 0x10000
+LOGGER_BATCH_SIZE     = 0x400
+LOGGER_FLUSH_INTERVAL = 0.1
+
 SOCKET_BUFSIZE = 4096 if not DATA_DEBUGGING else 16
-SOCKET_TIMEOUT = 30.0 if not DATA_DEBUGGING else 60
+
+SPLICE_PIPE_SIZE = 0x10000
+
+ERROR_REPLY_LINGER = 2.0 # i.e., seconds an error reply is given to go out before the connection is closed
 
 HTTP_CRLF = CRLF = "\r\n"
 
+HTTP_MAX_HEAD_LENGTH = 0x10000
+HTTP_MAX_LINE_LENGTH = 0x4000
+
 HTTP_METHODS_ALLOWED = [        # cf. [RFC2616] & [RFC7230]
     "CONNECT",
     "OPTIONS", "GET", "POST",
@@ -34,6 +124,39 @@ HTTP_HEADERS_SKIP_TO_SERVER = [ # cf. [RFC2616] & [RFC7230]
 HTTP_HEADERS_SKIP_TO_CLIENT = [ # cf. [RFC2616] & [RFC7230]
     "Proxy-Authenticate", "Keep-Alive",
 ]
+HTTP_HEADERS_SKIP_TO_SERVER_KEYS = frozenset(map(str.lower, HTTP_HEADERS_SKIP_TO_SERVER))
+HTTP_HEADERS_SKIP_TO_CLIENT_KEYS = frozenset(map(str.lower, HTTP_HEADERS_SKIP_TO_CLIENT))
+
+METRICS_BUCKETS = [ # i.e., seconds
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+]
+METRICS_PARSE_BUCKETS = [0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.01]
+
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4"
+METRICS_ADMIN_TIMEOUT = 5.0
+
+CACHE_STATUS_CODES = [200, 203, 300, 301, 404, 410] # cf. Section 6.1 of [RFC7231]
+CACHE_HEURISTIC_STATUS_CODES = CACHE_STATUS_CODES
+CACHE_HEURISTIC_MAX_LIFETIME = 86400
+
+CACHE_BYPASS_REQUEST_HEADERS = [ # i.e., conditional or partial, answered by the origin
+    "If-None-Match", "If-Modified-Since", "If-Match", "If-Unmodified-Since",
+    "If-Range", "Range",
+]
+
+CACHE_HEADERS_SKIP = [ # koemyd.caching, i.e., hop-by-hop or per response
+    "Connection", "Keep-Alive", "Proxy-Connection",
+    "Proxy-Authenticate", "TE", "Trailers", "Upgrade",
+    "Age",
+]
+CACHE_HEADERS_SKIP_KEYS = frozenset(map(str.lower, CACHE_HEADERS_SKIP))
+CACHE_HEADERS_SKIP_ON_FRESHEN_KEYS = CACHE_HEADERS_SKIP_KEYS | frozenset(["content-length", "transfer-encoding"])
+
+COLLAPSING_HEADERS_SKIP_KEYS = HTTP_HEADERS_SKIP_TO_CLIENT_KEYS | frozenset(["connection"]) # i.e., per client
+COLLAPSING_MAX_LAG = 0x1000000 # i.e., bytes a follower may fall behind the fastest before it's cut off
+COLLAPSING_TRIM_SIZE = 0x10000 # i.e., what every follower took is dropped in pieces no smaller than it
+
 HTTP_HEADERS_SORT_PRIO_KEYS = [ # koemyd.struct.HTTPHeaders
     "Host", "Connection",
     "Proxy-Connection",
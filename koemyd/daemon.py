@@ -1,40 +1,84 @@
 # vi:ts=4:sw=4:syn=python
 
+import os
 import sys
+import time
+import errno
 
+import signal
 import socket
-import thread
-import threading
+import traceback
 
+import koemyd.base
 import koemyd.conf
 import koemyd.const
 import koemyd.logger
-import koemyd.handler
-import koemyd.fetching
+import koemyd.metrics
+import koemyd.tuning
+import koemyd.reactor
+import koemyd.dispatching
+
+SO_REUSEPORT = getattr(socket, "SO_REUSEPORT", 15 if sys.platform.startswith("linux") else None)
+
+def has_reuse_port():
+    if SO_REUSEPORT is None: return False
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+    except socket.error:
+        return False
+    finally:
+        sock.close()
+
+    return True
+
+def bind(reuse_port=False, backlog=None):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port: sock.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+
+    koemyd.tuning.profile.tune_listener(sock) # i.e., fast open has to be in before listen(2)
+
+    if backlog is None: backlog = koemyd.conf.settings.listen_backlog
+
+    try:
+        sock.bind(koemyd.conf.settings.listen_address)
+        if backlog: sock.listen(backlog)
+    except socket.error as (_, m):
+        koemyd.logger.crit("daemon", "could not bind to %(addr)s:%(port)d (%(desc)s)" % {
+            "addr" : koemyd.conf.settings.listen_addr,
+            "port" : koemyd.conf.settings.listen_port,
+            "desc" : m.lower()
+        })
+
+    return sock
 
 class Server(object):
-    def __init__(self):
-        self.__sock   = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.__sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    def __init__(self, sock=None, reuse_port=False, w_id=None):
+        self.__sock = sock
+        self.__reuse_port = reuse_port
+        self.__w_id = w_id
+
+    def __serve_threaded(self):
+        dispatcher = koemyd.dispatching.dispatcher
+        dispatcher.start()
+
+        while True:
+            client_sock, client_address = self.__sock.accept()
+            koemyd.metrics.accepts.inc()
+
+            dispatcher.dispatch(koemyd.tuning.profile.tune_client(client_sock))
+
+    def __serve_reactor(self):
+        reactor = koemyd.reactor.Reactor(self.__sock)
+        reactor.serve_forever()
 
     def __serve_forever(self):
         try:
-            while True:
-                client_sock, client_address = self.__sock.accept()
-                if threading.active_count() <= koemyd.const.DAEMON_MAX_CONCURRENCY:
-                    try:
-                        link = koemyd.fetching.Connection(client_sock)
-                        handler = koemyd.handler.Handler(link)
-                        handler.daemon = True
-                        handler.start()
-                    except thread.error:
-                        koemyd.logger.oops("daemon", "exception caught when creating new thread")
-                        client_sock.shutdown(socket.SHUT_RDWR)
-                        client_sock.close()
-                else:
-                    koemyd.logger.warn("daemon", "maximum number of clients exceeded")
-                    client_sock.shutdown(socket.SHUT_RDWR)
-                    client_sock.close()
+            if koemyd.conf.settings.engine == "reactor": self.__serve_reactor()
+            else:
+                self.__serve_threaded()
         except KeyboardInterrupt:
             sys.stderr.write(koemyd.const.HTTP_CRLF)
             self.__sock.shutdown(socket.SHUT_RDWR)
@@ -45,17 +89,110 @@ class Server(object):
     def start(self):
         koemyd.logger.info("daemon", "%s:%s" % (koemyd.const.PROGRAM_NAME, koemyd.const.PROGRAM_DESC))
 
-        try:
-            self.__sock.bind(koemyd.conf.settings.listen_address)
-            self.__sock.listen(max(128, socket.SOMAXCONN))
-            self.address = self.__sock.getsockname()
-        except socket.error as (_, m):
-            koemyd.logger.crit("daemon", "could not bind to %(addr)s:%(port)d (%(desc)s)" % {
-                "addr" : koemyd.conf.settings.listen_addr,
-                "port" : koemyd.conf.settings.listen_port,
-                "desc" : m.lower()
-            })
+        if not self.__sock: self.__sock = bind(self.__reuse_port)
+        else:
+            koemyd.tuning.profile.tune_listener(self.__sock) # i.e., handed in already listening, which linux still takes
+
+        self.address = self.__sock.getsockname()
 
         koemyd.logger.info("daemon", "proxy is now listening on http://%s:%d" % self.address)
+        koemyd.logger.info("daemon", "engine:%s" % koemyd.conf.settings.engine)
+
+        koemyd.tuning.profile.report(self.__sock, koemyd.conf.settings.listen_backlog)
+
+        koemyd.metrics.serve(self.__w_id - 1 if self.__w_id else 0) # i.e., one admin port per worker
 
         self.__serve_forever()
+
+class Supervisor(object):
+    def __init__(self, workers):
+        self.__workers = workers
+        self.__pids = dict() # i.e., pid -> (worker id, spawn time)
+        self.__is_stopping = False
+
+    def __spawn(self, w_id):
+        koemyd.logger.flush() # i.e., or the child inherits the queued records
+
+        pid = os.fork()
+        if pid:
+            self.__pids[pid] = (w_id, time.time())
+            return
+
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        signal.signal(signal.SIGTERM, self.__interrupt)
+
+        koemyd.logger.restart()
+        koemyd.logger.tag("w#%d" % w_id)
+
+        koemyd.base.reseed()
+
+        ex_code = 0
+        try:
+            if self.__reuse_port:
+                self.__sock.close()
+                Server(reuse_port=True, w_id=w_id).start()
+            else:
+                Server(self.__sock, w_id=w_id).start()
+        except SystemExit as e:
+            ex_code = e.code or 0
+        except:
+            traceback.print_exc()
+            ex_code = 1
+        finally:
+            koemyd.logger.flush()
+            os._exit(ex_code)
+
+    def __interrupt(self, signum, frame):
+        raise KeyboardInterrupt
+
+    def __stop(self, signum, frame):
+        self.__is_stopping = True
+        for pid in self.__pids.keys():
+            try: os.kill(pid, signal.SIGTERM)
+            except OSError: pass
+
+    def __supervise(self):
+        while self.__pids:
+            try:
+                pid, status = os.wait()
+            except OSError as e:
+                if e.errno == errno.EINTR: continue
+                break
+
+            if pid not in self.__pids: continue
+
+            w_id, spawned_at = self.__pids.pop(pid)
+            if self.__is_stopping: continue
+
+            if os.WIFSIGNALED(status): cause = "killed by signal %d" % os.WTERMSIG(status)
+            else:
+                cause = "exited with status %d" % os.WEXITSTATUS(status)
+
+            koemyd.logger.oops("daemon", "w#%d:pid#%d:worker %s, restarting" % (w_id, pid, cause))
+
+            # i.e., don't spin when a worker dies right away, e.g., on bind
+            if time.time() - spawned_at < koemyd.const.DAEMON_RESPAWN_DELAY:
+                time.sleep(koemyd.const.DAEMON_RESPAWN_DELAY)
+
+            if not self.__is_stopping: self.__spawn(w_id)
+
+        self.__sock.close()
+
+    def start(self):
+        koemyd.logger.info("daemon", "%s:%s" % (koemyd.const.PROGRAM_NAME, koemyd.const.PROGRAM_DESC))
+
+        # i.e., a reuseport socket only joins the accept group once it
+        # listens, the supervisor just holds the address for its workers
+        self.__reuse_port = has_reuse_port()
+        self.__sock = bind(self.__reuse_port, backlog=0 if self.__reuse_port else None)
+
+        koemyd.logger.info("daemon", "supervising %d workers on http://%s:%d (%s)" % (
+            (self.__workers,) + self.__sock.getsockname() + ("so_reuseport" if self.__reuse_port else "shared socket",)
+        ))
+
+        signal.signal(signal.SIGINT, self.__stop)
+        signal.signal(signal.SIGTERM, self.__stop)
+
+        for w_id in xrange(1, self.__workers + 1): self.__spawn(w_id)
+
+        self.__supervise()
@@ -0,0 +1,227 @@
+# vi:ts=4:sw=4:syn=python
+
+import time
+import errno
+import select
+import socket
+import thread
+import threading
+import traceback
+import collections
+
+import koemyd.conf
+import koemyd.const
+import koemyd.logger
+import koemyd.timing
+import koemyd.metrics
+import koemyd.handler
+import koemyd.fetching
+
+class AcceptQueue(object):
+    def __init__(self, max_size, timeout):
+        self.max_size = max_size
+        self.timeout = timeout
+
+        self.__queue = collections.deque() # (time queued, client sock, None), oldest first
+        self.__resumed = collections.deque() # (time queued, None, handler)
+        self.__cond = threading.Condition(threading.Lock())
+
+    def __len__(self): return len(self.__queue) + len(self.__resumed)
+
+    def put(self, sock):
+        with self.__cond:
+            if len(self.__queue) >= self.max_size: return False
+
+            self.__queue.append((time.time(), sock, None))
+            self.__cond.notify()
+
+        return True
+
+    def resume(self, handler): # i.e., never refused, the client was already served
+        with self.__cond:
+            self.__resumed.append((time.time(), None, handler))
+            self.__cond.notify()
+
+    def get(self):
+        with self.__cond:
+            while not (self.__resumed or self.__queue): self.__cond.wait()
+
+            if self.__resumed: return self.__resumed.popleft()
+            return self.__queue.popleft()
+
+    def expire(self, now):
+        expired = []
+        with self.__cond:
+            while self.__queue and now - self.__queue[0][0] > self.timeout:
+                expired.append(self.__queue.popleft())
+
+        return expired
+
+class IdleWatcher(object): # i.e., idle keep-alive clients, without a thread each
+    def __init__(self, queue, timeout):
+        self.queue = queue
+        self.timeout = timeout
+
+        self.__lock = threading.Lock()
+        self.__parked = dict() # fd: (handler, its keep-alive timer)
+        self.__poll = None
+
+        self.resumed = self.expired = 0
+
+    def start(self):
+        self.__poll = select.epoll()
+
+        watcher = threading.Thread(target=self.__watch_forever, name="watcher")
+        watcher.daemon = True
+        watcher.start()
+
+    def park(self, handler):
+        with self.__lock: # i.e., held until it's in, events wait for it
+            try:
+                fd = handler.fileno()
+                self.__poll.register(fd, select.EPOLLIN | select.EPOLLONESHOT)
+            except (IOError, socket.error):
+                fd = None
+            else:
+                timer = koemyd.timing.wheel.schedule(self.timeout, self.__expire, fd, handler) if self.timeout else None
+                self.__parked[fd] = (handler, timer)
+
+        if fd is None: handler.close()
+
+    def __unregister(self, fd):
+        try: self.__poll.unregister(fd)
+        except (IOError, ValueError): pass
+
+    def __watch_forever(self):
+        while True:
+            try:
+                events = self.__poll.poll()
+            except IOError as e:
+                if e.errno == errno.EINTR: continue
+                raise
+
+            for fd, _ in events: # i.e., readable, or hung up, either way the handler sees to it
+                with self.__lock:
+                    parked = self.__parked.pop(fd, None)
+                    if parked: self.__unregister(fd)
+
+                if parked:
+                    handler, timer = parked
+                    if timer: koemyd.timing.wheel.cancel(timer)
+
+                    self.resumed += 1
+                    self.queue.resume(handler)
+
+    def __expire(self, fd, handler): # i.e., from the ticker
+        with self.__lock:
+            if not self.__parked.get(fd, (None,))[0] is handler: return # i.e., resumed meanwhile
+
+            del self.__parked[fd]
+            self.__unregister(fd)
+
+        self.expired += 1
+        koemyd.metrics.timeouts.labels("keepalive").inc()
+        koemyd.logger.info("c#%s", "keep-alive:idle timeout", handler.uuid)
+        handler.close()
+
+    @property
+    def stats(self): return {"parked": len(self.__parked), "resumed": self.resumed, "expired": self.expired}
+
+class Dispatcher(object):
+    def __init__(self, size, queue_size, queue_timeout, keepalive_timeout):
+        self.size = size
+        self.queue = AcceptQueue(queue_size, queue_timeout)
+        self.watcher = IdleWatcher(self.queue, keepalive_timeout)
+
+        self.__lock = threading.Lock()
+        self.__workers = []
+
+        self.busy = 0
+
+    def start(self): # i.e., once per process, threads don't survive fork(2)
+        for w_id in xrange(self.size):
+            worker = threading.Thread(target=self.__work, name="handler#%d" % w_id)
+            worker.daemon = True
+            try:
+                worker.start()
+            except thread.error:
+                koemyd.logger.oops("dispatcher", "could only start %d out of %d handler threads", len(self.__workers), self.size)
+                break
+
+            self.__workers.append(worker)
+
+        self.watcher.start()
+
+        koemyd.timing.wheel.start()
+
+        if self.queue.timeout:
+            reaper = threading.Thread(target=self.__reap_forever, name="reaper")
+            reaper.daemon = True
+            reaper.start()
+
+        koemyd.logger.info("dispatcher", "%d handler threads, accept queue of %d (%s)",
+            len(self.__workers), self.queue.max_size,
+            "%gs wait" % self.queue.timeout if self.queue.timeout else "no wait limit",
+        )
+
+    def dispatch(self, sock):
+        if not self.queue.put(sock):
+            self.__reject(sock, "queue_full", "accept queue full")
+
+    def __reject(self, sock, reason, message):
+        koemyd.metrics.rejections.labels(reason).inc()
+
+        try:
+            sock.setblocking(0)
+            sock.recv(koemyd.const.HTTP_MAX_HEAD_LENGTH) # i.e., or close(2) resets and the reply gets lost
+        except socket.error: pass
+
+        link = koemyd.fetching.Connection(sock)
+        link.error(503, message)
+        link.close()
+
+    def __reap_forever(self): # i.e., while every handler is busy, nobody else looks at the queue
+        while True:
+            time.sleep(min(koemyd.const.DISPATCHER_REAP_INTERVAL, self.queue.timeout))
+
+            for time_queued, sock, _ in self.queue.expire(time.time()):
+                koemyd.metrics.accept_queue_wait_seconds.observe(time.time() - time_queued)
+                self.__reject(sock, "queue_timeout", "accept queue wait exceeded")
+
+    def __work(self):
+        while True:
+            time_queued, sock, handler = self.queue.get()
+
+            if handler is None:
+                waited = time.time() - time_queued
+                koemyd.metrics.accept_queue_wait_seconds.observe(waited)
+
+                if self.queue.timeout and waited > self.queue.timeout:
+                    self.__reject(sock, "queue_timeout", "accept queue wait exceeded")
+                    continue
+
+            with self.__lock: self.busy += 1
+            try:
+                if handler is None: handler = koemyd.handler.Handler(koemyd.fetching.Connection(sock))
+                if handler.run(): self.watcher.park(handler)
+            except Exception: # i.e., never lose a worker
+                koemyd.logger.oops("dispatcher", "%s", traceback.format_exc())
+            finally:
+                with self.__lock: self.busy -= 1
+
+    @property
+    def stats(self):
+        return {
+            "size": len(self.__workers), "busy": self.busy,
+            "queued": len(self.queue), "queue_max": self.queue.max_size,
+        }
+
+dispatcher = Dispatcher(
+    koemyd.conf.settings.handler_pool_size,
+    koemyd.conf.settings.accept_queue_size,
+    koemyd.conf.settings.accept_queue_timeout,
+    koemyd.conf.settings.keepalive_timeout,
+)
+
+koemyd.metrics.registry.stats("koemyd_handler_pool", lambda: dispatcher.stats)
+koemyd.metrics.registry.stats("koemyd_keepalive", lambda: dispatcher.watcher.stats)
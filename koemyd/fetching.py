@@ -1,235 +1,577 @@
 # vi:ts=4:sw=4:syn=python
 
+import os
 import time
 import errno
 import socket
 import select
 import httplib
+import threading
+import collections
 
 import koemyd.base
+import koemyd.conf
 import koemyd.util
 import koemyd.const
 import koemyd.trans
 import koemyd.struct
 import koemyd.logger
+import koemyd.timing
+import koemyd.tuning
+import koemyd.metrics
+import koemyd.shaping
+import koemyd.splicing
+import koemyd.gathering
+import koemyd.messaging
 
 class Connection(koemyd.base.UUIDObject):
+    __slots__ = ("deadlines", "client", "server", "flow", "__rings_cache")
+
     RELAY_PERM_S_RX_C_TX = 0x118E0006
     RELAY_PERM_C_RX_S_TX = 0x7E440009
 
+    DEADLINES_REPLYABLE = ["header", "connect", "response"] # i.e., nothing sent to the client yet
+
     def __init__(self, client_sock, server_sock=None):
         super(Connection, self).__init__()
 
-        self.client = ConnectionSocket(self, client_sock)
-        self.server = ConnectionSocket(self, server_sock)
+        self.deadlines = koemyd.timing.Deadlines(koemyd.timing.wheel, self.__expire,
+                                                 koemyd.conf.settings.lifetime_timeout)
+
+        self.client = ConnectionSocket(self, client_sock, "client")
+        self.server = ConnectionSocket(self, server_sock, "server")
+
+        self.flow = koemyd.shaping.shaper.flow(self.client.peer_address[0] if self.client.peer_address else None)
+
+        self.__rings_cache = None
+
+    def __expire(self, deadline): # i.e., from the ticker, whatever the handler is blocked on returns
+        koemyd.metrics.timeouts.labels(deadline).inc()
+
+        self.client.abort(socket.SHUT_RD if deadline in self.DEADLINES_REPLYABLE else socket.SHUT_RDWR)
+        self.server.abort(socket.SHUT_RDWR)
+
+    def check_deadlines(self, what):
+        if self.deadlines.expired:
+            raise ConnectionTimeoutError("%s:%s timeout" % (what, self.deadlines.expired))
+
+    def send(self, sock, buffers, what): # i.e., heads, a peer gone meanwhile is DisconnectedPeerError
+        try:
+            sock.sendv(buffers)
+        except socket.error:
+            self.check_deadlines(what)
+            raise DisconnectedPeerError("%s:disconnected" % what)
 
     def relay(self, size=None, perms=[RELAY_PERM_S_RX_C_TX, RELAY_PERM_C_RX_S_TX]):
-        bytes_sent_to_client = 0
-        bytes_sent_to_server = 0
+        directions = [] # i.e., [(rx, tx), ...]
+        if self.RELAY_PERM_S_RX_C_TX in perms: directions.append((self.server, self.client))
+        if self.RELAY_PERM_C_RX_S_TX in perms: directions.append((self.client, self.server))
+
+        bufsize = koemyd.conf.settings.socket_bufsize
+        high_water = koemyd.conf.settings.relay_high_water
+        low_water = koemyd.conf.settings.relay_low_water
+
+        rings = self.__rings()
+        bytes_sent = {self.client: 0, self.server: 0}
+        held = set() # i.e., rx sides whose ring filled up, until drained to low water
+
+        is_eof = False
 
-        time_last_op = time.time()
         self.client.setblocking(0)
         self.server.setblocking(0)
-        while (time.time() - time_last_op) < koemyd.const.SOCKET_TIMEOUT:
-            rsocks, wsocks, xsocks = [], [], []
-
-            if self.RELAY_PERM_S_RX_C_TX in perms:
-                if len(self.server.cache) < koemyd.const.SOCKET_BUFSIZE:
-                    rsocks.append(self.server)
-                if self.server.cache:
-                    wsocks.append(self.client)
-
-            if self.RELAY_PERM_C_RX_S_TX in perms:
-                if len(self.client.cache) < koemyd.const.SOCKET_BUFSIZE:
-                    rsocks.append(self.client)
-                if self.client.cache:
-                    wsocks.append(self.server)
-
-            rx, tx, _ = select.select(rsocks, wsocks, xsocks, koemyd.const.SOCKET_TIMEOUT)
-
-            if rx or tx: time_last_op = time.time()
-
-            if rx:
-                if self.server in rx:
-                    data = self.server.rx(koemyd.const.SOCKET_BUFSIZE)
-                    if data:
-                        self.server.cache += data
-                    else:
-                        break
+        try:
+            while True:
+                rsocks, wsocks = [], []
+                allowed, timeout = {}, None
+
+                for s_rx, s_tx in directions:
+                    ring = rings[s_rx]
+
+                    left = (size - bytes_sent[s_tx] - len(ring)) if size is not None else ring.free
+                    if s_rx.cache and left > 0:
+                        n = ring.write(s_rx.cache[:left])
+                        del s_rx.cache[:n]
+                        left -= n
+
+                    if len(ring) >= high_water:
+                        if s_rx not in held: s_tx.tx_backpressure.inc()
+                        held.add(s_rx)
+                    elif len(ring) <= low_water:
+                        held.discard(s_rx)
+
+                    if not is_eof and not s_rx.cache and left > 0 and s_rx not in held:
+                        allowed[s_rx] = self.flow.allowance(bufsize)
+                        if allowed[s_rx]: rsocks.append(s_rx)
+                        else:
+                            timeout = self.flow.delay() # i.e., throttled, held back rather than buffered
+                    if ring:
+                        wsocks.append(s_tx)
 
-                if self.client in rx:
-                    data = self.client.rx(koemyd.const.SOCKET_BUFSIZE)
-                    if data:
-                        self.client.cache += data
-                    else:
-                        break
+                if not (rsocks or wsocks or timeout): break
 
-            if tx:
-                if self.server in tx:
-                    if size:
-                        bytes_queued =(size-bytes_sent_to_server)
-                        if len(self.client.cache) > bytes_queued:
-                            b = self.server.tx(self.client.cache[:bytes_queued])
-                            self.client.cache = self.client.cache[bytes_queued:]
-                        else:
-                            b = self.server.tx(self.client.cache)
-                            self.client.cache = bytearray()
-                    else:
-                        b = self.server.tx(self.client.cache)
-                        self.client.cache = bytearray()
+                rx, tx = koemyd.util.wait(rsocks, wsocks, timeout)
 
-                    bytes_sent_to_server += b
+                self.check_deadlines("relay")
+                self.deadlines.time_last_op = time.time()
 
-                if size and bytes_sent_to_server >= size: break
+                for s_rx, s_tx in directions:
+                    ring = rings[s_rx]
 
-                if self.client in tx:
-                    if size:
-                        bytes_queued =(size-bytes_sent_to_client)
-                        if len(self.server.cache) > bytes_queued:
-                            b = self.client.tx(self.server.cache[:bytes_queued])
-                            self.server.cache = self.server.cache[bytes_queued:]
+                    if s_rx in rx:
+                        left = (size - bytes_sent[s_tx] - len(ring)) if size is not None else bufsize
+                        n = s_rx.rx_into(ring, min(allowed[s_rx], left))
+                        if n == 0: is_eof = True
                         else:
-                            b = self.client.tx(self.server.cache)
-                            self.server.cache = bytearray()
-                    else:
-                        b = self.client.tx(self.server.cache)
-                        self.server.cache = bytearray()
+                            self.flow.consume(n)
+
+                    if s_tx in tx:
+                        left = (size - bytes_sent[s_tx]) if size is not None else len(ring)
+                        b = s_tx.tx_from(ring, left)
+                        if b is None: return # i.e., broken pipe
+                        bytes_sent[s_tx] += b
+
+                if size is not None and all(bytes_sent[s_tx] >= size for _, s_tx in directions): break
+        finally:
+            for s_rx, ring in rings.items():
+                if ring: s_rx.cache[:0] = ring.read()
+
+            self.__log_relay_stats(bytes_sent[self.server], bytes_sent[self.client])
 
-                    bytes_sent_to_client += b
+    def __rings(self):
+        if not self.__rings_cache:
+            self.__rings_cache = {
+                self.client: RingBuffer(koemyd.conf.settings.relay_buffer_size),
+                self.server: RingBuffer(koemyd.conf.settings.relay_buffer_size),
+            }
 
-                if size and bytes_sent_to_client >= size: break
+        return self.__rings_cache
 
+    def shrink(self): # i.e., left idle, rings are only worth their memory while relaying
+        self.__rings_cache = None
+
+    def __log_relay_stats(self, bytes_sent_to_server, bytes_sent_to_client):
         if bytes_sent_to_server:
-            koemyd.logger.data("c#%s" % self.uuid,
-                               "s#%s->s#%s:relay:stat:bytes_sent:%d" % (
-                                    self.server.uuid, self.client.uuid,
-                                    bytes_sent_to_server
-                                ))
+            koemyd.logger.data("c#%s", "s#%s->s#%s:relay:stat:bytes_sent:%d",
+                               self.uuid, self.server.uuid, self.client.uuid,
+                               bytes_sent_to_server)
 
         if bytes_sent_to_client:
-            koemyd.logger.data("c#%s" % self.uuid,
-                               "s#%s->s#%s:relay:stat:bytes_sent:%d" % (
-                                    self.client.uuid, self.server.uuid,
-                                    bytes_sent_to_client
-                                ))
+            koemyd.logger.data("c#%s", "s#%s->s#%s:relay:stat:bytes_sent:%d",
+                               self.uuid, self.client.uuid, self.server.uuid,
+                               bytes_sent_to_client)
+
+    def tunnel(self):
+        if not (koemyd.splicing.is_available and self.relay_spliced()):
+            self.relay()
+
+    def relay_spliced(self):
+        for s_rx, s_tx in [(self.client, self.server), (self.server, self.client)]:
+            if s_rx.cache:
+                s_tx.sendall(str(s_rx.cache))
+                s_rx.cache = bytearray()
+
+        peers = {self.client: self.server, self.server: self.client}
+        pipes = {} # rx side: pipe of its bytes in flight
+        for s in peers: pipes[s] = koemyd.splicing.Pipe(koemyd.const.SPLICE_PIPE_SIZE)
+        bytes_sent = {self.client: 0, self.server: 0}
+        sockets = dict((s.fileno(), s) for s in peers)
+
+        eof = set() # i.e., rx sides done, each half-closed on to its peer once its pipe drains
+        is_relaying = False # i.e., bytes moved, too late to fall back to relay()
+
+        self.client.setblocking(0)
+        self.server.setblocking(0)
+        try:
+            while True:
+                masks = {self.client: 0, self.server: 0}
+                allowed, timeout = {}, None
+                for s, pipe in pipes.items():
+                    if s not in eof and not pipe.is_full and pipe.queued < pipe.size:
+                        allowed[s] = self.flow.allowance(pipe.size - pipe.queued)
+                        if allowed[s]: masks[s] |= select.POLLIN
+                        else:
+                            timeout = self.flow.delay() * 1000 # i.e., throttled
+                    if pipe.queued:
+                        masks[peers[s]] |= select.POLLOUT
+                    elif s in eof and not pipe.is_shut:
+                        pipe.is_shut = True
+                        try: peers[s].shutdown(socket.SHUT_WR)
+                        except socket.error: pass
+
+                if len(eof) == len(pipes) and not any(p.queued for p in pipes.values()): break
+
+                p = select.poll()
+                for s, m in masks.items():
+                    if m: p.register(s.fileno(), m)
+
+                events = p.poll(timeout)
+
+                self.check_deadlines("tunnel")
+                self.deadlines.time_last_op = time.time()
+
+                for fd, ev in events:
+                    s = sockets[fd]
+
+                    pipe = pipes[s]
+                    if s not in eof and masks[s] & select.POLLIN and ev & (select.POLLIN | select.POLLHUP | select.POLLERR):
+                        n = self.__splice(s.fileno(), pipe.w, allowed[s], is_relaying)
+                        if n is None: return False
+                        if n > 0:
+                            is_relaying = True
+                            pipe.queued += n
+                            s.rx_bytes.inc(n)
+                            self.flow.consume(n)
+                        elif n == 0:
+                            eof.add(s)
+                        elif pipe.queued:
+                            pipe.is_full = True # i.e., out of slots, small segments take one each
+
+                    pipe = pipes[peers[s]]
+                    if pipe.queued and ev & select.POLLOUT:
+                        n = self.__splice(pipe.r, s.fileno(), pipe.queued, is_relaying)
+                        if n is None: return False
+                        if n > 0:
+                            is_relaying = True
+                            pipe.queued -= n
+                            pipe.is_full = False
+                            bytes_sent[s] += n
+                            s.tx_bytes.inc(n)
+                        s.tx_calls.inc()
+        except OSError as e:
+            if e.errno not in [errno.ECONNRESET, errno.EPIPE]:
+                raise ConnectionSocketError("tunnel:splice:%s" % e.strerror.lower())
+        finally:
+            for pipe in pipes.values(): pipe.close()
+
+        self.__log_relay_stats(bytes_sent[self.server], bytes_sent[self.client])
+
+        return True
+
+    @staticmethod
+    def __splice(fd_in, fd_out, size, is_relaying): # i.e., -1 would block, 0 is EOF, None means unsupported
+        try:
+            return koemyd.splicing.splice(fd_in, fd_out, size)
+        except OSError as e:
+            if e.errno in [errno.EAGAIN, errno.EINTR]: return -1
+            if e.errno in [errno.EINVAL, errno.ENOSYS] and not is_relaying:
+                return None # i.e., unsupported, fallback to relay()
+            raise
+
+    def relay_encoded(self, coder, perm=RELAY_PERM_S_RX_C_TX): # i.e., a ChunkScanner either way, a coder server to client only
+        if isinstance(coder, koemyd.trans.ChunkScanner):
+            if perm == self.RELAY_PERM_C_RX_S_TX: return self.__relay_scanned(coder, self.client, self.server)
+            return self.__relay_scanned(coder, self.server, self.client)
 
-    def relay_encoded(self, coder):
         self.server.setblocking(0)
-        _time_last_op = time.time()
-        while coder.keep_feeding:
-            if (time.time() - _time_last_op) < koemyd.const.SOCKET_TIMEOUT:
-                r, _, _ = select.select([self.server], [], [], koemyd.const.SOCKET_TIMEOUT)
-
-                if self.server in r:
-                    try: 
-                         coder.feed(self.server.rx(koemyd.const.SOCKET_BUFSIZE))
-                    except koemyd.trans.ChunksCodedException:
-                        for c in coder.flush():
-                            koemyd.logger.data("c#%s" % self.uuid,
-                                               "s#%s->s#%s:relay_encoded:chunk(%s,%s)" % (
-                                                  self.server.uuid, self.client.uuid,
-                                                  "%X" % c.size, koemyd.util.dump(c.data) or "--"
-                                               ))
-
-                            self.client.tx(koemyd.const.HTTP_CRLF.join(["%X" % c.size, c.data]))
-                            self.client.tx(koemyd.const.HTTP_CRLF)
+        self.client.setblocking(0)
+        while coder.keep_feeding or self.client.tx_queue:
+            rsocks, wsocks, timeout = [], [], None
+
+            if coder.keep_feeding and not self.client.tx_queue.is_full: # i.e., a slow client holds the server back
+                size = self.flow.allowance(koemyd.conf.settings.socket_bufsize)
+                if size: rsocks.append(self.server)
+                else:
+                    timeout = self.flow.delay() # i.e., throttled
+            if self.client.tx_queue:
+                wsocks.append(self.client)
+
+            if rsocks and self.server.cache: r, w = rsocks, []
             else:
-                raise ConnectionTimeoutError("encoded:connection timeout")
+                r, w = koemyd.util.wait(rsocks, wsocks, timeout)
+                self.check_deadlines("encoded")
+
+            if self.client in w:
+                if self.client.flush() is None:
+                    raise DisconnectedPeerError("encoded:tx:disconnected")
+                self.deadlines.time_last_op = time.time()
+
+            if self.server in r:
+                data = self.server.rx(size)
+                if data: self.deadlines.time_last_op = time.time()
+                self.flow.consume(len(data))
+
+                try: 
+                     coder.feed(data)
+                except koemyd.trans.ChunksCodedException:
+                    frames = []
+                    for c in coder.flush():
+                        koemyd.logger.data("c#%s", "s#%s->s#%s:relay_encoded:chunk(%X,%s)",
+                                           self.uuid, self.server.uuid, self.client.uuid,
+                                           c.size, koemyd.util.HexDump(c.data, "--"))
+
+                        frames += ["%X%s" % (c.size, koemyd.const.HTTP_CRLF), c.data, koemyd.const.HTTP_CRLF]
+
+                    self.client.queue(frames) # i.e., last-chunk included, its empty trailer is the closing CRLF
         self.server.setblocking(1)
-
-        self.client.tx(koemyd.const.HTTP_CRLF)
+        self.client.setblocking(1)
 
         self.server.cache += coder.cache
 
         if not self.server.is_tainted: 
             self.server.readline()
 
+    def __relay_scanned(self, scanner, s_rx, s_tx):
+        bytes_sent = 0
+
+        s_rx.setblocking(0)
+        s_tx.setblocking(1)
+        while scanner.keep_feeding:
+            if s_rx.cache:
+                data = str(s_rx.cache)
+                s_rx.cache = bytearray()
+            else:
+                size = self.flow.allowance(koemyd.conf.settings.socket_bufsize)
+                if not size:
+                    time.sleep(self.flow.delay()) # i.e., throttled
+                    continue
+
+                koemyd.util.wait([s_rx], [])
+                self.check_deadlines("encoded:rx")
+
+                data = s_rx.rx(size)
+                if not data:
+                    raise DisconnectedPeerError("encoded:rx:disconnected")
+
+                self.deadlines.time_last_op = time.time()
+                self.flow.consume(len(data))
+
+            n = scanner.feed(data)
+            if n < len(data): s_rx.cache += data[n:] # i.e., not ours, e.g., a pipelined request
+
+            try:
+                s_tx.sendall(buffer(data, 0, n))
+            except socket.error:
+                self.check_deadlines("encoded:tx")
+                raise DisconnectedPeerError("encoded:tx:disconnected")
+
+            bytes_sent += n
+        s_rx.setblocking(1)
+
+        if s_tx is self.client: self.__log_relay_stats(0, bytes_sent)
+        else:
+            self.__log_relay_stats(bytes_sent, 0)
+
     def error(self, code, message=None, do_relay_http_error=True):
-        code_description = httplib.responses[code]
-        if not message: message = code_description
+        if not message: message = httplib.responses[code]
 
-        koemyd.logger.oops("c#%s" % self.uuid, "e#%04d:%s" % (code, message.lower()))
+        koemyd.logger.oops("c#%s", "e#%04d:%s", self.uuid, code, message.lower())
 
         if do_relay_http_error:
-            body  = code_description.title()
-            body += koemyd.const.HTTP_CRLF * 2 + message.lower()
-            body += koemyd.const.HTTP_CRLF * 2 + "! c#%s:e#%04d" % (self.uuid, code)
-
             try:
                 self.client.setblocking(0)
-                self.client.tx(koemyd.const.HTTP_CRLF.join([
-                    "HTTP/1.1 %d %s" % (code, code_description),
-                    "%s: %s" % ("Content-Type","text/plain"),
-                    "%s: %d" % ("Content-Length", len(body)),
-                    "%s: %s" % ("Connection", "close"),
-                    koemyd.const.HTTP_CRLF
-                ]) + body)
+                self.client.queue([str(koemyd.messaging.ErrorResponse(code, message, self.uuid))])
+                self.client.drain(koemyd.const.ERROR_REPLY_LINGER)
             except socket.error as e:
                 pass
 
     def close(self):
+        self.deadlines.close()
+        self.flow.close()
+
         self.server.close()
         self.client.close()
 
 class ConnectionError(Exception): pass
 
 class ConnectionSocket(koemyd.base.UUIDObject):
-    def __init__(self, link, __sock=None):
+    __slots__ = ("__link", "__sock", "__address", "__peer_address", "__head_parser", "__is_ahead", "__connect_error",
+                 "rx_bytes", "tx_bytes", "tx_calls", "tx_backpressure", "tx_queue",
+                 "cache", "is_tainted", "tee", "tee_through", "is_gone")
+
+    def __init__(self, link, __sock=None, peer="server"):
         self.__link = link
         self.setup(__sock)
 
+        self.rx_bytes = koemyd.metrics.bytes_received.labels(peer)
+        self.tx_bytes = koemyd.metrics.bytes_sent.labels(peer)
+        self.tx_calls = koemyd.metrics.send_syscalls.labels(peer)
+        self.tx_backpressure = koemyd.metrics.backpressure.labels(peer)
+
         self.__peer_address = None
         try:
             self.__peer_address = self.__sock.getpeername()
-            koemyd.logger.info("c#%s:s#%s" % (self.__link.uuid, self.uuid),
-                               "p#%s:%d:connection established"
-                               % self.__peer_address)
+            koemyd.logger.info("c#%s:s#%s", "p#%s:%d:connection established",
+                               self.__link.uuid, self.uuid, *self.__peer_address)
         except socket.error: pass
 
     def setup(self, sock=None):
         super(ConnectionSocket, self).__init__()
-        self.__sock = sock if sock else socket.socket()
-        self.__sock.settimeout(koemyd.const.SOCKET_TIMEOUT)
+        self.__peer_address = self.__address = None
+        self.__sock = sock if sock else koemyd.tuning.profile.tune_upstream(socket.socket())
+        self.__sock.setblocking(1) # i.e., deadlines are kept by koemyd.timing, not per socket
         self.__sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
         self.__sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
 
         self.cache = bytearray()
+        self.__head_parser = koemyd.struct.HTTPHeadParser()
+
+        self.tx_queue = OutputQueue(koemyd.conf.settings.relay_high_water, koemyd.conf.settings.relay_low_water)
 
         self.is_tainted = False
 
+        self.tee = None # i.e., callable, receives every byte sent
+        self.tee_through = None # i.e., callable, True while the tee wants what a gone peer can't take
+        self.is_gone = False
+
+        self.__is_ahead = False
+        self.__connect_error = None
+
     def __getattr__(self, item): return getattr(self.__sock, item)
 
+    @property
+    def peer_address(self): return self.__peer_address
+
     def connect(self, address):
-        koemyd.logger.info("c#%s:s#%s" % (self.__link.uuid, self.uuid), "p#%s:%d:connecting..." % address)
+        if self.__is_ahead:
+            if address == self.__address: return self.__join(address)
+            self.cancel()
+
+        koemyd.logger.info("c#%s:s#%s", "p#%s:%d:connecting...", self.__link.uuid, self.uuid, *address)
+
+        if not address == self.__address: self.release()
+
+        breaker.check(address)
+
+        if not type(self.__peer_address) == tuple:
+            sock = pool.checkout(address)
+            if sock: return self.__reuse(address, sock)
+
+        self.__address = address
+
+        sock_address = self.__resolve(address)
+
+        self.__link.check_deadlines("p#%s:%d:could not connect" % address) # i.e., went off while resolving
+
+        time_started = time.time()
+        try:
+            self.__sock.connect(sock_address)
+        except socket.error as e:
+            if e.errno not in [errno.EISCONN]: self.__connect_failed(address, e)
+
+        koemyd.metrics.connect_seconds.observe(time.time() - time_started)
+
+        self.__established()
+
+    def preconnect(self, address): # i.e., set off ahead, connect() picks it up, or cancel() drops it
+        if self.__address: return
+
+        koemyd.logger.info("c#%s:s#%s", "p#%s:%d:connecting ahead...", self.__link.uuid, self.uuid, *address)
+
+        self.__is_ahead = True
+
+        try:
+            breaker.check(address)
+        except ConnectionSocketError as e:
+            self.__address, self.__connect_error = address, e
+            return
+
+        sock = pool.checkout(address)
+        if sock: return self.__reuse(address, sock)
+
+        self.__address = address
+
+        try:
+            sock_address = self.__resolve(address)
+        except ConnectionSocketError as e:
+            self.__connect_error = e # i.e., reported once the head is in, if still wanted
+            return
+
+        self.__sock.setblocking(0)
+        e_n = self.__sock.connect_ex(sock_address)
+        self.__sock.setblocking(1)
+
+        if e_n not in [0, errno.EINPROGRESS]:
+            self.__connect_error = socket.error(e_n, os.strerror(e_n))
+
+    def __join(self, address):
+        koemyd.metrics.preconnects.labels("used").inc()
+
+        self.__is_ahead = False
+        if type(self.__peer_address) == tuple: return # i.e., reused
+
+        if isinstance(self.__connect_error, ConnectionSocketError): raise self.__connect_error
+
+        time_joined = time.time()
+
+        e = self.__connect_error
+        if not e:
+            koemyd.util.wait([self.__sock], [self.__sock]) # i.e., readable too, on an abort
+
+            e_n = self.__sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if e_n: e = socket.error(e_n, os.strerror(e_n))
+
+        if e: self.__connect_failed(address, e)
+
+        self.__link.check_deadlines("p#%s:%d:could not connect" % address)
+
+        koemyd.metrics.connect_seconds.observe(time.time() - time_joined) # i.e., what is left of it
+
+        self.__established()
+
+    def __reuse(self, address, sock):
+        is_ahead = self.__is_ahead
 
-        if not address == self.__peer_address: self.reset()
+        self.setup(sock)
+        self.__address = address
+        self.__peer_address = self.__sock.getpeername()
+        self.__is_ahead = is_ahead
 
+        koemyd.logger.info("c#%s:s#%s", "p#%s:%d:connection reused",
+                           self.__link.uuid, self.uuid, *self.__peer_address)
+
+    def __resolve(self, address):
         try:
-            self.__sock.connect(address)
-        except socket.timeout:
-            raise ConnectionSocketError("%s:could not connect (connection timeout)" % ("p#%s:%d" % address))
-        except socket.error as (e_n, m):
-            if e_n not in [errno.EISCONN]:
-                raise ConnectionSocketError("%s:could not connect (%s)" % ("p#%s:%d" % address, m))
+            return resolver.resolve(address)
+        except socket.error as e:
+            koemyd.metrics.connect_failures.labels("resolve").inc()
+            raise ConnectionSocketError("%s:could not resolve (%s)" % ("p#%s:%d" % address, str(e.strerror).lower()))
+
+    def __connect_failed(self, address, e):
+        breaker.failure(address, bool(self.__link.deadlines.expired))
+
+        if self.__link.deadlines.expired:
+            koemyd.metrics.connect_failures.labels("timeout").inc()
+            self.__link.check_deadlines("p#%s:%d:could not connect" % address)
+
+        koemyd.metrics.connect_failures.labels(koemyd.metrics.connect_error_class(e)).inc()
+        raise ConnectionSocketError("%s:could not connect (%s)" % ("p#%s:%d" % address, e.strerror))
+
+    def __established(self):
+        self.__peer_address = self.__sock.getpeername()
+
+        koemyd.logger.info("c#%s:s#%s", "p#%s:%d:connection established",
+                           self.__link.uuid, self.uuid, *self.__peer_address)
 
-        self.__peer_address = peer_address = self.__sock.getpeername()
+    def cancel(self): # i.e., set off ahead, but the request never made it, or was served otherwise
+        if not self.__is_ahead: return
 
-        koemyd.logger.info("c#%s:s#%s" % (self.__link.uuid, self.uuid),
-                           "p#%s:%d:connection established"
-                           % self.__peer_address)
+        koemyd.metrics.preconnects.labels("cancelled").inc()
+        self.release()
 
     def rx(self, size):
+        if not self.cache and not koemyd.const.DATA_DEBUGGING:
+            try: d = self.__sock.recv(size)
+            except socket.error as e:
+                return str()
+
+            self.rx_bytes.inc(len(d))
+            return d
+
         d = bytearray()
 
         if self.cache:
             d += self.cache[:size]
-            self.cache = bytearray()
+            del self.cache[:size]
+
+            koemyd.logger.data("c#%s:s#%s", "cr:%s", self.__link.uuid, self.uuid, koemyd.util.HexDump(d))
 
-            koemyd.logger.data("c#%s:s#%s" % (self.__link.uuid, self.uuid), "cr:%s" % koemyd.util.dump(d))
+            if len(d) == size: return str(d)
 
         if not koemyd.const.DATA_DEBUGGING:
             try:
-                d += self.__sock.recv(size)
+                c = self.__sock.recv(size - len(d))
+                self.rx_bytes.inc(len(c))
+                d += c
             except socket.error as e:
                 if e.errno in [errno.ECONNRESET]:
                     pass
@@ -237,57 +579,163 @@ class ConnectionSocket(koemyd.base.UUIDObject):
             while size > len(d):
                 try:
                     c = self.__sock.recv(min(size - len(d), koemyd.const.SOCKET_BUFSIZE))
+                    self.rx_bytes.inc(len(c))
                     if c: d += c
                     else:
                         break
 
-                    koemyd.logger.data("c#%s:s#%s" % (self.__link.uuid, self.uuid), "rx:%s" % koemyd.util.dump(c))
+                    koemyd.logger.data("c#%s:s#%s", "rx:%s", self.__link.uuid, self.uuid, koemyd.util.HexDump(c))
                 except socket.error as e:
                     if e.errno in [errno.EAGAIN, errno.ECONNRESET]:
                         break
 
         return str(d)
 
-    def tx(self, data):
-        if not koemyd.const.DATA_DEBUGGING:
-            try: return self.__sock.send(data)
-            except socket.error as e:
-                if e.errno in [ errno.EPIPE ]:
-                    return 0
+    def __is_teeing_through(self): return bool(self.tee_through and self.tee_through())
+
+    def __tee_through(self, data): # i.e., the peer is gone, whoever else was fed still is
+        self.is_gone = True
+        self.tee(data)
+        return len(data)
+
+    def queue(self, buffers): # i.e., onto tx_queue, out with flush or drain
+        if self.is_gone and self.__is_teeing_through():
+            for b in buffers: self.__tee_through(str(b))
+            return
+
+        if self.tx_queue.push(buffers): self.tx_backpressure.inc()
+
+    def flush(self): # i.e., one syscall's worth of tx_queue, bytes sent, 0 if it would block, None if the peer is gone
+        q = self.tx_queue
+        if not q: return 0
+
+        try:
+            if koemyd.const.DATA_DEBUGGING:
+                c = q.buffers[0][:koemyd.const.SOCKET_BUFSIZE]
+                n = self.__sock.send(c)
+                koemyd.logger.data("c#%s:s#%s", "tx:%s", self.__link.uuid, self.uuid, koemyd.util.HexDump(str(c)[:n]))
+            elif koemyd.gathering.is_available and q.is_gatherable:
+                n = koemyd.gathering.writev(self.__sock.fileno(), q.buffers)
+            else:
+                n = self.__sock.send(q.buffers[0])
+        except socket.error as e:
+            if e.errno in [errno.EAGAIN, errno.EINTR]: return 0
+            if e.errno in [errno.EPIPE, errno.ECONNRESET]:
+                if self.__is_teeing_through(): return self.__tee_through(q.clear())
+                return None
+
+            raise
+
+        self.tx_bytes.inc(n)
+        self.tx_calls.inc()
+        q.pop(n, self.tee)
+
+        return n
+
+    def drain(self, timeout=None): # i.e., until tx_queue is out, socket.error if the peer went away first
+        time_limit = time.time() + timeout if timeout is not None else None
 
         bytes_sent = 0
-        while bytes_sent < len(data):
-            c = data[bytes_sent:bytes_sent + koemyd.const.SOCKET_BUFSIZE]
+        while self.tx_queue:
+            n = self.flush()
+            if n is None: raise socket.error(errno.EPIPE, os.strerror(errno.EPIPE))
 
-            try:
-                bytes_sent += self.__sock.send(c)
+            bytes_sent += n
+            if not n:
+                wait = time_limit - time.time() if time_limit is not None else None
+                if wait is not None and wait <= 0: break
 
-                koemyd.logger.data("c#%s:s#%s" % (self.__link.uuid, self.uuid), "tx:%s" % koemyd.util.dump(c))
-            except socket.error as e:
-                if e.errno in [errno.EPIPE]:
-                    pass
+                koemyd.util.wait([], [self.__sock], wait)
 
         return bytes_sent
 
-    def readline(self, max_line_length=0x4000):
+    def rx_into(self, ring, size):
+        try:
+            n = ring.recv_into(self.__sock, size)
+            self.rx_bytes.inc(n)
+            return n
+        except socket.error as e:
+            if e.errno in [errno.EAGAIN, errno.EINTR]: return None
+            if e.errno in [errno.ECONNRESET]:
+                return 0
+
+            raise
+
+    def abort(self, how): # i.e., from another thread, unblocks whatever waits on it
+        try: self.__sock.shutdown(how)
+        except socket.error: pass
+
+    def sendall(self, data):
+        self.queue([data])
+        return self.drain()
+
+    def sendv(self, buffers): # i.e., heads and chunk frames, gathered into as few syscalls as it takes
+        self.queue(buffers)
+        return self.drain()
+
+    def tx_from(self, ring, size):
+        if self.is_gone: return ring.skip(size, self.tee) if self.__is_teeing_through() else None
+
+        try:
+            n = ring.send(self.__sock, size, self.tee)
+            self.tx_bytes.inc(n)
+            self.tx_calls.inc()
+            return n
+        except socket.error as e:
+            if e.errno in [errno.EAGAIN, errno.EINTR]: return 0
+            if e.errno in [errno.EPIPE, errno.ECONNRESET]:
+                if self.__is_teeing_through():
+                    self.is_gone = True
+                    return ring.skip(size, self.tee)
+                return None
+
+            raise
+
+    def readhead(self, on_line=None): # i.e., on_line(first line), once, if the rest is still on its way
+        while True:
+            lines = self.__head_parser.parse(self.cache)
+            if lines is not None: return lines
+
+            if on_line and "\n" in self.cache:
+                on_line(str(self.cache[:self.cache.find("\n")]).rstrip("\r"))
+                on_line = None
+
+            koemyd.util.wait([self.__sock], [])
+
+            try:
+                c = self.__sock.recv(koemyd.const.SOCKET_BUFSIZE)
+            except socket.error as e:
+                if e.errno in [errno.EAGAIN, errno.EINTR]: continue
+                c = str()
+
+            self.rx_bytes.inc(len(c))
+
+            if c:
+                self.cache += c
+                self.__link.deadlines.time_last_op = time.time()
+            else:
+                self.__link.check_deadlines("p#%s:%d:rx" % self.__peer_address)
+                raise DisconnectedPeerError
+
+    def readline(self, max_line_length=koemyd.const.HTTP_MAX_LINE_LENGTH):
         d = bytearray()
 
         if self.cache:
             d += self.cache
             self.cache = bytearray()
 
-            koemyd.logger.data("c#%s:s#%s" % (self.__link.uuid,self.uuid), "cr:%s" % koemyd.util.dump(d))
+            koemyd.logger.data("c#%s:s#%s", "cr:%s", self.__link.uuid, self.uuid, koemyd.util.HexDump(d))
 
         while not '\n' in d and max_line_length > len(d):
-            r, _, _ = select.select([self.__sock], [], [], koemyd.const.SOCKET_TIMEOUT)
+            koemyd.util.wait([self.__sock], [])
 
-            if self.__sock in r:
-                c = self.rx(koemyd.const.SOCKET_BUFSIZE)
-                if c: d += c
-                else:
-                    raise DisconnectedPeerError
+            c = self.rx(koemyd.const.SOCKET_BUFSIZE)
+            if c:
+                d += c
+                self.__link.deadlines.time_last_op = time.time()
             else:
-                raise ConnectionTimeoutError("p#%s:%d:rx:connection timeout" % self.__peer_address)
+                self.__link.check_deadlines("p#%s:%d:rx" % self.__peer_address)
+                raise DisconnectedPeerError
 
         if not '\n' in d:
             raise ConnectionSocketError("p#%s:%d:rx:maximum length exceeded" % self.__peer_address)
@@ -303,31 +751,462 @@ class ConnectionSocket(koemyd.base.UUIDObject):
 
         self.cache += d[i:]
         if self.cache:
-            koemyd.logger.data("c#%s:s#%s" % (self.__link.uuid, self.uuid),
-                                   "cw:%s" % koemyd.util.dump(self.cache))
+            koemyd.logger.data("c#%s:s#%s", "cw:%s", self.__link.uuid, self.uuid, koemyd.util.HexDump(self.cache))
 
         return str(l)
 
     def close(self):
-        if not type(self.__peer_address) == tuple: return
+        if not type(self.__peer_address) == tuple:
+            self.__sock.close() # i.e., never connected, or fresh after a release
+            return
 
         try:
             self.__sock.shutdown(socket.SHUT_RDWR)
-            self.__sock.close()
         except socket.error as e:
-            if e.errno in [errno.ENOTCONN, errno.EBADF]: return
-            else:
-                raise e
+            if e.errno not in [errno.ENOTCONN, errno.EBADF]: raise e
+        finally:
+            self.__sock.close() # i.e., ENOTCONN too, e.g., a tunnel with both halves shut down already
 
-        koemyd.logger.info("c#%s:s#%s" % (self.__link.uuid, self.uuid),
-                           "p#%s:%d:connection closed"
-                           % self.__peer_address)
+        koemyd.logger.info("c#%s:s#%s", "p#%s:%d:connection closed",
+                           self.__link.uuid, self.uuid, *self.__peer_address)
 
     def reset(self):
         self.close()
         self.setup()
 
+    def release(self):
+        if self.is_tainted or self.cache or not type(self.__peer_address) == tuple:
+            return self.reset()
+
+        if not pool.checkin(self.__address, self.__sock):
+            return self.reset()
+
+        koemyd.logger.info("c#%s:s#%s", "p#%s:%d:connection released",
+                           self.__link.uuid, self.uuid, *self.__peer_address)
+
+        self.setup()
+
 class ConnectionSocketError(ConnectionError): pass
 class ConnectionTimeoutError(ConnectionSocketError): pass
 class DisconnectedPeerError(ConnectionSocketError): pass
 
+class OutputQueue(object): # i.e., what is yet to go out on a socket, whoever fills it holds back from high water down to low water
+    __slots__ = ("high", "low", "buffers", "size", "is_full")
+
+    def __init__(self, high, low):
+        self.high, self.low = high, low
+
+        self.buffers = []
+        self.size = 0
+
+        self.is_full = False
+
+    def __len__(self): return self.size
+
+    @property
+    def is_gatherable(self): return all(type(b) is str for b in self.buffers[:koemyd.gathering.IOV_MAX])
+
+    def push(self, buffers): # i.e., True if it just filled up
+        for b in buffers:
+            if not len(b): continue
+
+            self.buffers.append(b)
+            self.size += len(b)
+
+        if self.is_full or self.size < self.high: return False
+
+        self.is_full = True
+        return True
+
+    def pop(self, n, tee=None): # i.e., n bytes went out, tee sees exactly those
+        self.buffers = koemyd.gathering.advance(self.buffers, n, tee)
+        self.size -= n
+
+        if self.size <= self.low: self.is_full = False
+
+    def clear(self):
+        data = str().join(str(b) for b in self.buffers)
+
+        self.buffers, self.size, self.is_full = [], 0, False
+        return data
+
+class RingBuffer(object):
+    __slots__ = ("size", "__buffer", "__view", "__head", "__length")
+
+    def __init__(self, size):
+        self.size = size
+
+        self.__buffer = bytearray(size)
+        self.__view = memoryview(self.__buffer)
+        self.__head = self.__length = 0
+
+    def __len__(self): return self.__length
+
+    @property
+    def free(self): return self.size - self.__length
+
+    @property
+    def __tail(self): return (self.__head + self.__length) % self.size
+
+    def write(self, data):
+        n = min(len(data), self.free)
+
+        t = self.__tail
+        m = min(n, self.size - t)
+        self.__buffer[t:t + m] = data[:m]
+        self.__buffer[:n - m] = data[m:n] # i.e., wrapped around
+
+        self.__length += n
+        return n
+
+    def read(self):
+        h, n = self.__head, self.__length
+        d = str(self.__buffer[h:h + n]) + str(self.__buffer[:max(0, h + n - self.size)])
+
+        self.__head = self.__length = 0
+        return d
+
+    def recv_into(self, sock, size):
+        t = self.__tail
+        n = sock.recv_into(self.__view[t:t + min(size, self.free, self.size - t)])
+
+        self.__length += n
+        return n
+
+    def send(self, sock, size, tee=None):
+        h = self.__head
+        n = sock.send(self.__view[h:h + min(size, self.__length, self.size - h)])
+        if tee and n: tee(self.__view[h:h + n])
+
+        self.__length -= n
+        self.__head = (h + n) % self.size if self.__length else 0
+        return n
+
+    def skip(self, size, tee=None): # i.e., as send() would, to nowhere
+        h = self.__head
+        n = min(size, self.__length, self.size - h)
+        if tee and n: tee(self.__view[h:h + n])
+
+        self.__length -= n
+        self.__head = (h + n) % self.size if self.__length else 0
+        return n
+
+class ConnectionPool(object):
+    def __init__(self, max_idle, max_idle_per_host, idle_timeout):
+        self.max_idle = max_idle
+        self.max_idle_per_host = max_idle_per_host
+        self.idle_timeout = idle_timeout
+
+        self.__lock = threading.Lock()
+        self.__idle = dict() # (host, port): deque([(time_released, sock), ...])
+        self.__size = 0
+
+        self.hits = self.misses = self.evictions = 0
+
+    def checkout(self, address):
+        with self.__lock:
+            self.__evict(time.time())
+
+            idle = self.__idle.get(address)
+            while idle:
+                _, sock = idle.pop() # i.e., most recently used first
+                self.__size -= 1
+
+                if self.__is_alive(sock):
+                    self.hits += 1
+                    return sock
+
+                self.__discard(sock)
+
+            self.misses += 1
+
+        return None
+
+    def checkin(self, address, sock):
+        if not (self.max_idle and self.max_idle_per_host): return False
+
+        with self.__lock:
+            time_released = time.time()
+            self.__evict(time_released)
+
+            idle = self.__idle.setdefault(address, collections.deque())
+            if len(idle) >= self.max_idle_per_host:
+                self.__discard(idle.popleft()[1])
+                self.__size -= 1
+            elif self.__size >= self.max_idle:
+                oldest = min(self.__idle.values(), key=lambda q: q[0][0] if q else time_released)
+                self.__discard(oldest.popleft()[1])
+                self.__size -= 1
+
+            idle.append((time_released, sock))
+            self.__size += 1
+
+        return True
+
+    def __evict(self, now):
+        for address, idle in self.__idle.items():
+            while idle and (now - idle[0][0]) >= self.idle_timeout:
+                self.__discard(idle.popleft()[1])
+                self.__size -= 1
+
+            if not idle: del self.__idle[address]
+
+    def __discard(self, sock):
+        self.evictions += 1
+
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+            sock.close()
+        except socket.error: pass
+
+    @staticmethod
+    def __is_alive(sock): # an idle socket turning readable means EOF or junk
+        try:
+            p = select.poll()
+            p.register(sock, select.POLLIN)
+            return not p.poll(0)
+        except (select.error, socket.error):
+            return False
+
+    @property
+    def stats(self):
+        return {
+            "hits": self.hits, "misses": self.misses,
+            "evictions": self.evictions, "idle": self.__size,
+        }
+
+class Circuit(object):
+    S_CLOSED    = 0
+    S_OPEN      = 1
+    S_HALF_OPEN = 2
+
+    def __init__(self):
+        self.state = self.S_CLOSED
+        self.failures = 0 # i.e., consecutive
+        self.is_timeout = False # i.e., of the last failure, 504 rather than 502 while open
+        self.time_opened = self.time_probed = None
+
+class CircuitBreaker(object):
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+
+        self.__lock = threading.Lock()
+        self.__circuits = dict() # (host, port): Circuit, while failing
+
+        self.trips = self.rejections = self.probes = 0
+
+    def check(self, address): # i.e., raises while open, lets one probe through once cooled down
+        if not self.__circuits: return
+
+        with self.__lock:
+            circuit = self.__circuits.get(address)
+            if not circuit or circuit.state == Circuit.S_CLOSED: return
+
+            now = time.time()
+            if circuit.state == Circuit.S_OPEN and now - circuit.time_opened >= self.cooldown:
+                self.__set_state(address, circuit, Circuit.S_HALF_OPEN)
+
+            if circuit.state == Circuit.S_HALF_OPEN:
+                if circuit.time_probed is None or now - circuit.time_probed >= self.cooldown:
+                    circuit.time_probed = now # i.e., a probe that never reports back is let go eventually
+                    self.probes += 1
+                    return
+
+            self.rejections += 1
+
+        e = ConnectionTimeoutError if circuit.is_timeout else ConnectionSocketError
+        raise e("p#%s:%d:circuit open (%d consecutive failures)" % (address + (circuit.failures,)))
+
+    def failure(self, address, is_timeout=False):
+        if not self.threshold: return
+
+        with self.__lock:
+            circuit = self.__circuits.get(address)
+            if not circuit:
+                if len(self.__circuits) >= koemyd.const.BREAKER_MAX_CIRCUITS: self.__forget()
+                circuit = self.__circuits[address] = Circuit()
+
+            circuit.failures += 1
+            circuit.is_timeout = is_timeout
+
+            if circuit.state == Circuit.S_HALF_OPEN or (circuit.state == Circuit.S_CLOSED and circuit.failures >= self.threshold):
+                circuit.time_opened = time.time()
+                circuit.time_probed = None
+                self.__set_state(address, circuit, Circuit.S_OPEN)
+
+                self.trips += 1
+                koemyd.metrics.breaker_trips.inc()
+
+                koemyd.logger.warn("breaker", "p#%s:%d:circuit open (%d consecutive failures), for %.1fs",
+                                   address[0], address[1], circuit.failures, self.cooldown)
+
+    def success(self, address):
+        if not address in self.__circuits: return
+
+        with self.__lock:
+            circuit = self.__circuits.pop(address, None)
+            if not circuit or circuit.state == Circuit.S_CLOSED: return
+
+            circuit.state = Circuit.S_CLOSED
+            koemyd.metrics.breaker_state.remove("%s:%d" % address)
+
+        koemyd.logger.info("breaker", "p#%s:%d:circuit closed", *address)
+
+    def __set_state(self, address, circuit, state):
+        circuit.state = state
+        koemyd.metrics.breaker_state.labels("%s:%d" % address).set(state)
+
+    def __forget(self):
+        for address, circuit in self.__circuits.items():
+            if circuit.state == Circuit.S_CLOSED: del self.__circuits[address]
+
+        # i.e., then the ones open the longest, e.g., hosts that never come back, or a client asking for many of them
+        excess = len(self.__circuits) - koemyd.const.BREAKER_MAX_CIRCUITS // 2
+        if excess > 0:
+            for address, _ in sorted(self.__circuits.items(), key=lambda (_, c): c.time_opened)[:excess]:
+                del self.__circuits[address]
+                koemyd.metrics.breaker_state.remove("%s:%d" % address)
+
+    @property
+    def stats(self):
+        states = [c.state for c in self.__circuits.values()]
+        return {
+            "open": states.count(Circuit.S_OPEN), "half_open": states.count(Circuit.S_HALF_OPEN),
+            "trips": self.trips, "rejections": self.rejections, "probes": self.probes,
+        }
+
+class Resolver(object):
+    def __init__(self, max_entries, ttl, negative_ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+
+        self.__lock = threading.Lock()
+        self.__cache = collections.OrderedDict() # (host, port): (time_expires, sock_address | socket.error)
+        self.__lookups = dict() # (host, port): in-flight ResolverLookup
+
+        self.hits = self.misses = self.waits = 0
+        self.lookups = self.failures = 0
+        self.lookup_time = self.lookup_time_max = 0.0
+
+    def resolve(self, address):
+        with self.__lock:
+            entry = self.__cache.pop(address, None)
+            if entry and entry[0] > time.time():
+                self.__cache[address] = entry # i.e., most recently used last
+                self.hits += 1
+                return self.__result(entry[1])
+
+            self.misses += 1
+
+            is_waiting = address in self.__lookups # i.e., one lookup per host at a time
+            if is_waiting:
+                lookup = self.__lookups[address]
+                self.waits += 1
+            else:
+                lookup = self.__lookups[address] = ResolverLookup()
+
+        if is_waiting:
+            if not lookup.wait(koemyd.conf.settings.connect_timeout or None):
+                raise socket.error(errno.ETIMEDOUT, "name resolution timed out")
+            return self.__result(lookup.result)
+
+        return self.__result(self.__lookup(address, lookup))
+
+    def peek(self, address): # i.e., a cached answer or None, never blocks
+        with self.__lock:
+            entry = self.__cache.get(address)
+            if not entry or entry[0] <= time.time(): return None
+
+            self.__cache[address] = self.__cache.pop(address)
+            self.hits += 1
+
+        return self.__result(entry[1])
+
+    def __lookup(self, address, lookup):
+        time_started = time.time()
+        result, ttl = socket.error(errno.EINTR, "name resolution interrupted"), 0
+        try:
+            result = socket.getaddrinfo(address[0], address[1], socket.AF_INET, socket.SOCK_STREAM)[0][4]
+            ttl = self.ttl
+        except socket.error as e:
+            result = e
+            ttl = self.negative_ttl
+        except Exception as e: # e.g., OverflowError, on a port out of range
+            result = socket.error(errno.EINVAL, "name resolution failed (%s)" % e)
+            ttl = self.negative_ttl
+        finally: # i.e., whatever happened, the ones waiting on it are let go
+            time_elapsed = time.time() - time_started
+
+            with self.__lock:
+                self.lookups += 1
+                self.lookup_time += time_elapsed
+                self.lookup_time_max = max(self.lookup_time_max, time_elapsed)
+                if isinstance(result, socket.error): self.failures += 1
+
+                if ttl > 0 and self.max_entries:
+                    self.__cache[address] = (time.time() + ttl, result)
+                    while len(self.__cache) > self.max_entries:
+                        self.__cache.popitem(last=False)
+
+                del self.__lookups[address]
+
+            lookup.set(result)
+
+        koemyd.logger.info("resolver", "p#%s:%d:%s in %.1fms", address[0], address[1],
+                           "lookup failed" if isinstance(result, socket.error) else "resolved",
+                           time_elapsed * 1000)
+
+        return result
+
+    @staticmethod
+    def __result(result):
+        if isinstance(result, socket.error): raise result
+        return result
+
+    @property
+    def stats(self):
+        resolves = self.hits + self.misses
+        return {
+            "hits": self.hits, "misses": self.misses, "waits": self.waits,
+            "hit_rate": float(self.hits) / resolves if resolves else 0.0,
+            "lookups": self.lookups, "failures": self.failures,
+            "lookup_time_avg": self.lookup_time / self.lookups if self.lookups else 0.0,
+            "lookup_time_max": self.lookup_time_max,
+            "entries": len(self.__cache),
+        }
+
+class ResolverLookup(object):
+    def __init__(self):
+        self.result = None
+        self.__done = threading.Event()
+
+    def wait(self, timeout):
+        self.__done.wait(timeout)
+        return self.__done.is_set()
+
+    def set(self, result):
+        self.result = result
+        self.__done.set()
+
+resolver = Resolver(
+    koemyd.conf.settings.resolver_max_entries,
+    koemyd.conf.settings.resolver_ttl,
+    koemyd.conf.settings.resolver_negative_ttl,
+)
+
+pool = ConnectionPool(
+    koemyd.conf.settings.pool_max_idle,
+    koemyd.conf.settings.pool_max_idle_per_host,
+    koemyd.conf.settings.pool_idle_timeout,
+)
+
+breaker = CircuitBreaker(
+    koemyd.conf.settings.breaker_threshold,
+    koemyd.conf.settings.breaker_cooldown,
+)
+
+koemyd.metrics.registry.stats("koemyd_resolver", lambda: resolver.stats)
+koemyd.metrics.registry.stats("koemyd_pool", lambda: pool.stats)
+koemyd.metrics.registry.stats("koemyd_breaker", lambda: breaker.stats)
@@ -0,0 +1,55 @@
+# vi:ts=4:sw=4:syn=python
+
+import os
+import sys
+import socket
+
+import ctypes
+import ctypes.util
+
+IOV_MAX = 1024 # cf. writev(2), linux
+
+class IOVec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_char_p), ("iov_len", ctypes.c_size_t)]
+
+def _bind():
+    if not sys.platform.startswith("linux"): return None
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fn = libc.writev
+    except (OSError, AttributeError):
+        return None
+
+    fn.argtypes = [ctypes.c_int, ctypes.POINTER(IOVec), ctypes.c_int]
+    fn.restype = ctypes.c_ssize_t
+
+    return fn
+
+_writev = _bind()
+
+is_available = _writev is not None
+
+def writev(fd, buffers): # i.e., str buffers, as many of them as one syscall takes
+    buffers = buffers[:IOV_MAX]
+
+    n = _writev(fd, (IOVec * len(buffers))(*[(b, len(b)) for b in buffers]), len(buffers))
+    if n < 0:
+        e_n = ctypes.get_errno()
+        raise socket.error(e_n, os.strerror(e_n))
+
+    return n
+
+def advance(buffers, n, tee=None): # i.e., whatever is left of buffers after n bytes went out
+    i = 0
+    while n and i < len(buffers):
+        b = buffers[i]
+        if n < len(b):
+            if tee: tee(b[:n])
+            return [b[n:]] + buffers[i + 1:]
+
+        if tee: tee(b)
+        n -= len(b)
+        i += 1
+
+    return buffers[i:]
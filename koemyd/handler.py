@@ -3,158 +3,374 @@
 import os
 
 import time
+import socket
 import thread
-import threading
 import traceback
 
+import koemyd.conf
 import koemyd.util
 import koemyd.const
 import koemyd.struct
 import koemyd.logger
+import koemyd.caching
+import koemyd.metrics
 import koemyd.fetching
+import koemyd.collapsing
 import koemyd.messaging
 
-class Handler(threading.Thread):
+class Handler(object):
+    __slots__ = ("__link", "__request", "__requests", "__cached", "__fetch", "__time_parsed", "__time_requested")
+
     def __init__(self, koemyd_connection_link):
         super(self.__class__, self).__init__()
         self.__link = koemyd_connection_link
         self.__request = None
+        self.__requests = 0 # i.e., served on this connection so far
+
+        self.__cached = None # i.e., stale entry under revalidation
+        self.__fetch = None # i.e., collapsed onto this one, koemyd.collapsing
+        self.__time_parsed = self.__time_requested = None
+
+        koemyd.metrics.connections_active.inc()
+
+    @property
+    def uuid(self): return self.__link.uuid
+
+    def fileno(self): return self.__link.client.fileno()
 
     def __parse_client_request(self):
-        line = self.__link.client.readline()
-        while not line.strip(koemyd.const.CRLF):
-            line = self.__link.client.readline()
+        try:
+            lines = self.__link.client.readhead(self.__preconnect if koemyd.conf.settings.preconnect else None)
 
-        self.__request = koemyd.messaging.ClientRequest(line)
+            self.__time_parsed = time.time()
+            self.__request = koemyd.messaging.ClientRequest.parse_head(lines)
+            koemyd.metrics.parse_seconds.observe(time.time() - self.__time_parsed)
+        except Exception:
+            self.__link.server.cancel()
+            raise
 
-        line = self.__link.client.readline()
-        while line.strip(koemyd.const.CRLF):
-            k, v = self.__request.headers.parse(line)
-            line = self.__link.client.readline()
-            self.__request.headers[k] = v
+        self.__requests += 1
+
+        self.__link.flow.route(self.__request.host)
+
+        max_requests = koemyd.conf.settings.keepalive_max_requests
+        if max_requests and self.__requests >= max_requests:
+            self.__request.headers["Connection"] = "close" # i.e., last one on this connection
 
         if not self.__request.is_tunneling:
-            koemyd.logger.info("c#%s" % self.__link.uuid, "s#%s:requested procuration to %s" % (
-                self.__link.client.uuid, self.__request,
-            ))
+            koemyd.logger.info("c#%s", "s#%s:requested procuration to %s",
+                self.__link.uuid, self.__link.client.uuid, self.__request,
+            )
         else:
-            koemyd.logger.info("c#%s" % self.__link.uuid, "s#%s:requested tunnel procuration to %s:%d" % (
-                self.__link.client.uuid, self.__request.host, self.__request.port,
-            ))
+            koemyd.logger.info("c#%s", "s#%s:requested tunnel procuration to %s:%d",
+                self.__link.uuid, self.__link.client.uuid, self.__request.host, self.__request.port,
+            )
+
+    def __preconnect(self, line): # i.e., the request line is in, the rest of the head is not
+        try:
+            address = koemyd.messaging.ClientRequest(line).address
+        except (koemyd.struct.HTTPError, ValueError):
+            return # i.e., left for parse_head to report
+
+        self.__link.server.preconnect(address)
 
     def __setup_server_connect(self):
         self.__link.server.connect(self.__request.address)
 
         if self.__request.is_tunneling:
-            self.__link.client.tx(koemyd.const.HTTP_CRLF.join([
-                "HTTP/1.1 200 Connection established",
-                "Proxy-Agent: %s/%s" % (
-                    koemyd.const.PROGRAM_NAME,
-                    koemyd.const.VERSION
-                ),
-                koemyd.const.HTTP_CRLF
-            ]))
+            koemyd.fetching.breaker.success(self.__request.address)
+
+            self.__link.send(self.__link.client, [
+                "HTTP/1.1 200 Connection established", koemyd.const.HTTP_CRLF,
+                "Proxy-Agent: %s/%s" % (koemyd.const.PROGRAM_NAME, koemyd.const.VERSION), koemyd.const.HTTP_CRLF,
+                koemyd.const.HTTP_CRLF,
+            ], "tunnel:tx")
+
+    def __relay_cached_reply(self):
+        self.__cached = None
+
+        cache = koemyd.caching.cache
+        if not cache or self.__request.is_tunneling: return False
+
+        entry, is_fresh = cache.lookup(self.__request)
+        if entry and is_fresh and self.__relay_cached_entry(entry, "hit"): return True
+
+        if "only-if-cached" in koemyd.caching.parse_cache_control(self.__request.headers):
+            raise koemyd.struct.HTTPRequestError(504, "cache:only-if-cached:miss")
+
+        self.__cached = entry
+
+        return False
+
+    def __relay_cached_entry(self, entry, status): # i.e., no upstream connection involved
+        body = entry.open()
+        if body is None: return False
+
+        now = time.time()
+
+        koemyd.logger.info("c#%s", "s#%s:p#%s:%d:r#%d:cache:%s (age %d)",
+                    self.__link.uuid, self.__link.client.uuid, self.__request.host,
+                    self.__request.port, entry.code,
+                    status, entry.age(now),
+            )
+
+        bufsize = koemyd.conf.settings.relay_buffer_size
+
+        self.__link.deadlines.arm("transfer", koemyd.conf.settings.idle_timeout, True)
+
+        self.__link.client.setblocking(1)
+        try:
+            self.__link.client.sendall(entry.head(self.__request.is_persistent, now))
+
+            i = 0
+            while i < len(body):
+                n = self.__link.flow.wait(min(bufsize, len(body) - i))
+                self.__link.client.sendall(buffer(body, i, n))
+                self.__link.deadlines.time_last_op = time.time()
+                i += n
+        except socket.error:
+            self.__link.check_deadlines("cache:tx")
+            raise koemyd.fetching.DisconnectedPeerError("cache:tx:disconnected")
+        finally:
+            entry.close(body)
+
+        koemyd.caching.cache.served(i)
+
+        return True
+
+    def __relay_collapsed_reply(self):
+        self.__fetch = None
+
+        collapser = koemyd.collapsing.collapser
+        if not collapser or not koemyd.collapsing.is_collapsible(self.__request): return False
+
+        fetch, is_leader = collapser.join(self.__request, self, self.__link.uuid)
+        if is_leader:
+            self.__fetch = fetch
+            return False
+
+        try:
+            if self.__relay_fetched(fetch): return True
+        finally:
+            fetch.leave(self)
+
+        collapser.fallback()
+
+        return False
+
+    def __relay_fetched(self, fetch): # i.e., follower, no upstream connection of its own
+        self.__link.deadlines.arm("response", koemyd.conf.settings.idle_timeout, True)
+
+        head = fetch.wait_head()
+        self.__link.check_deadlines("collapse")
+
+        if head is None or not fetch.matches(self.__request): return False
+
+        koemyd.logger.info("c#%s", "s#%s:p#%s:%d:collapsed onto c#%s",
+                    self.__link.uuid, self.__link.client.uuid, self.__request.host,
+                    self.__request.port, fetch.leader_uuid,
+            )
+
+        bufsize = koemyd.conf.settings.relay_buffer_size
+
+        self.__link.deadlines.arm("transfer", koemyd.conf.settings.idle_timeout, True)
+
+        self.__link.client.setblocking(1)
+        try:
+            self.__link.client.sendv([
+                head,
+                "Connection: %s%s" % ("keep-alive" if self.__request.is_persistent else "close", koemyd.const.CRLF),
+                koemyd.const.CRLF,
+            ])
+
+            while True:
+                data = fetch.read(self, bufsize)
+                if not data: break
+
+                i = 0
+                while i < len(data):
+                    n = self.__link.flow.wait(len(data) - i)
+                    self.__link.client.sendall(buffer(data, i, n))
+                    self.__link.deadlines.time_last_op = time.time()
+                    i += n
+        except socket.error:
+            self.__link.check_deadlines("collapse:tx")
+            raise koemyd.fetching.DisconnectedPeerError("collapse:tx:disconnected")
+
+        return True
 
     def __relay_server_request(self):
-        request = koemyd.messaging.ServerRequest(self.__request.method, self.__request.path)
-        for k, v in self.__request.headers.iteritems():
-            if k.lower() not in map(str.lower, koemyd.const.HTTP_HEADERS_SKIP_TO_SERVER):
-                request.headers[k] = v
+        request = koemyd.messaging.ServerRequest.procure(self.__request)
 
-        request.headers["Host"] = self.__request.host
-        if not self.__request.port == 80: 
-            request.headers["Host"] += ":%d" % self.__request.port
+        if self.__cached: # cf. Section 4.3.1 of [RFC7234]
+            if self.__cached.etag: request.headers["If-None-Match"] = self.__cached.etag
+            if self.__cached.last_modified:
+                request.headers["If-Modified-Since"] = self.__cached.last_modified
 
-        request.headers["Connection"] = "keep-alive"
+        self.__time_requested = time.time()
 
-        self.__link.server.tx(request.line)
-        self.__link.server.tx(koemyd.const.CRLF)
-        for k, v in request.headers.iteritems():
-            self.__link.server.tx("%s: %s" % (k, v))
-            self.__link.server.tx(koemyd.const.CRLF)
+        self.__link.send(self.__link.server, [
+            request.line, koemyd.const.CRLF,
+            request.head, koemyd.const.CRLF,
+        ], "request:tx")
 
-        self.__link.server.tx(koemyd.const.CRLF)
+        if self.__request.is_expecting and self.__request.has_body: # i.e., the origin is there, go ahead
+            self.__link.send(self.__link.client, [
+                "HTTP/1.1 100 Continue", koemyd.const.CRLF,
+                koemyd.const.CRLF,
+            ], "continue:tx")
 
-        if "Content-Length" in self.__request.headers:
+        if self.__request.is_chunked:
+            self.__link.relay_encoded(self.__request.coder, self.__link.RELAY_PERM_C_RX_S_TX)
+        elif "Content-Length" in self.__request.headers:
             self.__link.relay(
                 long(self.__request.headers["Content-Length"]),
                 perms=[self.__link.RELAY_PERM_C_RX_S_TX]
             )
 
     def __relay_server_reply(self):
-        response = koemyd.messaging.ServerResponse(self.__link.server.readline())
-        line = self.__link.server.readline()
-        while line.strip(koemyd.const.CRLF):
-            try:
-                k, v = response.headers.parse(line)
-                response.headers[k] = v
-            except koemyd.struct.HTTPHeaderError as e:
-                e.code = 502
-                raise e
+        try:
+            response = None
+            while not response or response.is_interim: # i.e., 100-continue was answered here already
+                response = koemyd.messaging.ServerResponse.parse_head(
+                    self.__link.server.readhead(),
+                    koemyd.conf.settings.chunk_passthrough
+                )
+        except koemyd.struct.HTTPHeaderError as e:
+            e.code = 502
+            raise e
+        except koemyd.fetching.ConnectionTimeoutError:
+            koemyd.fetching.breaker.failure(self.__request.address, True) # i.e., connects, never answers
+            raise
 
-            line = self.__link.server.readline()
+        koemyd.fetching.breaker.success(self.__request.address)
 
-        koemyd.logger.info("c#%s" % self.__link.uuid, "s#%s:p#%s:%d:r#%d:response:%s" % (
-                    self.__link.server.uuid, self.__request.host,
+        koemyd.metrics.ttfb_seconds.observe(time.time() - self.__time_requested)
+
+        koemyd.logger.info("c#%s", "s#%s:p#%s:%d:r#%d:response:%s",
+                    self.__link.uuid, self.__link.server.uuid, self.__request.host,
                     self.__request.port, response.code,
                     response.reason.lower()
-                )
             )
 
         if not response.is_persistent:
             self.__link.server.is_tainted = True
 
-            koemyd.logger.info("c#%s" % self.__link.uuid,
-                "s#%s:p#%s:%d:r#%d:tainted!" % (
-                    self.__link.server.uuid, self.__request.host,
+            koemyd.logger.info("c#%s", "s#%s:p#%s:%d:r#%d:tainted!",
+                    self.__link.uuid, self.__link.server.uuid, self.__request.host,
                     self.__request.port, response.code,
-                )
             )
 
+        cache = koemyd.caching.cache
+        if cache:
+            if self.__cached and response.code == 304:
+                cache.freshen(self.__cached, response, self.__time_requested, time.time())
+                if self.__relay_cached_entry(self.__cached, "revalidated"): return
+
+                raise koemyd.fetching.ConnectionError("cache:entry vanished on revalidation")
+
+            if self.__request.method not in ["GET", "HEAD", "OPTIONS", "TRACE"] and response.code < 400:
+                cache.invalidate(self.__request) # i.e., unsafe method
+
         if self.__request.is_persistent:
             response.headers["Connection"] = "keep-alive"
         else:
             response.headers["Connection"] = "close"
 
-        coder = response.coder
-
-        self.__link.client.tx(response.line)
-        self.__link.client.tx(koemyd.const.CRLF)
-        for k, v in response.headers.iteritems():
-            if k.lower() not in map(str.lower, koemyd.const.HTTP_HEADERS_SKIP_TO_CLIENT):
-                self.__link.client.tx("%s: %s" % (k, v))
-                self.__link.client.tx(koemyd.const.CRLF)
-
-        self.__link.client.tx(koemyd.const.CRLF)
-
-        if response.expect_body:
-            if coder: self.__link.relay_encoded(coder)
-            else:
-                self.__link.relay(
-                    long(response.headers["Content-Length"]),
-                    perms=[
-                        self.__link.RELAY_PERM_S_RX_C_TX
-                    ]
-                )
+        expect_body = response.expects_body(self.__request)
+
+        coder = response.coder if expect_body else None
+
+        entry = None
+        if cache and expect_body:
+            entry = cache.store(self.__request, response, self.__time_requested, time.time())
+            if not entry and self.__cached: cache.invalidate(self.__request)
+
+        if self.__fetch:
+            self.__fetch.publish(response if koemyd.collapsing.is_shareable(response) else None)
+
+        self.__link.deadlines.arm("transfer", koemyd.conf.settings.idle_timeout, True)
+
+        self.__link.send(self.__link.client, [
+            response.line, koemyd.const.CRLF,
+            response.headers.wire(koemyd.const.HTTP_HEADERS_SKIP_TO_CLIENT_KEYS),
+            koemyd.const.CRLF,
+        ], "reply:tx")
+
+        if expect_body:
+            if entry: self.__link.client.tee = entry.write # i.e., stream into the cache as well
+            if self.__fetch and self.__fetch.head: # i.e., and to the followers, even if this client leaves
+                self.__link.client.tee = self.__fetch.chain(self.__link.client.tee)
+                self.__link.client.tee_through = self.__fetch.is_wanted
+            try:
+                if coder: self.__link.relay_encoded(coder)
+                else:
+                    self.__link.relay(
+                        long(response.headers["Content-Length"]),
+                        perms=[
+                            self.__link.RELAY_PERM_S_RX_C_TX
+                        ]
+                    )
+            finally:
+                self.__link.client.tee = self.__link.client.tee_through = None
+
+            if entry and cache.commit(entry):
+                koemyd.logger.info("c#%s", "s#%s:p#%s:%d:r#%d:cache:stored (%d bytes)",
+                            self.__link.uuid, self.__link.server.uuid, self.__request.host,
+                            self.__request.port, response.code, entry.size,
+                    )
+
+        if self.__fetch: self.__fetch.finish()
+
+    def __is_pending(self): # i.e., pipelined, or already on its way
+        if self.__link.client.cache: return True
+
+        r, _ = koemyd.util.wait([self.__link.client], [], 0)
+        return bool(r)
 
     def __handle(self):
         try:
-            try:
-                self.__parse_client_request()
-            except koemyd.fetching.ConnectionError as e:
-                raise koemyd.struct.HTTPRequestError(408, e.message)
+            while True:
+                self.__link.deadlines.arm("header", koemyd.conf.settings.header_timeout)
+                try:
+                    self.__parse_client_request()
+                except koemyd.fetching.DisconnectedPeerError as e:
+                    if self.__requests: return False # i.e., hung up while idle
+                    raise koemyd.struct.HTTPRequestError(408, e.message)
+                except koemyd.fetching.ConnectionError as e:
+                    raise koemyd.struct.HTTPRequestError(408, e.message)
+
+                if self.__request.is_tunneling:
+                    self.__link.deadlines.arm("connect", koemyd.conf.settings.connect_timeout)
+                    self.__setup_server_connect()
+
+                    self.__link.deadlines.arm("transfer", koemyd.conf.settings.idle_timeout, True)
+                    self.__link.tunnel()
+                    return False
+
+                if self.__relay_cached_reply() or self.__relay_collapsed_reply():
+                    self.__link.deadlines.disarm()
+                    self.__link.server.cancel()
+                else:
+                    try:
+                        self.__link.deadlines.arm("connect", koemyd.conf.settings.connect_timeout)
+                        self.__setup_server_connect()
 
-            self.__setup_server_connect()
+                        self.__link.deadlines.arm("response", koemyd.conf.settings.idle_timeout, True)
+                        self.__relay_server_request()
+                        self.__relay_server_reply()
+                    finally:
+                        if self.__fetch: self.__fetch.close() # i.e., followers left waiting fall back
 
-            if self.__request.is_tunneling: self.__link.relay()
-            else:
-                self.__relay_server_request()
-                self.__relay_server_reply()
+                    self.__link.deadlines.disarm() # i.e., before its socket goes back to the pool
+                    self.__link.server.release()
 
-                if self.__request.is_persistent:
-                   if self.__link.server.is_tainted:
-                      self.__link.server.reset()
-                   self.__handle()
+                koemyd.metrics.transfer_seconds.observe(time.time() - self.__time_parsed)
+
+                if not self.__request.is_persistent: return False
+                if not self.__is_pending():
+                    self.__link.shrink()
+                    return True # i.e., idle, to be parked until more arrives
         except koemyd.struct.HTTPError, e:
             self.__link.error(e.code, e.line)
         except koemyd.fetching.ConnectionTimeoutError as e:
@@ -166,8 +382,18 @@ class Handler(threading.Thread):
             self.__link.error(500, s)
         except KeyboardInterrupt:
             thread.interrupt_main()
+
+        return False
+
+    def run(self): # i.e., True when left idle, the connection is kept open
+        is_idle = False
+        try:
+            is_idle = self.__handle()
         finally:
-            self.__link.close()
+            if not is_idle: self.close()
+
+        return is_idle
 
-    def run(self):
-        self.__handle()
+    def close(self):
+        self.__link.close()
+        koemyd.metrics.connections_active.dec()
@@ -2,8 +2,12 @@
 
 import os
 import sys
+import time
 
+import atexit
 import logging
+import threading
+import collections
 
 import koemyd.const
 
@@ -16,41 +20,110 @@ logging.CRIT = logging.CRITICAL
 class Logger(object):
     def __init__(self):
         self.logger = logging.getLogger(koemyd.const.PROGRAM_NAME)
-        self.format = logging.Formatter("[%(asctime)s] %(message)s", "%H:%M:%S")
-        self.handle = logging.StreamHandler(sys.stdout)
-        self.handle.setFormatter(self.format)
-        self.logger.addHandler(self.handle)
 
         if koemyd.const.DATA_DEBUGGING: self.logger.setLevel(logging.DATA)
         else:
             self.logger.setLevel(logging.INFO)
 
-    def __out(self, l, m):
-        if self.logger.handlers: self.logger.log(l, m)
+        self.level = self.logger.level # i.e., cached, checked before any formatting
+        self.prefix = str()
+
+        self.stream = sys.stdout
+
+        self.drops = 0
+        self.__drops_reported = 0
+
+        self.restart()
+
+    @property
+    def stats(self): return {"queued": len(self.__queue), "dropped": self.drops}
+
+    def restart(self): # i.e., after fork(2), the writer thread does not survive it
+        self.__lock = threading.Lock() # i.e., serializes drains, a fresh one, the writer may have held it across the fork
+        self.__queue = collections.deque()
+        self.__wakeup = threading.Event()
+        self.__is_idle = False # i.e., the writer is waiting, the next record wakes it up
+
+        self.__writer = threading.Thread(target=self.__write_forever, name="logger")
+        self.__writer.daemon = True
+        self.__writer.start()
+
+    def tag(self, t): self.prefix = "%s:" % t
+
+    def __line(self, t, m):
+        return "[%s] %s%s%s" % (time.strftime("%H:%M:%S", time.localtime(t)), self.prefix, m, os.linesep)
+
+    def __write(self, lines):
+        try:
+            self.stream.write(str().join(lines))
+            self.stream.flush()
+        except (IOError, ValueError): pass
+
+    def __drain(self): # i.e., popped and written under the lock, so batches go out in order
+        with self.__lock:
+            lines = []
+            try:
+                while len(lines) < koemyd.const.LOGGER_BATCH_SIZE:
+                    lines.append(self.__line(*self.__queue.popleft()))
+            except IndexError: pass
+
+            if self.drops > self.__drops_reported:
+                lines.append(self.__line(time.time(), "warn:logger:%d records dropped" % (self.drops - self.__drops_reported)))
+                self.__drops_reported = self.drops
+
+            if lines: self.__write(lines)
+
+        return len(lines)
+
+    def __write_forever(self):
+        while True:
+            if not self.__drain():
+                self.__is_idle = True
+                if not self.__queue: self.__wakeup.wait(koemyd.const.LOGGER_FLUSH_INTERVAL) # i.e., or missed its wakeup
+                self.__is_idle = False
+                self.__wakeup.clear()
+
+    def flush(self):
+        while self.__drain(): pass
+
+    def __out(self, l, m, args):
+        if args: m = m % args # i.e., only once the level is known to be enabled
+
+        if len(self.__queue) < koemyd.const.LOGGER_QUEUE_SIZE:
+            self.__queue.append((time.time(), m))
+            if self.__is_idle: self.__wakeup.set() # i.e., once per idle spell, not per record
         else:
-            sys.stderr.write(m + os.linesep)
+            self.drops += 1
 
-    def data(self, module, message):
-        self.__out(logging.DATA, "data:%s:%s" % (module, message))
+    def data(self, module, message, *args):
+        if self.level <= logging.DATA: self.__out(logging.DATA, "data:" + module + ":" + message, args)
 
-    def info(self, module, message):
-        self.__out(logging.INFO, "info:%s:%s" % (module, message))
+    def info(self, module, message, *args):
+        if self.level <= logging.INFO: self.__out(logging.INFO, "info:" + module + ":" + message, args)
 
-    def warn(self, module, message):
-        self.__out(logging.OOPS, "warn:%s:%s" % (module, message))
+    def warn(self, module, message, *args):
+        if self.level <= logging.OOPS: self.__out(logging.OOPS, "warn:" + module + ":" + message, args)
 
-    def oops(self, module, message):
-        self.__out(logging.OOPS, "oops:%s:%s" % (module, message))
+    def oops(self, module, message, *args):
+        if self.level <= logging.OOPS: self.__out(logging.OOPS, "oops:" + module + ":" + message, args)
 
-    def crit(self, module, message, ex_code):
-        self.__out(logging.CRIT, "crit:%s:%s" % (module, message))
+    def crit(self, module, message, ex_code, *args):
+        self.__out(logging.CRIT, "crit:%s:%s" % (module, message % args if args else message), ())
+        self.flush()
 
         sys.exit(ex_code)
 
-def data(module, message): logger.data(module, message)
-def info(module, message): logger.info(module, message)
-def warn(module, message): logger.warn(module, message)
-def oops(module, message): logger.oops(module, message)
-def crit(module, message): logger.crit(module, message, ex_code=1)
+def tag(t): logger.tag(t)
+
+def flush(): logger.flush()
+def restart(): logger.restart()
+
+def data(module, message, *args): logger.data(module, message, *args)
+def info(module, message, *args): logger.info(module, message, *args)
+def warn(module, message, *args): logger.warn(module, message, *args)
+def oops(module, message, *args): logger.oops(module, message, *args)
+def crit(module, message, *args): logger.crit(module, message, 1, *args)
 
 logger = Logger()
+
+atexit.register(logger.flush)
@@ -11,9 +11,16 @@ def main(argv):
                        prog=koemyd.const.PROGRAM_NAME, epilog="-- koaeH (118E 7E44)",
              )
     parser.set_defaults(mode="advanced")
-    parser.parse_args(argv)
+    parser.add_option("-w", "--workers", dest="workers", type="int", default=0, metavar="N",
+                      help="pre-fork N worker processes sharing the listen address")
+    options, _ = parser.parse_args(argv)
 
-    from koemyd.daemon import Server
+    if options.workers < 0: parser.error("--workers must not be negative")
+
+    from koemyd.daemon import Server, Supervisor
+
+    if options.workers: daemon = Supervisor(options.workers)
+    else:
+        daemon = Server()
 
-    daemon = Server()
     daemon.start()
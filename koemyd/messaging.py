@@ -1,11 +1,15 @@
 # vi:ts=4:sw=4:syn=python
 
+import httplib
 import urlparse
 
+import koemyd.const
 import koemyd.trans
 import koemyd.struct
 
 class ClientRequest(koemyd.struct.HTTPRequest):
+    __slots__ = ("scheme", "host", "port", "path", "is_chunked", "is_expecting")
+
     def __init__(self, line=str()):
         super(ClientRequest, self).__init__(line)
 
@@ -17,7 +21,8 @@ class ClientRequest(koemyd.struct.HTTPRequest):
                     self.host = parts.hostname
                     if not self.host:
                         raise ClientRequestError(400, "missing hostname in request URI")
-                    self.port = int(parts.port or 80)
+                    port = parts.netloc.rpartition('@')[2].rpartition(']')[2].partition(':')[2] # i.e., past userinfo and an IPv6 literal
+                    self.port = self.__port(port) if port else 80
                     self.path = parts.path or '/'
                     if parts.query:
                         self.path += "?%s" % parts.query
@@ -35,7 +40,39 @@ class ClientRequest(koemyd.struct.HTTPRequest):
                 raise ClientRequestError(400, "CONNECT:bad address")
 
             self.host = self.host.lower()
-            self.port = int(self.port)
+            self.port = self.__port(self.port)
+
+        self.is_chunked = False
+        self.is_expecting = False # i.e., 100-continue, answered here rather than by the origin
+
+    @staticmethod
+    def __port(port): # i.e., no sign, no wrap around, before it gets anywhere near the resolver
+        if not (port.isdigit() and int(port) <= 0xFFFF):
+            raise ClientRequestError(400, "%s:bad port" % port)
+        return int(port)
+
+    @classmethod
+    def parse_head(cls, lines, *args):
+        request = super(ClientRequest, cls).parse_head(lines, *args)
+
+        if "Transfer-Encoding" in request.headers: # cf. Section 3.3.3 of [RFC7230]
+            if not request.headers["Transfer-Encoding"].strip().lower() == "chunked":
+                raise ClientRequestError(501, "%s:unsupported transfer-encoding" % request.headers["Transfer-Encoding"].lower())
+            request.is_chunked = True
+
+        if "Expect" in request.headers: # cf. Section 5.1.1 of [RFC7231]
+            if not request.headers["Expect"].strip().lower() == "100-continue":
+                raise ClientRequestError(417, "%s:unsupported expectation" % request.headers["Expect"].lower())
+            request.is_expecting = request.http_version.endswith("1.1")
+
+        return request
+
+    @property
+    def coder(self): return koemyd.trans.ChunkScanner() if self.is_chunked else None # i.e., relayed as is
+
+    @property
+    def has_body(self):
+        return self.is_chunked or bool(long(self.headers.get("Content-Length", 0)))
 
     @property
     def is_tunneling(self): return "CONNECT" == self.method
@@ -62,21 +99,49 @@ class ClientRequest(koemyd.struct.HTTPRequest):
 class ClientRequestError(koemyd.struct.HTTPError): pass
 
 class ServerRequest(koemyd.struct.HTTPRequest):
+    __slots__ = ()
+
     def __init__(self, method, path, http_version="HTTP/1.1"):
         super(ServerRequest, self).__init__("%s %s %s" % (method, path, http_version))
 
+    @classmethod
+    def procure(cls, c_request):
+        request = cls(c_request.method, c_request.path)
+        for k, v in c_request.headers.iteritems():
+            if k.lower() in koemyd.const.HTTP_HEADERS_SKIP_TO_SERVER_KEYS: continue
+            if k.lower() == "expect": continue # i.e., answered by koemyd itself
+            if k.lower() == "content-length" and c_request.is_chunked: continue # cf. Section 3.3.3 of [RFC7230]
+
+            request.headers.add(k, v)
+
+        if c_request.is_chunked: request.headers["Transfer-Encoding"] = "chunked"
+
+        request.headers["Host"] = c_request.host
+        if not c_request.port == 80:
+            request.headers["Host"] += ":%d" % c_request.port
+
+        request.headers["Connection"] = "keep-alive"
+
+        return request
+
 class ServerRequestError(koemyd.struct.HTTPError): pass
 
 class ServerResponse(koemyd.struct.HTTPResponse):
-    def __init__(self, line):
+    __slots__ = ("__coder", "__chunk_passthrough")
+
+    def __init__(self, line, chunk_passthrough=False):
         super(ServerResponse, self).__init__(line)
 
         self.__coder = None
+        self.__chunk_passthrough = chunk_passthrough
 
     def __set_coder(self):
         if "Transfer-Encoding" in self.headers:
             if "chunked" == self.headers["Transfer-Encoding"].lower():
-                self.__coder = koemyd.trans.ChunkDecoder()
+                if self.__chunk_passthrough:
+                    self.__coder = koemyd.trans.ChunkScanner()
+                else:
+                    self.__coder = koemyd.trans.ChunkDecoder()
             else:
                 raise ServerResponseError(502, "%s:unsupported transfer-encoding")
         elif not "Content-Length" in self.headers:
@@ -88,6 +153,9 @@ class ServerResponse(koemyd.struct.HTTPResponse):
     @property
     def coder(self): return self.__coder if self.__coder else self.__set_coder()
 
+    def expects_body(self, request): # cf. Section 3.3.3 of [RFC7230], i.e., none after HEAD, whatever the headers say
+        return self.expect_body and not request.method == "HEAD"
+
     @property
     def is_persistent(self):
         if "Connection" in self.headers:
@@ -97,3 +165,20 @@ class ServerResponse(koemyd.struct.HTTPResponse):
         return False
 
 class ServerResponseError(koemyd.struct.HTTPError): pass
+
+class ErrorResponse(koemyd.struct.HTTPResponse):
+    __slots__ = ("body",)
+
+    def __init__(self, code, message, link_uuid):
+        super(ErrorResponse, self).__init__("HTTP/1.1 %d %s" % (code, httplib.responses[code]))
+
+        self.body  = self.reason.title()
+        self.body += koemyd.const.HTTP_CRLF * 2 + message.lower()
+        self.body += koemyd.const.HTTP_CRLF * 2 + "! c#%s:e#%04d" % (link_uuid, code)
+
+        self.headers["Content-Type"] = "text/plain"
+        self.headers["Content-Length"] = str(len(self.body))
+        self.headers["Connection"] = "close"
+
+    def __str__(self):
+        return str().join([self.line, koemyd.const.HTTP_CRLF, self.head, koemyd.const.HTTP_CRLF, self.body])
@@ -0,0 +1,266 @@
+# vi:ts=4:sw=4:syn=python
+
+import errno
+import socket
+import bisect
+import threading
+
+import koemyd.conf
+import koemyd.const
+import koemyd.logger
+import koemyd.tuning
+
+class Metric(object):
+    TYPE = None
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels_names = tuple(labels)
+
+        self.__lock = threading.Lock()
+        self.__children = dict() # (label value, ...): child
+
+        if not self.labels_names: self.labels() # i.e., exposed as zero from the start
+
+    def labels(self, *values): # i.e., resolve once, keep the child around on hot paths
+        child = self.__children.get(values)
+        if child is None:
+            with self.__lock:
+                child = self.__children.setdefault(values, self.child())
+
+        return child
+
+    def remove(self, *values): # i.e., per-peer labels, dropped once the peer is, or the label set grows without end
+        with self.__lock: self.__children.pop(values, None)
+
+    def child(self): raise NotImplementedError
+
+    def __label(self, values, extra=()):
+        pairs = zip(self.labels_names, values) + list(extra)
+        if not pairs: return str()
+
+        return "{%s}" % ",".join('%s="%s"' % (k, str(v).replace('\\', r'\\').replace('"', r'\"')) for k, v in pairs)
+
+    def expose(self):
+        lines = [
+            "# HELP %s %s" % (self.name, self.description),
+            "# TYPE %s %s" % (self.name, self.TYPE),
+        ]
+
+        for values, child in sorted(self.__children.items()):
+            for suffix, extra, value in child.samples():
+                lines.append("%s%s%s %s" % (self.name, suffix, self.__label(values, extra), format_value(value)))
+
+        return lines
+
+class Counter(Metric):
+    TYPE = "counter"
+
+    def child(self): return CounterChild()
+
+    def inc(self, n=1): self.labels().inc(n)
+
+class CounterChild(object):
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, n=1):
+        with self.__lock: self.value += n
+
+    def samples(self): return [(str(), (), self.value)]
+
+class Gauge(Counter):
+    TYPE = "gauge"
+
+    def child(self): return GaugeChild()
+
+    def dec(self, n=1): self.labels().inc(-n)
+
+class GaugeChild(CounterChild):
+    def dec(self, n=1): self.inc(-n)
+
+    def set(self, value): self.inc(value - self.value) # i.e., callers serialize their own sets
+
+class Histogram(Metric):
+    TYPE = "histogram"
+
+    def __init__(self, name, description, labels=(), buckets=koemyd.const.METRICS_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super(Histogram, self).__init__(name, description, labels)
+
+    def child(self): return HistogramChild(self.buckets)
+
+    def observe(self, value): self.labels().observe(value)
+
+class HistogramChild(object):
+    def __init__(self, buckets):
+        self.__lock = threading.Lock()
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # i.e., +Inf last
+        self.sum = 0.0
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.__lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def samples(self):
+        with self.__lock: counts, total = list(self.counts), self.sum
+
+        samples, cumulative = [], 0
+        for le, n in zip(self.buckets + (float("inf"),), counts):
+            cumulative += n
+            samples.append(("_bucket", [("le", format_value(le))], cumulative))
+
+        samples.append(("_sum", (), total))
+        samples.append(("_count", (), cumulative))
+
+        return samples
+
+def format_value(value):
+    if value == float("inf"): return "+Inf"
+    if isinstance(value, float): return repr(value)
+    return str(value)
+
+class Registry(object):
+    def __init__(self):
+        self.__metrics = []
+        self.__stats = [] # (prefix, callable returning a stats dict)
+
+    def counter(self, *args, **kwargs): return self.__add(Counter(*args, **kwargs))
+    def gauge(self, *args, **kwargs): return self.__add(Gauge(*args, **kwargs))
+    def histogram(self, *args, **kwargs): return self.__add(Histogram(*args, **kwargs))
+
+    def __add(self, metric):
+        self.__metrics.append(metric)
+        return metric
+
+    def stats(self, prefix, fn): self.__stats.append((prefix, fn))
+
+    def expose(self):
+        lines = []
+        for metric in self.__metrics: lines.extend(metric.expose())
+
+        for prefix, fn in self.__stats:
+            stats = fn()
+            if not stats: continue
+
+            for k, v in sorted(stats.items()):
+                name = "%s_%s" % (prefix, k)
+                lines.append("# TYPE %s gauge" % name)
+                lines.append("%s %s" % (name, format_value(v)))
+
+        return "\n".join(lines) + "\n"
+
+def connect_error_class(e):
+    if isinstance(e, socket.timeout): return "timeout"
+    if isinstance(e, socket.gaierror): return "resolve"
+
+    e_n = e if isinstance(e, int) else getattr(e, "errno", None)
+    return errno.errorcode.get(e_n, "unknown").lower()
+
+class AdminServer(threading.Thread):
+    def __init__(self, address):
+        super(AdminServer, self).__init__()
+        self.daemon = True
+
+        self.address = address
+
+        self.__sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.__sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+    def start(self):
+        try:
+            self.__sock.bind(self.address)
+            self.__sock.listen(16)
+        except socket.error as (_, m):
+            koemyd.logger.warn("metrics", "could not bind to %s:%d (%s)" % (self.address + (m.lower(),)))
+            return
+
+        koemyd.logger.info("metrics", "admin is now listening on http://%s:%d/metrics" % self.__sock.getsockname())
+
+        super(AdminServer, self).start()
+
+    def __reply(self, sock, code, reason, body, content_type="text/plain"):
+        sock.sendall(koemyd.const.HTTP_CRLF.join([
+            "HTTP/1.0 %d %s" % (code, reason),
+            "Content-Type: %s" % content_type,
+            "Content-Length: %d" % len(body),
+            "Connection: close",
+            koemyd.const.HTTP_CRLF,
+        ]) + body)
+
+    def __serve(self, sock):
+        sock.settimeout(koemyd.const.METRICS_ADMIN_TIMEOUT)
+
+        d = str()
+        while "\n" not in d and len(d) < koemyd.const.HTTP_MAX_LINE_LENGTH:
+            c = sock.recv(koemyd.const.SOCKET_BUFSIZE)
+            if not c: return
+            d += c
+
+        try:
+            method, path, _ = d.split("\n", 1)[0].split()
+        except ValueError:
+            return self.__reply(sock, 400, "Bad Request", "bad request\n")
+
+        if not method == "GET":
+            return self.__reply(sock, 405, "Method Not Allowed", "method not allowed\n")
+
+        if not path.split("?", 1)[0] == "/metrics":
+            return self.__reply(sock, 404, "Not Found", "not found\n")
+
+        self.__reply(sock, 200, "OK", registry.expose(), koemyd.const.METRICS_CONTENT_TYPE)
+
+    def run(self):
+        while True:
+            try:
+                sock, _ = self.__sock.accept()
+            except socket.error as e:
+                if e.errno in [errno.EINTR, errno.ECONNABORTED, errno.EMFILE]: continue
+                raise
+
+            try:
+                self.__serve(sock)
+            except socket.error: pass
+            finally:
+                sock.close()
+
+def serve(port_offset=0):
+    if not koemyd.conf.settings.admin_port: return None
+
+    admin = AdminServer((koemyd.conf.settings.admin_addr, koemyd.conf.settings.admin_port + port_offset))
+    admin.start()
+
+    return admin
+
+registry = Registry()
+
+connections_active = registry.gauge("koemyd_connections_active", "client connections being served")
+
+accepts = registry.counter("koemyd_accepts_total", "client connections accepted")
+rejections = registry.counter("koemyd_rejections_total", "client connections refused", ["reason"])
+
+bytes_received = registry.counter("koemyd_received_bytes_total", "bytes received, by peer", ["peer"])
+bytes_sent = registry.counter("koemyd_sent_bytes_total", "bytes sent, by peer", ["peer"])
+backpressure = registry.counter("koemyd_backpressure_total", "times a peer's output queue filled up and reads were held back, by peer", ["peer"])
+send_syscalls = registry.counter("koemyd_send_syscalls_total", "send, writev and splice calls out to a socket, by peer", ["peer"])
+
+connect_failures = registry.counter("koemyd_upstream_connect_failures_total", "upstream connect failures", ["reason"])
+preconnects = registry.counter("koemyd_upstream_preconnects_total", "upstream connects set off ahead of the request head", ["outcome"])
+breaker_trips = registry.counter("koemyd_upstream_breaker_trips_total", "upstream circuits opened")
+breaker_state = registry.gauge("koemyd_upstream_breaker_state", "upstream circuit, 1 open, 2 half-open, gone once closed", ["upstream"])
+timeouts = registry.counter("koemyd_timeouts_total", "connection deadlines that went off", ["deadline"])
+
+parse_seconds = registry.histogram("koemyd_client_head_parse_seconds", "client request head parse time",
+                                   buckets=koemyd.const.METRICS_PARSE_BUCKETS)
+connect_seconds = registry.histogram("koemyd_upstream_connect_seconds", "upstream connect time")
+ttfb_seconds = registry.histogram("koemyd_upstream_ttfb_seconds", "upstream request sent to response head")
+accept_queue_wait_seconds = registry.histogram("koemyd_accept_queue_wait_seconds", "client connection accepted to handled")
+transfer_seconds = registry.histogram("koemyd_transfer_seconds", "client request head to last byte relayed")
+
+registry.stats("koemyd_logger", lambda: koemyd.logger.logger.stats)
+registry.stats("koemyd_tuning", lambda: koemyd.tuning.profile.effective)
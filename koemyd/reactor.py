@@ -0,0 +1,823 @@
+# vi:ts=4:sw=4:syn=python
+
+import os
+
+import time
+import fcntl
+import Queue
+import errno
+import socket
+import select
+import httplib
+import threading
+import traceback
+import collections
+
+import koemyd.base
+import koemyd.conf
+import koemyd.const
+import koemyd.trans
+import koemyd.struct
+import koemyd.logger
+import koemyd.timing
+import koemyd.tuning
+import koemyd.metrics
+import koemyd.shaping
+import koemyd.fetching
+import koemyd.messaging
+
+EPOLL_RX = select.EPOLLIN | select.EPOLLPRI
+EPOLL_TX = select.EPOLLOUT
+EPOLL_XX = select.EPOLLERR | select.EPOLLHUP
+
+class Reactor(object):
+    def __init__(self, sock):
+        self.__sock = sock
+        self.__sock.setblocking(0)
+
+        self.__poll = select.epoll()
+        self.__poll.register(self.__sock.fileno(), EPOLL_RX)
+
+        self.__sockets = dict() # fd: ReactorSocket
+
+        self.channels = set()
+
+        self.wheel = koemyd.timing.wheel # i.e., advanced from the loop rather than ticked, fires on its thread
+
+        self.lookups = Lookups()
+        self.__poll.register(self.lookups.fileno(), EPOLL_RX)
+
+    def register(self, r_sock, events):
+        self.__poll.register(r_sock.fileno(), events)
+        self.__sockets[r_sock.fileno()] = r_sock
+
+    def modify(self, r_sock, events):
+        self.__poll.modify(r_sock.fileno(), events)
+
+    def unregister(self, r_sock):
+        try: self.__poll.unregister(r_sock.fileno())
+        except (IOError, ValueError): pass
+
+        self.__sockets.pop(r_sock.fileno(), None)
+
+    def __accept(self):
+        while True:
+            try:
+                client_sock, client_address = self.__sock.accept()
+            except socket.error as e:
+                if e.errno in [errno.EAGAIN, errno.EINTR, errno.ECONNABORTED]: return
+                if e.errno in [errno.EMFILE, errno.ENFILE]:
+                    koemyd.metrics.rejections.labels(errno.errorcode[e.errno].lower()).inc()
+                    koemyd.logger.oops("reactor", "could not accept (%s)" % os.strerror(e.errno).lower())
+                    return
+                raise
+
+            koemyd.metrics.accepts.inc()
+            if len(self.channels) < koemyd.const.REACTOR_MAX_CONCURRENCY:
+                Channel(self, koemyd.tuning.profile.tune_client(client_sock))
+            else:
+                koemyd.metrics.rejections.labels("max_clients").inc()
+                koemyd.logger.warn("reactor", "maximum number of clients exceeded")
+                client_sock.close()
+
+    def serve_forever(self):
+        while True:
+            try:
+                events = self.__poll.poll(self.wheel.resolution)
+            except IOError as e:
+                if e.errno in [errno.EINTR]: continue
+                raise
+
+            for fd, ev in events:
+                if fd == self.__sock.fileno(): self.__accept()
+                elif fd == self.lookups.fileno():
+                    for r_sock, result in self.lookups.drain(): r_sock.channel.on_resolved(r_sock, result)
+                elif fd in self.__sockets:
+                    r_sock = self.__sockets[fd]
+                    r_sock.channel.on_event(r_sock, ev)
+
+            self.wheel.advance()
+
+class Lookups(object): # i.e., resolver cache misses, looked up on a few threads and handed back through a pipe
+    def __init__(self, workers=koemyd.const.REACTOR_RESOLVER_THREADS):
+        self.__r, self.__w = os.pipe()
+        for fd in [self.__r, self.__w]: fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+        self.__queue = Queue.Queue()
+        self.__done = collections.deque() # (r_sock, sock_address | socket.error)
+
+        for _ in xrange(workers):
+            t = threading.Thread(target=self.__work)
+            t.daemon = True
+            t.start()
+
+    def fileno(self): return self.__r
+
+    def submit(self, r_sock, address): self.__queue.put((r_sock, address))
+
+    def __work(self):
+        while True:
+            r_sock, address = self.__queue.get()
+            try:
+                result = koemyd.fetching.resolver.resolve(address)
+            except socket.error as e:
+                result = e
+            except Exception as e: # i.e., a worker lost for good otherwise, the channel left waiting
+                result = socket.error(errno.EINVAL, "name resolution failed (%s)" % e)
+
+            self.__done.append((r_sock, result))
+            try: os.write(self.__w, "\0")
+            except OSError: pass # i.e., the pipe is full, the loop is woken up already
+
+    def drain(self):
+        try:
+            while os.read(self.__r, 0x1000): pass
+        except OSError: pass
+
+        while self.__done: yield self.__done.popleft()
+
+class ReactorSocket(koemyd.base.UUIDObject):
+    __slots__ = ("channel", "address", "peer_address", "time_connect", "rx_bytes", "tx_bytes", "tx_calls", "tx_backpressure",
+                 "__sock", "__events", "__head_parser", "__is_held", "rx_buffer", "tx_buffer", "is_tainted", "is_eof",
+                 "is_resolving", "is_shut", "is_broken")
+
+    def __init__(self, channel, sock, address=None, peer="server"):
+        super(ReactorSocket, self).__init__()
+
+        self.channel = channel
+        self.address = address # as requested, i.e., (host, port)
+
+        self.rx_bytes = koemyd.metrics.bytes_received.labels(peer)
+        self.tx_bytes = koemyd.metrics.bytes_sent.labels(peer)
+        self.tx_calls = koemyd.metrics.send_syscalls.labels(peer)
+        self.tx_backpressure = koemyd.metrics.backpressure.labels(peer)
+        self.time_connect = None
+
+        self.__sock = sock
+        self.__sock.setblocking(0)
+        self.__sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        self.__events = None
+
+        self.rx_buffer = bytearray()
+        self.tx_buffer = bytearray()
+        self.__head_parser = koemyd.struct.HTTPHeadParser()
+        self.__is_held = False
+
+        self.is_tainted = False
+        self.is_eof = False
+        self.is_shut = False # i.e., its write side, once the other way's done, cf. Channel.S_TUNNEL
+        self.is_broken = False # i.e., reset, rather than an orderly EOF
+        self.is_resolving = False # i.e., not to be watched, a fresh socket polls as hung up
+
+        self.peer_address = None
+        try:
+            self.peer_address = self.__sock.getpeername()
+            self.__log("p#%s:%d:connection established", *self.peer_address)
+        except socket.error: pass
+
+    def __getattr__(self, item): return getattr(self.__sock, item)
+
+    def __log(self, message, *args):
+        koemyd.logger.info("c#%s:s#%s", message, self.channel.uuid, self.uuid, *args)
+
+    def watch(self, events):
+        if self.is_eof and self.is_shut: # i.e., done both ways, it would poll as hung up for good
+            if self.__events is not None: self.channel.reactor.unregister(self)
+            self.__events = None
+            return
+
+        if self.__events is None:
+            self.channel.reactor.register(self, events)
+        elif not events == self.__events:
+            self.channel.reactor.modify(self, events)
+
+        self.__events = events
+
+    def connect(self, address):
+        self.__log("p#%s:%d:connecting...", *address)
+
+        try:
+            sock_address = koemyd.fetching.resolver.peek(address)
+        except socket.error as e:
+            self.__unresolved(e)
+
+        if sock_address is None: # i.e., a cache miss, cf. Channel.on_resolved
+            self.is_resolving = True
+            self.channel.reactor.lookups.submit(self, address)
+            return
+
+        self.__connect(sock_address)
+
+    def resolved(self, result):
+        self.is_resolving = False
+
+        if isinstance(result, socket.error): self.__unresolved(result)
+        self.__connect(result)
+
+    def __unresolved(self, e):
+        koemyd.metrics.connect_failures.labels("resolve").inc()
+        raise koemyd.fetching.ConnectionSocketError("%s:could not resolve (%s)" % ("p#%s:%d" % self.address, str(e.strerror).lower()))
+
+    def __connect(self, sock_address):
+        self.time_connect = time.time()
+
+        e_n = self.__sock.connect_ex(sock_address)
+        if e_n not in [0, errno.EINPROGRESS, errno.EWOULDBLOCK]:
+            koemyd.fetching.breaker.failure(self.address)
+            koemyd.metrics.connect_failures.labels(koemyd.metrics.connect_error_class(e_n)).inc()
+            raise koemyd.fetching.ConnectionSocketError("%s:could not connect (%s)" % ("p#%s:%d" % self.address, os.strerror(e_n)))
+
+    def connected(self):
+        e_n = self.__sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if e_n:
+            koemyd.fetching.breaker.failure(self.address)
+            koemyd.metrics.connect_failures.labels(koemyd.metrics.connect_error_class(e_n)).inc()
+            raise koemyd.fetching.ConnectionSocketError("%s:could not connect (%s)" % ("p#%s:%d" % self.address, os.strerror(e_n)))
+
+        koemyd.metrics.connect_seconds.observe(time.time() - self.time_connect)
+
+        self.peer_address = self.__sock.getpeername()
+        self.__log("p#%s:%d:connection established", *self.peer_address)
+
+    def fill(self, size=None):
+        try:
+            d = self.__sock.recv(size or koemyd.conf.settings.socket_bufsize)
+        except socket.error as e:
+            if e.errno in [errno.EAGAIN, errno.EINTR]: return 0
+            if e.errno in [errno.ECONNRESET, errno.ETIMEDOUT]: d, self.is_broken = None, True
+            else:
+                raise
+
+        if d:
+            self.rx_buffer += d
+            self.rx_bytes.inc(len(d))
+            return len(d)
+
+        self.is_eof = True
+        return 0
+
+    def flush(self):
+        if not self.tx_buffer: return
+
+        try:
+            bytes_sent = self.__sock.send(self.tx_buffer)
+        except socket.error as e:
+            if e.errno in [errno.EAGAIN, errno.EINTR]: return
+            if e.errno in [errno.EPIPE, errno.ECONNRESET]:
+                self.tx_buffer, self.is_eof, self.is_broken = bytearray(), True, True
+                return
+            raise
+
+        if bytes_sent == len(self.tx_buffer): self.tx_buffer = bytearray() # i.e., rather than a drained one pinning its heap chunk
+        else:
+            del self.tx_buffer[:bytes_sent]
+        self.tx_bytes.inc(bytes_sent)
+        self.tx_calls.inc()
+
+    def is_held(self, high, low): # i.e., True from tx_buffer reaching high water until it drains to low water
+        n = len(self.tx_buffer)
+        if n >= high and not self.__is_held:
+            self.__is_held = True
+            self.tx_backpressure.inc()
+        elif n <= low:
+            self.__is_held = False
+
+        return self.__is_held
+
+    def shut(self): # i.e., half-close, passed on once the other peer's EOF and what came before it went out
+        if self.is_shut: return
+        self.is_shut = True
+
+        try:
+            self.__sock.shutdown(socket.SHUT_WR)
+        except socket.error: pass
+
+    def head(self): return self.__head_parser.parse(self.rx_buffer)
+
+    def release(self):
+        self.channel.reactor.unregister(self)
+
+        if self.is_tainted or self.is_eof or self.rx_buffer or self.tx_buffer:
+            return self.close()
+        if not type(self.peer_address) == tuple: # i.e., set off ahead, never made it
+            return self.close()
+
+        if not koemyd.fetching.pool.checkin(self.address, self.__sock):
+            return self.close()
+
+        self.__log("p#%s:%d:connection released", *self.peer_address)
+
+    def close(self):
+        self.channel.reactor.unregister(self)
+
+        try:
+            self.__sock.close()
+        except socket.error: pass
+
+        if type(self.peer_address) == tuple:
+            self.__log("p#%s:%d:connection closed", *self.peer_address)
+
+class Channel(koemyd.base.UUIDObject):
+    __slots__ = ("reactor", "client", "server", "flow", "deadlines",
+                 "__state", "__request", "__requests", "__coder", "__size", "__time_parsed", "__time_requested",
+                 "__ahead", "__allowed", "__is_throttled")
+
+    S_REQUEST_HEAD   = 0x00
+    S_CONNECT        = 0x01
+    S_REQUEST_BODY   = 0x02
+    S_REPLY_HEAD     = 0x03
+    S_REPLY_BODY     = 0x04
+    S_REPLY_TRAILER  = 0x05
+    S_TUNNEL         = 0x06
+    S_CLOSING        = 0x07
+    S_CLOSED         = 0x08
+
+    def __init__(self, reactor, client_sock):
+        super(Channel, self).__init__()
+
+        self.reactor = reactor
+        self.reactor.channels.add(self)
+
+        self.client = ReactorSocket(self, client_sock, peer="client")
+        self.server = None
+
+        self.__state = self.S_REQUEST_HEAD
+        self.__request = None
+        self.__requests = 0 # i.e., served on this connection so far
+        self.__coder = None
+        self.__size = 0
+
+        self.__time_parsed = self.__time_requested = None
+
+        self.__ahead = None # i.e., (address, error) of a server connect set off ahead of the head
+
+        koemyd.metrics.connections_active.inc()
+
+        self.flow = koemyd.shaping.shaper.flow(self.client.peer_address[0] if self.client.peer_address else None)
+        self.__allowed = None # i.e., bytes the next read may take, while shaped
+        self.__is_throttled = False
+
+        self.deadlines = koemyd.timing.Deadlines(reactor.wheel, self.__expire, koemyd.conf.settings.lifetime_timeout)
+        self.deadlines.arm("header", koemyd.conf.settings.header_timeout)
+
+        self.__watch()
+
+    def on_event(self, r_sock, ev):
+        if ev & EPOLL_XX and r_sock is self.client and self.client.is_eof:
+            return self.close() # i.e., hung up
+
+        self.__run(self.__on_event, r_sock, ev)
+
+    def on_resolved(self, r_sock, result):
+        if self.__state == self.S_CLOSED or not r_sock is self.server: return # i.e., given up on while it was looked up
+
+        self.__run(self.__on_resolved, result)
+
+    def __on_event(self, r_sock, ev):
+        if r_sock is self.server and self.__state == self.S_CONNECT:
+            self.server.connected()
+            self.__on_server_connected()
+        else:
+            if ev & EPOLL_TX: r_sock.flush()
+            if ev & (EPOLL_RX | EPOLL_XX): self.flow.consume(r_sock.fill(self.__allowed))
+
+        if self.__state == self.S_REQUEST_HEAD and self.client.rx_buffer and self.deadlines.armed == "keepalive":
+            self.deadlines.arm("header", koemyd.conf.settings.header_timeout) # i.e., the next one begun
+
+    def __on_resolved(self, result):
+        try:
+            self.server.resolved(result)
+        except koemyd.fetching.ConnectionError as e:
+            if not self.__ahead: raise
+
+            self.__ahead = (self.__ahead[0], e) # i.e., set off ahead, reported once the head is in, as in __preconnect
+            self.server.close()
+            self.server = None
+
+    def __run(self, fn, *args):
+        self.deadlines.time_last_op = time.time()
+
+        try:
+            fn(*args)
+            while self.__step(): pass
+        except koemyd.struct.HTTPError as e:
+            self.error(e.code, e.line)
+        except koemyd.fetching.ConnectionTimeoutError as e:
+            self.error(504, e.message)
+        except koemyd.fetching.ConnectionError as e:
+            self.error(502, e.message)
+        except koemyd.trans.CoderError as e:
+            self.error(502, "%s" % e)
+        except Exception as exc: # fallback
+            self.error(500, traceback.format_exc())
+
+        self.__watch()
+
+    def __expire(self, deadline): # i.e., from the wheel, the channel is done either way
+        koemyd.metrics.timeouts.labels(deadline).inc()
+
+        if deadline == "keepalive":
+            koemyd.logger.info("c#%s", "keep-alive:idle timeout", self.uuid)
+        elif self.__state == self.S_REQUEST_HEAD:
+            self.error(408, "rx:%s timeout" % deadline)
+        elif self.__state in [self.S_CONNECT, self.S_REQUEST_BODY, self.S_REPLY_HEAD]:
+            if self.__state in [self.S_CONNECT, self.S_REPLY_HEAD]: # i.e., upstream's fault, not the client's
+                koemyd.fetching.breaker.failure(self.server.address, True)
+            self.error(504, "p#%s:%d:%s timeout" % (self.server.address + (deadline,)))
+
+        self.client.flush() # i.e., best effort, whoever stalled won't get another chance
+        self.close()
+
+    def __step(self):
+        if self.__state == self.S_REQUEST_HEAD:
+            if self.client.is_eof:
+                self.close()
+                return False
+
+            lines = self.client.head()
+            if lines is None:
+                if koemyd.conf.settings.preconnect and not self.__ahead and "\n" in self.client.rx_buffer:
+                    self.__preconnect(str(self.client.rx_buffer[:self.client.rx_buffer.find("\n")]).rstrip("\r"))
+                return False
+
+            self.__parse_client_request(lines)
+            self.__setup_server_connect()
+            return True
+
+        if self.__state == self.S_REQUEST_BODY:
+            if self.__coder: # i.e., chunked, relayed as is up to its last-chunk
+                if self.client.rx_buffer:
+                    self.__pipe(self.client, self.server, self.__coder.feed(str(self.client.rx_buffer)))
+                if not self.__coder.keep_feeding:
+                    self.__state, self.__coder = self.S_REPLY_HEAD, None
+                    return True
+            else:
+                self.__size -= self.__pipe(self.client, self.server, self.__size)
+                if not self.__size:
+                    self.__state = self.S_REPLY_HEAD
+                    return True
+
+            if self.server.is_eof:
+                raise koemyd.fetching.DisconnectedPeerError("p#%s:%d:tx:disconnected" % self.server.address)
+            if self.client.is_eof: self.close()
+            return False
+
+        if self.__state == self.S_REPLY_HEAD:
+            try:
+                lines = self.server.head()
+            except koemyd.struct.HTTPHeaderError as e:
+                e.code = 502
+                raise e
+
+            if lines is None:
+                if self.server.is_eof:
+                    raise koemyd.fetching.DisconnectedPeerError("p#%s:%d:rx:disconnected" % self.server.address)
+                return False
+
+            self.__relay_server_reply(lines)
+            return True
+
+        if self.__state == self.S_REPLY_BODY:
+            if self.__coder: self.__relay_encoded()
+            else:
+                self.__size -= self.__pipe(self.server, self.client, self.__size)
+                if not self.__size: return self.__finish()
+
+                if self.server.is_eof:
+                    self.server.is_tainted = True
+                    self.__state = self.S_CLOSING
+            return self.__state != self.S_REPLY_BODY
+
+        if self.__state == self.S_REPLY_TRAILER:
+            i = self.server.rx_buffer.find("\n")
+            if i >= 0:
+                del self.server.rx_buffer[:i + 1]
+            elif self.server.is_eof:
+                self.server.is_tainted = True
+            else:
+                return False
+
+            return self.__finish()
+
+        if self.__state == self.S_TUNNEL: # i.e., each way on its own, as relay_spliced does
+            if self.client.is_broken or self.server.is_broken:
+                self.__state = self.S_CLOSING
+                return True
+
+            for r_sock_rx, r_sock_tx in [(self.client, self.server), (self.server, self.client)]:
+                self.__pipe(r_sock_rx, r_sock_tx)
+                if r_sock_rx.is_eof and not r_sock_tx.tx_buffer: r_sock_tx.shut()
+
+            if self.client.is_shut and self.server.is_shut: self.close()
+            return False
+
+        if self.__state == self.S_CLOSING:
+            if self.client.is_eof or not self.client.tx_buffer:
+                if not self.server or self.server.is_eof or not self.server.tx_buffer:
+                    self.close()
+
+        return False
+
+    def __pipe(self, r_sock_rx, r_sock_tx, size=None):
+        n = len(r_sock_rx.rx_buffer) if size is None else min(size, len(r_sock_rx.rx_buffer))
+        if n and n == len(r_sock_rx.rx_buffer) and not r_sock_tx.tx_buffer: # i.e., handed over whole, no copy
+            r_sock_tx.tx_buffer, r_sock_rx.rx_buffer = r_sock_rx.rx_buffer, bytearray()
+        elif n:
+            r_sock_tx.tx_buffer += r_sock_rx.rx_buffer[:n]
+            del r_sock_rx.rx_buffer[:n]
+
+        return n
+
+    def __parse_client_request(self, lines):
+        self.__time_parsed = time.time()
+        self.__request = koemyd.messaging.ClientRequest.parse_head(lines)
+        koemyd.metrics.parse_seconds.observe(time.time() - self.__time_parsed)
+
+        self.__requests += 1
+
+        self.flow.route(self.__request.host)
+
+        max_requests = koemyd.conf.settings.keepalive_max_requests
+        if max_requests and self.__requests >= max_requests:
+            self.__request.headers["Connection"] = "close" # i.e., last one on this connection
+
+        if not self.__request.is_tunneling:
+            koemyd.logger.info("c#%s", "s#%s:requested procuration to %s",
+                self.uuid, self.client.uuid, self.__request,
+            )
+        else:
+            koemyd.logger.info("c#%s", "s#%s:requested tunnel procuration to %s:%d",
+                self.uuid, self.client.uuid, self.__request.host, self.__request.port,
+            )
+
+    def __preconnect(self, line): # i.e., the request line is in, the rest of the head is not
+        self.__ahead = (None, None)
+        try:
+            address = koemyd.messaging.ClientRequest(line).address
+        except (koemyd.struct.HTTPError, ValueError):
+            return # i.e., left for parse_head to report
+
+        self.__ahead = (address, None)
+        try:
+            self.__open_server(address)
+        except koemyd.fetching.ConnectionError as e:
+            self.__ahead = (address, e) # i.e., reported once the head is in, if still wanted
+            if self.server:
+                self.server.close()
+                self.server = None
+
+    def __cancel(self): # i.e., set off ahead, but the request never made it
+        if not self.__ahead: return
+
+        self.__ahead = None
+        if not self.server: return
+
+        koemyd.metrics.preconnects.labels("cancelled").inc()
+
+        self.server.release()
+        self.server = None
+
+    def __open_server(self, address):
+        koemyd.fetching.breaker.check(address)
+
+        sock = koemyd.fetching.pool.checkout(address)
+        if sock:
+            self.server = ReactorSocket(self, sock, address)
+            return
+
+        self.server = ReactorSocket(self, koemyd.tuning.profile.tune_upstream(socket.socket()), address)
+        self.server.connect(address)
+
+    def __setup_server_connect(self):
+        self.deadlines.arm("connect", koemyd.conf.settings.connect_timeout)
+
+        if self.__ahead:
+            address, e = self.__ahead
+            if not address == self.__request.address: self.__cancel()
+            else:
+                self.__ahead = None
+                koemyd.metrics.preconnects.labels("used").inc()
+                if e: raise e
+
+                if self.server.time_connect: self.server.time_connect = time.time() # i.e., what is left of it
+
+        if not self.server: self.__open_server(self.__request.address)
+
+        if type(self.server.peer_address) == tuple: return self.__on_server_connected() # i.e., reused
+
+        self.__state = self.S_CONNECT
+
+    def __on_server_connected(self):
+        self.deadlines.arm("transfer" if self.__request.is_tunneling else "response",
+                           koemyd.conf.settings.idle_timeout, True)
+
+        if self.__request.is_tunneling:
+            koemyd.fetching.breaker.success(self.__request.address)
+
+            self.client.tx_buffer += koemyd.const.HTTP_CRLF.join([
+                "HTTP/1.1 200 Connection established",
+                "Proxy-Agent: %s/%s" % (
+                    koemyd.const.PROGRAM_NAME,
+                    koemyd.const.VERSION
+                ),
+                koemyd.const.HTTP_CRLF
+            ])
+
+            self.__state = self.S_TUNNEL
+        else:
+            request = koemyd.messaging.ServerRequest.procure(self.__request)
+
+            self.server.tx_buffer += request.line
+            self.server.tx_buffer += koemyd.const.CRLF
+            self.server.tx_buffer += request.head
+            self.server.tx_buffer += koemyd.const.CRLF
+
+            self.__time_requested = time.time()
+
+            if self.__request.is_expecting and self.__request.has_body: # i.e., the origin is there, go ahead
+                self.client.tx_buffer += "HTTP/1.1 100 Continue"
+                self.client.tx_buffer += koemyd.const.CRLF
+                self.client.tx_buffer += koemyd.const.CRLF
+
+            self.__size = 0
+            if "Content-Length" in self.__request.headers:
+                self.__size = long(self.__request.headers["Content-Length"])
+            self.__coder = self.__request.coder
+
+            self.__state = self.S_REQUEST_BODY
+
+    def __relay_server_reply(self, lines):
+        try:
+            response = koemyd.messaging.ServerResponse.parse_head(lines, koemyd.conf.settings.chunk_passthrough)
+        except koemyd.struct.HTTPHeaderError as e:
+            e.code = 502
+            raise e
+
+        if response.is_interim: return # i.e., 100-continue was answered here already, the final head follows
+
+        koemyd.fetching.breaker.success(self.__request.address)
+
+        koemyd.metrics.ttfb_seconds.observe(time.time() - self.__time_requested)
+
+        koemyd.logger.info("c#%s", "s#%s:p#%s:%d:r#%d:response:%s",
+                    self.uuid, self.server.uuid, self.__request.host,
+                    self.__request.port, response.code,
+                    response.reason.lower()
+            )
+
+        if not response.is_persistent:
+            self.server.is_tainted = True
+
+            koemyd.logger.info("c#%s", "s#%s:p#%s:%d:r#%d:tainted!",
+                    self.uuid, self.server.uuid, self.__request.host,
+                    self.__request.port, response.code,
+            )
+
+        if self.__request.is_persistent:
+            response.headers["Connection"] = "keep-alive"
+        else:
+            response.headers["Connection"] = "close"
+
+        expect_body = response.expects_body(self.__request)
+
+        self.__coder = response.coder if expect_body else None
+
+        self.deadlines.arm("transfer", koemyd.conf.settings.idle_timeout, True)
+
+        self.client.tx_buffer += response.line
+        self.client.tx_buffer += koemyd.const.CRLF
+        self.client.tx_buffer += response.headers.wire(koemyd.const.HTTP_HEADERS_SKIP_TO_CLIENT_KEYS)
+        self.client.tx_buffer += koemyd.const.CRLF
+
+        self.__size = 0
+        if expect_body and not self.__coder:
+            self.__size = long(response.headers["Content-Length"])
+
+        self.__state = self.S_REPLY_BODY
+
+    def __relay_encoded(self):
+        if isinstance(self.__coder, koemyd.trans.ChunkScanner):
+            self.__pipe(self.server, self.client, self.__coder.feed(self.server.rx_buffer))
+            if not self.__coder.keep_feeding: return self.__finish()
+
+            if self.server.is_eof:
+                raise koemyd.fetching.DisconnectedPeerError("p#%s:%d:rx:disconnected" % self.server.address)
+            return
+
+        if self.server.rx_buffer:
+            data = str(self.server.rx_buffer)
+            del self.server.rx_buffer[:]
+        elif self.server.is_eof:
+            if not isinstance(self.__coder, koemyd.trans.ChunkEncoder):
+                raise koemyd.fetching.DisconnectedPeerError("p#%s:%d:rx:disconnected" % self.server.address)
+            data = str() # i.e., last-chunk
+        else:
+            return
+
+        try:
+            self.__coder.feed(data)
+        except koemyd.trans.ChunksCodedException:
+            for c in self.__coder.flush():
+                self.client.tx_buffer += "%X" % c.size
+                self.client.tx_buffer += koemyd.const.HTTP_CRLF
+                self.client.tx_buffer += c.data
+                self.client.tx_buffer += koemyd.const.HTTP_CRLF
+
+        if not self.__coder.keep_feeding:
+            if isinstance(self.__coder, koemyd.trans.ChunkDecoder):
+                self.server.rx_buffer[:0] = self.__coder.cache
+                self.__state = self.S_REPLY_TRAILER
+            else:
+                self.__finish()
+
+    def __finish(self):
+        self.server.release()
+        self.server = None
+
+        koemyd.metrics.transfer_seconds.observe(time.time() - self.__time_parsed)
+
+        if self.__request.is_persistent and not self.client.is_eof:
+            self.__state = self.S_REQUEST_HEAD
+            self.__request = self.__coder = None
+
+            if self.client.rx_buffer: self.deadlines.arm("header", koemyd.conf.settings.header_timeout)
+            else:
+                self.deadlines.arm("keepalive", koemyd.conf.settings.keepalive_timeout) # i.e., idle between requests
+        else:
+            self.__state = self.S_CLOSING
+
+        return True
+
+    def __watch(self):
+        if self.__state == self.S_CLOSED: return
+
+        high, low = koemyd.conf.settings.relay_high_water, koemyd.conf.settings.relay_low_water
+        head = koemyd.const.HTTP_MAX_HEAD_LENGTH # i.e., HTTPHeadParser bounds it
+
+        self.__allowed = None
+        if self.__state in [self.S_REQUEST_BODY, self.S_REPLY_BODY, self.S_TUNNEL]:
+            self.__allowed = self.flow.allowance(koemyd.conf.settings.socket_bufsize)
+            if not self.__allowed and not self.__is_throttled: # i.e., held back rather than buffered
+                self.__is_throttled = True
+                self.reactor.wheel.schedule(self.flow.delay(), self.__unthrottle)
+
+        c_ev = EPOLL_TX if self.client.tx_buffer else 0
+        if not self.client.is_eof:
+            if self.__state == self.S_REQUEST_HEAD:
+                if len(self.client.rx_buffer) <= head: c_ev |= EPOLL_RX
+            elif self.__state in [self.S_REQUEST_BODY, self.S_TUNNEL]:
+                if len(self.client.rx_buffer) < high and not self.server.is_held(high, low) and self.__allowed:
+                    c_ev |= EPOLL_RX
+        self.client.watch(c_ev)
+
+        if not self.server or self.__state == self.S_REQUEST_HEAD: return # i.e., not while set off ahead
+
+        if self.server.is_resolving: return
+
+        if self.__state == self.S_CONNECT: s_ev = EPOLL_TX
+        else:
+            s_ev = EPOLL_TX if self.server.tx_buffer else 0
+            if not self.server.is_eof:
+                if self.__state in [self.S_REPLY_HEAD, self.S_REPLY_TRAILER]:
+                    if len(self.server.rx_buffer) <= head: s_ev |= EPOLL_RX
+                elif self.__state in [self.S_REPLY_BODY, self.S_TUNNEL]:
+                    if len(self.server.rx_buffer) < high and not self.client.is_held(high, low) and self.__allowed:
+                        s_ev |= EPOLL_RX
+        self.server.watch(s_ev)
+
+    def __unthrottle(self):
+        self.__is_throttled = False
+        self.__watch()
+
+    def error(self, code, message=None):
+        if not message: message = httplib.responses[code]
+
+        koemyd.logger.oops("c#%s", "e#%04d:%s", self.uuid, code, message.lower())
+
+        self.__cancel()
+
+        if self.__state in [self.S_REQUEST_HEAD, self.S_CONNECT, self.S_REQUEST_BODY, self.S_REPLY_HEAD]:
+            self.client.tx_buffer += str(koemyd.messaging.ErrorResponse(code, message, self.uuid))
+
+        if self.server:
+            self.server.close()
+            self.server = None
+
+        self.__state = self.S_CLOSING
+
+        if not self.client.tx_buffer: self.close()
+
+    def close(self):
+        if self.__state == self.S_CLOSED: return
+
+        self.deadlines.close()
+        self.flow.close()
+
+        self.__cancel()
+        if self.server: self.server.close()
+        self.client.close()
+
+        self.reactor.channels.discard(self)
+        self.__state = self.S_CLOSED
+
+        koemyd.metrics.connections_active.dec()
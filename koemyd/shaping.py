@@ -0,0 +1,137 @@
+# vi:ts=4:sw=4:syn=python
+
+import time
+import threading
+
+import koemyd.conf
+import koemyd.const
+import koemyd.metrics
+
+class TokenBucket(object):
+    def __init__(self, rate):
+        self.rate = rate # i.e., bytes per second
+        self.burst = max(rate * koemyd.const.SHAPING_BURST, koemyd.const.SHAPING_QUANTUM)
+        self.low = min(koemyd.const.SHAPING_QUANTUM, self.burst) # i.e., below it reads are held back
+
+        self.tokens = self.burst
+        self.time_last_fill = time.time()
+
+        self.flows = 0
+
+    def fill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.time_last_fill) * self.rate)
+        self.time_last_fill = now
+
+    @property
+    def share(self): return max(self.low, self.burst / max(1, self.flows)) # i.e., per take, when contended
+
+class Shaper(object):
+    def __init__(self, client_rate, server_rate, global_rate):
+        self.client_rate = client_rate
+        self.server_rate = server_rate
+        self.global_rate = global_rate
+
+        self.__lock = threading.Lock()
+        self.__buckets = dict() # (kind, key): TokenBucket, while a flow draws from it
+
+        self.throttled = 0
+
+    @property
+    def is_enabled(self): return bool(self.client_rate or self.server_rate or self.global_rate)
+
+    def flow(self, client_host): return Flow(self, client_host)
+
+    def attach(self, kind, key, rate):
+        with self.__lock:
+            bucket = self.__buckets.get((kind, key))
+            if not bucket: bucket = self.__buckets[(kind, key)] = TokenBucket(rate)
+
+            bucket.flows += 1
+
+        return bucket
+
+    def detach(self, kind, key):
+        with self.__lock:
+            bucket = self.__buckets[(kind, key)]
+
+            bucket.flows -= 1
+            if not bucket.flows: del self.__buckets[(kind, key)]
+
+    def allowance(self, buckets, n):
+        now = time.time()
+        with self.__lock:
+            for bucket in buckets:
+                bucket.fill(now)
+                n = min(n, bucket.share if bucket.tokens >= bucket.low else 0, bucket.tokens)
+
+        return max(0, int(n))
+
+    def consume(self, buckets, n):
+        with self.__lock:
+            for bucket in buckets: bucket.tokens -= n # i.e., may go into debt, repaid by waiting
+
+    def delay(self, buckets):
+        with self.__lock:
+            self.throttled += 1
+            return max([(b.low - b.tokens) / b.rate for b in buckets] + [koemyd.const.SHAPING_MIN_DELAY])
+
+    @property
+    def stats(self):
+        return {"buckets": len(self.__buckets), "throttled": self.throttled}
+
+class Flow(object): # i.e., one connection's draw on the buckets it's subject to, both ways
+    __slots__ = ("shaper", "__attached", "__buckets", "__server_host")
+
+    def __init__(self, shaper, client_host):
+        self.shaper = shaper
+
+        self.__attached = [] # i.e., [(kind, key), ...]
+        self.__buckets = []
+        self.__server_host = None
+
+        if shaper.global_rate: self.__attach("global", None, shaper.global_rate)
+        if shaper.client_rate and client_host:
+            self.__attach("client", client_host, shaper.client_rate)
+
+    def __attach(self, kind, key, rate):
+        self.__buckets.append(self.shaper.attach(kind, key, rate))
+        self.__attached.append((kind, key))
+
+    def route(self, server_host): # i.e., per request, keep-alive clients may move between hosts
+        if not self.shaper.server_rate or server_host == self.__server_host: return
+
+        if self.__server_host:
+            i = self.__attached.index(("server", self.__server_host))
+            del self.__attached[i], self.__buckets[i]
+            self.shaper.detach("server", self.__server_host)
+
+        self.__server_host = server_host
+        self.__attach("server", server_host, self.shaper.server_rate)
+
+    def allowance(self, n): return self.shaper.allowance(self.__buckets, n) if self.__buckets else n
+
+    def consume(self, n):
+        if self.__buckets and n: self.shaper.consume(self.__buckets, n)
+
+    def delay(self): return self.shaper.delay(self.__buckets)
+
+    def wait(self, n): # i.e., blocking, for the threaded engine
+        while True:
+            a = self.allowance(n)
+            if a:
+                self.consume(a)
+                return a
+
+            time.sleep(self.delay())
+
+    def close(self):
+        for kind, key in self.__attached: self.shaper.detach(kind, key)
+        self.__attached, self.__buckets, self.__server_host = [], [], None
+
+shaper = Shaper(
+    koemyd.conf.settings.client_rate_limit,
+    koemyd.conf.settings.server_rate_limit,
+    koemyd.conf.settings.global_rate_limit,
+)
+
+koemyd.metrics.registry.stats("koemyd_shaper", lambda: shaper.stats)
@@ -0,0 +1,61 @@
+# vi:ts=4:sw=4:syn=python
+
+import os
+import sys
+
+import fcntl
+import ctypes
+import ctypes.util
+
+SPLICE_F_MOVE     = 0x01
+SPLICE_F_NONBLOCK = 0x02
+SPLICE_F_MORE     = 0x04
+
+F_SETPIPE_SZ = 1031 # cf. fcntl(2), linux >= 2.6.35
+
+def _bind():
+    if not sys.platform.startswith("linux"): return None
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fn = libc.splice
+    except (OSError, AttributeError):
+        return None
+
+    fn.argtypes = [
+        ctypes.c_int, ctypes.c_void_p,
+        ctypes.c_int, ctypes.c_void_p,
+        ctypes.c_size_t, ctypes.c_uint,
+    ]
+    fn.restype = ctypes.c_ssize_t
+
+    return fn
+
+_splice = _bind()
+
+is_available = _splice is not None
+
+def splice(fd_in, fd_out, size, flags=SPLICE_F_MOVE | SPLICE_F_NONBLOCK):
+    n = _splice(fd_in, None, fd_out, None, size, flags)
+    if n < 0:
+        e_n = ctypes.get_errno()
+        raise OSError(e_n, os.strerror(e_n))
+
+    return n
+
+class Pipe(object):
+    def __init__(self, size):
+        self.r, self.w = os.pipe()
+
+        try: fcntl.fcntl(self.w, F_SETPIPE_SZ, size)
+        except IOError: pass
+
+        self.size = size
+        self.queued = 0
+        self.is_full = False # i.e., out of slots, however few bytes are queued
+        self.is_shut = False # i.e., its rx side is done, and the tx side was told so
+
+    def close(self):
+        for fd in [self.r, self.w]:
+            try: os.close(fd)
+            except OSError: pass
@@ -6,21 +6,34 @@ import koemyd.base
 import koemyd.const
 
 class HTTPMessage(koemyd.base.UUIDObject):
+    __slots__ = ("line", "headers")
+
     def __init__(self, line):
         super(HTTPMessage, self).__init__()
 
         self.line, self.headers = line, HTTPHeaders()
 
     @property
-    def head(self):
-        m = bytearray()
-        for header in self.headers.iteritems():
-            m += "%s: %s" % header
-            m += koemyd.const.CRLF
+    def head(self): return self.headers.wire()
+
+    @classmethod
+    def parse_head(cls, lines, *args):
+        message = cls(lines[0], *args)
+        for line in lines[1:]:
+            k, v = message.headers.parse(line)
+            message.headers.add(k, v)
+
+        if "Content-Length" in message.headers: # cf. Section 3.3.2 of [RFC7230], i.e., identical ones fold into one
+            values = set(v.strip() for v in message.headers["Content-Length"].split(","))
+            if not (len(values) == 1 and next(iter(values)).isdigit()):
+                raise HTTPHeaderError(400, "header:content-length:%s:invalid" % message.headers["Content-Length"])
+            message.headers["Content-Length"] = values.pop()
 
-        return str(m)
+        return message
 
 class HTTPRequest(HTTPMessage):
+    __slots__ = ("method", "uri", "http_version")
+
     def __init__(self, line=str()):
         super(HTTPRequest, self).__init__(line)
 
@@ -33,6 +46,8 @@ class HTTPRequest(HTTPMessage):
             raise HTTPRequestError(405, "request:%s:not allowed" % self.method)
 
 class HTTPResponse(HTTPMessage):
+    __slots__ = ("http_version", "code", "reason")
+
     def __init__(self, line=str()):
         super(HTTPResponse, self).__init__(line)
 
@@ -46,36 +61,74 @@ class HTTPResponse(HTTPMessage):
     def expect_body(self): # cf. Section 3.3 of [RFC7230]
         return True if self.code not in [100, 101, 204, 304] else False
 
-class HTTPHeaders(dict):
-    def __init__(self, *args, **kwargs):
-        super(HTTPHeaders, self).__init__(*args, **kwargs)
+    @property
+    def is_interim(self): # cf. Section 6.2 of [RFC7231], i.e., another head follows
+        return 100 <= self.code < 200 and not self.code == 101
+
+class HTTPHeaders(object):
+    __slots__ = ("__fields", "__entries", "__wires")
+
+    PRIO = dict((k.lower(), i) for i, k in enumerate(koemyd.const.HTTP_HEADERS_SORT_PRIO_KEYS))
+
+    def __init__(self):
+        self.__fields = dict() # k.lower(): (k, [v, ...])
+        self.__entries = None  # i.e., cached, ordered [(k.lower(), k, v), ...]
+        self.__wires = dict()  # skip: cached wire form
 
-    def __contains__(self, k): return k.title() in map(str.title, self.keys())
+    def __invalidate(self): self.__entries, self.__wires = None, dict()
 
-    def __getitem__(self, k):
-        for cs_k in self.keys():
-            if k.title() == cs_k.title(): k = cs_k
-        return super(HTTPHeaders, self).__getitem__(k)
+    def __len__(self): return len(self.__fields)
+
+    def __iter__(self): return iter(self.keys())
+
+    def __contains__(self, k): return k.lower() in self.__fields
+
+    def __getitem__(self, k): return ", ".join(self.__fields[k.lower()][1])
 
     def __setitem__(self, k, v):
-        for cs_k in self.keys():
-            if k.title() == cs_k.title(): k = cs_k
-        super(HTTPHeaders, self).__setitem__(k, v.strip())
+        n = k.lower()
+        if n in self.__fields: k = self.__fields[n][0]
+        self.__fields[n] = (k, [v.strip()])
+        self.__invalidate()
 
     def __delitem__(self, k):
-        for cs_k in self.keys():
-            if k.title() == cs_k.title():
-                super(HTTPHeaders, self).__delitem__(cs_k)
+        if self.__fields.pop(k.lower(), None): self.__invalidate()
+
+    def add(self, k, v): # i.e., repeated fields, e.g., Set-Cookie
+        n = k.lower()
+        if n in self.__fields: self.__fields[n][1].append(v.strip())
+        else:
+            self.__fields[n] = (k, [v.strip()])
+        self.__invalidate()
+
+    def get(self, k, default=None): return self[k] if k in self else default
+
+    def getall(self, k): return list(self.__fields[k.lower()][1]) if k in self else []
+
+    def keys(self): return [k for k, _ in self.__fields.values()]
 
-    def __fn_order(self, i, p=koemyd.const.HTTP_HEADERS_SORT_PRIO_KEYS):
-        k, v = map(str.title, i)
-        p = tuple(map(str.title, p))
-        return (p.index(k) if k in p else len(p), i)
+    def __order(self):
+        if self.__entries is None:
+            p = len(self.PRIO)
+            self.__entries = sorted(
+                ((n, k, v) for n, (k, vs) in self.__fields.iteritems() for v in vs),
+                key=lambda (n, k, v): (self.PRIO.get(n, p), k, v)
+            )
+
+        return self.__entries
 
     def iteritems(self):
-        i = super(HTTPHeaders, self).iteritems()
-        headers = sorted(i, key=self.__fn_order)
-        for k, v in headers: yield (k, v)
+        for _, k, v in self.__order(): yield (k, v)
+
+    def items(self): return list(self.iteritems())
+
+    def wire(self, skip=frozenset()):
+        if skip not in self.__wires:
+            self.__wires[skip] = str().join([
+                "%s: %s%s" % (k, v, koemyd.const.CRLF) for n, k, v in self.__order() if n not in skip
+            ])
+
+        return self.__wires[skip]
 
     @staticmethod
     def parse(line):
@@ -87,7 +140,47 @@ class HTTPHeaders(dict):
             except ValueError:
                 return tuple(line, str())
 
+class HTTPHeadParser(object):
+    __slots__ = ("max_head_length", "max_line_length", "__scanned")
+
+    def __init__(self, max_head_length=koemyd.const.HTTP_MAX_HEAD_LENGTH,
+                       max_line_length=koemyd.const.HTTP_MAX_LINE_LENGTH):
+        self.max_head_length = max_head_length
+        self.max_line_length = max_line_length
+
+        self.__scanned = 0
+
+    def parse(self, buffer): # i.e., consumes the head off buffer, if complete
+        while buffer[:1] in ["\r", "\n"]: del buffer[:1]
+
+        s_i = max(0, self.__scanned - 3)
+        e_s = [(i, n) for i, n in [(buffer.find("\r\n\r\n", s_i), 4), (buffer.find("\n\n", s_i), 2)] if i >= 0]
+        if not e_s:
+            self.__scanned = len(buffer)
+
+            if len(buffer) > self.max_head_length:
+                raise HTTPHeaderError(400, "head:maximum length exceeded")
+            if (len(buffer) - buffer.rfind("\n") - 1) > self.max_line_length:
+                raise HTTPHeaderError(400, "head:line:maximum length exceeded")
+
+            return None
+
+        i, n = min(e_s)
+        if i > self.max_head_length:
+            raise HTTPHeaderError(400, "head:maximum length exceeded")
+
+        lines = [l.rstrip("\r") for l in str(buffer[:i]).split("\n")]
+        if max(map(len, lines)) > self.max_line_length:
+            raise HTTPHeaderError(400, "head:line:maximum length exceeded")
+
+        del buffer[:i + n] # i.e., what is left is body
+        self.__scanned = 0
+
+        return lines
+
 class HTTPChunk(object):
+    __slots__ = ("size", "data")
+
     def __init__(self): self.size, self.data = int(), str()
 
 class HTTPError(Exception):
@@ -0,0 +1,204 @@
+# vi:ts=4:sw=4:syn=python
+
+import math
+import time
+import threading
+import traceback
+
+import koemyd.const
+import koemyd.logger
+import koemyd.metrics
+
+class Timer(object):
+    __slots__ = ("expires", "fn", "args", "slot")
+
+    def __init__(self, expires, fn, args):
+        self.expires = expires # i.e., in ticks
+        self.fn = fn
+        self.args = args
+
+        self.slot = None # i.e., the set it's pending in
+
+class TimerWheel(object): # cf. Varghese & Lauck, "Hashed and Hierarchical Timing Wheels"
+    def __init__(self, resolution=koemyd.const.TIMING_RESOLUTION,
+                       bits=koemyd.const.TIMING_WHEEL_BITS,
+                       levels=koemyd.const.TIMING_WHEEL_LEVELS):
+        self.resolution = resolution
+
+        self.__bits = bits
+        self.__mask = (1 << bits) - 1
+        self.__wheels = [[set() for _ in xrange(1 << bits)] for _ in xrange(levels)]
+        self.__span = (1 << (bits * levels)) - 1 # i.e., in ticks, longer ones are cascaded back
+
+        self.__lock = threading.Lock()
+        self.__time_origin = time.time()
+        self.__tick = 0 # i.e., next one to run
+
+        self.pending = self.fired = 0
+
+    def __ticks(self, t): return (t - self.__time_origin) / self.resolution
+
+    def schedule(self, delay, fn, *args):
+        with self.__lock:
+            timer = Timer(int(math.ceil(self.__ticks(time.time() + delay))), fn, args)
+            self.__add(timer)
+            self.pending += 1
+
+        return timer
+
+    def cancel(self, timer):
+        with self.__lock:
+            if timer.slot is None: return False
+
+            timer.slot.discard(timer)
+            timer.slot = None
+            self.pending -= 1
+
+        return True
+
+    def __add(self, timer):
+        delta = min(max(0, timer.expires - self.__tick), self.__span)
+        expires = self.__tick + delta
+
+        level = 0
+        while delta > self.__mask and level < len(self.__wheels) - 1:
+            delta >>= self.__bits
+            level += 1
+
+        timer.slot = self.__wheels[level][(expires >> (self.__bits * level)) & self.__mask]
+        timer.slot.add(timer)
+
+    def __cascade(self, level, i):
+        slot = self.__wheels[level][i]
+        self.__wheels[level][i] = set()
+
+        for timer in slot: self.__add(timer)
+
+    def advance(self, now=None): # i.e., runs every tick due, fires their timers in one batch
+        target = int(self.__ticks(now or time.time()))
+
+        expired = []
+        with self.__lock:
+            if not self.pending: self.__tick = max(self.__tick, target + 1)
+
+            while self.__tick <= target:
+                i, level = self.__tick & self.__mask, 1
+                while not i and level < len(self.__wheels):
+                    i = (self.__tick >> (self.__bits * level)) & self.__mask
+                    self.__cascade(level, i)
+                    level += 1
+
+                i = self.__tick & self.__mask
+                self.__tick += 1
+
+                slot = self.__wheels[0][i]
+                if slot:
+                    self.__wheels[0][i] = set()
+                    expired.extend(slot)
+
+            for timer in expired: timer.slot = None
+
+            self.pending -= len(expired)
+            self.fired += len(expired)
+
+        for timer in expired:
+            try:
+                timer.fn(*timer.args)
+            except Exception: # i.e., never lose the ticker
+                koemyd.logger.oops("timing", "%s", traceback.format_exc())
+
+        return len(expired)
+
+    def start(self): # i.e., once per process, threads don't survive fork(2)
+        ticker = threading.Thread(target=self.__tick_forever, name="ticker")
+        ticker.daemon = True
+        ticker.start()
+
+    def __tick_forever(self):
+        while True:
+            time.sleep(self.resolution)
+            self.advance()
+
+    @property
+    def stats(self): return {"pending": self.pending, "fired": self.fired}
+
+class Deadlines(object): # i.e., one connection's, a single phase armed at a time plus its lifetime
+    __slots__ = ("wheel", "fn", "time_last_op", "armed", "expired",
+                 "__lock", "__timeout", "__time_due", "__is_idle", "__generation", "__timer", "__timer_due", "__lifetime")
+
+    def __init__(self, wheel, fn, lifetime=0):
+        self.wheel = wheel
+        self.fn = fn # i.e., called with the name of the deadline that went off
+
+        self.time_last_op = time.time() # i.e., touched on progress, checked lazily on expiry
+        self.armed = self.expired = None
+
+        self.__lock = threading.Lock()
+        self.__timeout = self.__time_due = 0
+        self.__is_idle = False
+
+        self.__generation = 0
+        self.__timer = None
+        self.__timer_due = 0
+
+        self.__lifetime = wheel.schedule(lifetime, self.__expire, "lifetime") if lifetime else None
+
+    def arm(self, name, timeout, is_idle=False): # i.e., the wheel is only touched when it's due earlier
+        with self.__lock:
+            self.armed = None
+            if not timeout or self.expired: return
+
+            now = self.time_last_op = time.time()
+
+            self.armed = name
+            self.__timeout, self.__is_idle = timeout, is_idle
+            self.__time_due = now + timeout
+
+            if self.__timer and self.__timer_due <= self.__time_due: return
+
+            if self.__timer: self.wheel.cancel(self.__timer)
+            self.__schedule(self.__time_due, now)
+
+    def disarm(self): # i.e., its timer is left pending, to go off idle or be picked up by the next arm
+        with self.__lock: self.armed = None
+
+    def close(self):
+        with self.__lock:
+            self.armed = None
+
+            if self.__timer: self.wheel.cancel(self.__timer)
+            if self.__lifetime: self.wheel.cancel(self.__lifetime)
+
+            self.fn = None # i.e., it's bound to the connection, no cycle left for the gc to find
+
+    def __schedule(self, time_due, now):
+        self.__generation += 1 # i.e., one already on its way is ignored
+        self.__timer = self.wheel.schedule(time_due - now, self.__fire, self.__generation)
+        self.__timer_due = time_due
+
+    def __fire(self, generation):
+        with self.__lock:
+            if not generation == self.__generation: return
+            self.__timer = None
+
+            if not self.armed: return
+
+            time_due = self.time_last_op + self.__timeout if self.__is_idle else self.__time_due
+
+            now = time.time()
+            if time_due > now: return self.__schedule(time_due, now) # i.e., pushed back meanwhile
+
+            name = self.armed
+
+        self.__expire(name)
+
+    def __expire(self, name):
+        with self.__lock:
+            if self.expired or not self.fn: return
+            self.expired, fn = name, self.fn
+
+        fn(name) # i.e., not held, fn may well close the connection
+
+wheel = TimerWheel() # i.e., ticked from its own thread, or advanced by the reactor loop
+
+koemyd.metrics.registry.stats("koemyd_timers", lambda: wheel.stats)
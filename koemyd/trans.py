@@ -1,10 +1,20 @@
 # vi:ts=4:sw=4:syn=python
 
+import re
+
 import koemyd.util
 import koemyd.const
 import koemyd.struct
 
+CHUNK_SIZE = re.compile(r"([0-9A-Fa-f]+)(?:;.*)?\Z") # cf. Section 4.1 of [RFC7230], i.e., no sign, prefix nor padding
+
+def chunk_size(line):
+    m = CHUNK_SIZE.match(line)
+    return long(m.group(1), 16) if m else None
+
 class Coder(object):
+    __slots__ = ("keep_feeding",)
+
     def __init__(self, k_f=False): self.keep_feeding = k_f
 
     def feed(self, data): raise NotImplementedError
@@ -14,18 +24,16 @@ class CoderException(Exception): pass
 class CoderError(Exception): pass
 
 class ChunkCoder(Coder):
+    __slots__ = ("_chunk", "_chunk_queue", "cache")
+
     def __init__(self):
         super(ChunkCoder, self).__init__(k_f=True)
 
         self._chunk = koemyd.struct.HTTPChunk()
         self._chunk_queue = list()
-        self._chunks = list()
 
         self.cache = str()
 
-    @property
-    def body(self): return str().join([c.data for c in self._chunks])
-
     def flush(self):
         chunks = self._chunk_queue
         self._chunk_queue = []
@@ -34,6 +42,8 @@ class ChunkCoder(Coder):
 class ChunksCodedException(Exception): pass
 
 class ChunkDecoder(ChunkCoder):
+    __slots__ = ("__decoder",)
+
     def __init__(self):
         super(ChunkDecoder, self).__init__()
 
@@ -52,9 +62,8 @@ class ChunkDecoder(ChunkCoder):
 
             self.cache = self.cache[s_i + 2:] # HTTP_CRLF
 
-            try:
-                self._chunk.size = long(s_s, 16)
-            except ValueError:
+            self._chunk.size = chunk_size(str(s_s))
+            if self._chunk.size is None:
                 raise ChunkDecoderError("chunk-size:could not parse")
 
             if 0 == self._chunk.size: # i.e., last-chunk
@@ -64,6 +73,9 @@ class ChunkDecoder(ChunkCoder):
 
             while len(self.cache) < (self._chunk.size + 2): self.cache += (yield)
 
+            if not self.cache[self._chunk.size:self._chunk.size + 2] == koemyd.const.HTTP_CRLF:
+                raise ChunkDecoderError("chunk-data:missing CRLF")
+
             self._chunk.data = self.cache[:self._chunk.size]
             self.cache = self.cache[self._chunk.size + 2:]
             self._chunk_queue.append(self._chunk) # next
@@ -83,6 +95,8 @@ class ChunksDecodedException(ChunksCodedException): pass
 class ChunkDecoderError(CoderError): pass
 
 class ChunkEncoder(ChunkCoder):
+    __slots__ = ()
+
     def __init__(self):
         super(ChunkEncoder, self).__init__()
 
@@ -107,3 +121,64 @@ class ChunkEncoder(ChunkCoder):
 class ChunkEncodedException(ChunksCodedException): pass
 
 class ChunkEncoderError(CoderError): pass
+
+class ChunkScanner(Coder):
+    __slots__ = ("max_line_length", "__state", "__line", "__left")
+
+    S_SIZE     = 0x00
+    S_DATA     = 0x01
+    S_DATA_END = 0x02 # i.e., the CRLF closing chunk-data, on its own line
+    S_TRAILER  = 0x03
+
+    def __init__(self, max_line_length=0x1000):
+        super(ChunkScanner, self).__init__(k_f=True)
+
+        self.max_line_length = max_line_length
+
+        self.__state = self.S_SIZE
+        self.__line = str() # i.e., a partial line, across feeds
+        self.__left = 0
+
+    def feed(self, data=str()):
+        i, n = 0, len(data)
+        while self.keep_feeding and i < n:
+            if self.__state == self.S_DATA:
+                m = min(self.__left, n - i)
+                self.__left -= m
+                i += m
+
+                if not self.__left: self.__state = self.S_DATA_END
+
+                continue
+
+            j = data.find('\n', i)
+            if ((j if j >= 0 else n) - i + len(self.__line)) > self.max_line_length:
+                raise ChunkScannerError("line:maximum length exceeded")
+
+            if j < 0:
+                self.__line += str(data[i:])
+                return n
+
+            line = self.__line + str(data[i:j])
+            self.__line = str()
+            i = j + 1
+
+            if self.__state == self.S_SIZE:
+                size = chunk_size(line[:-1] if line.endswith('\r') else line)
+                if size is None:
+                    raise ChunkScannerError("chunk-size:could not parse")
+
+                if size: self.__state, self.__left = self.S_DATA, size
+                else:
+                    self.__state = self.S_TRAILER # i.e., last-chunk
+            elif self.__state == self.S_DATA_END:
+                if line not in ["", "\r"]: # i.e., framed otherwise upstream, cf. request smuggling
+                    raise ChunkScannerError("chunk-data:missing CRLF")
+
+                self.__state = self.S_SIZE
+            elif not line.strip(koemyd.const.HTTP_CRLF):
+                self.keep_feeding = False
+
+        return i
+
+class ChunkScannerError(CoderError): pass
@@ -0,0 +1,124 @@
+# vi:ts=4:sw=4:syn=python
+
+import sys
+import socket
+
+import koemyd.conf
+import koemyd.logger
+
+IS_LINUX = sys.platform.startswith("linux")
+
+# cf. tcp(7), most of which python 2's socket module doesn't carry
+TCP_KEEPIDLE         = getattr(socket, "TCP_KEEPIDLE",  4 if IS_LINUX else None)
+TCP_KEEPINTVL        = getattr(socket, "TCP_KEEPINTVL", 5 if IS_LINUX else None)
+TCP_KEEPCNT          = getattr(socket, "TCP_KEEPCNT",   6 if IS_LINUX else None)
+TCP_DEFER_ACCEPT     = getattr(socket, "TCP_DEFER_ACCEPT", 9 if IS_LINUX else None)
+TCP_QUICKACK         = getattr(socket, "TCP_QUICKACK", 12 if IS_LINUX else None)
+TCP_FASTOPEN         = getattr(socket, "TCP_FASTOPEN", 23 if IS_LINUX else None)
+TCP_FASTOPEN_CONNECT = getattr(socket, "TCP_FASTOPEN_CONNECT", 30 if IS_LINUX else None) # i.e., linux >= 4.11
+
+SOMAXCONN_PATH = "/proc/sys/net/core/somaxconn"
+
+class Profile(object):
+    def __init__(self):
+        s = koemyd.conf.settings
+
+        # (name, level, option, value), a value of 0 leaves the kernel's default alone
+        peer = [
+            ("nodelay",   socket.IPPROTO_TCP, socket.TCP_NODELAY, int(s.tcp_nodelay)),
+            ("rcvbuf",    socket.SOL_SOCKET,  socket.SO_RCVBUF,   s.socket_rcvbuf),
+            ("sndbuf",    socket.SOL_SOCKET,  socket.SO_SNDBUF,   s.socket_sndbuf),
+            ("keepidle",  socket.IPPROTO_TCP, TCP_KEEPIDLE,       s.tcp_keepidle),
+            ("keepintvl", socket.IPPROTO_TCP, TCP_KEEPINTVL,      s.tcp_keepintvl),
+            ("keepcnt",   socket.IPPROTO_TCP, TCP_KEEPCNT,        s.tcp_keepcnt),
+        ]
+
+        # i.e., accepted sockets inherit these off the listener, so clients get them without a syscall
+        self.listener = self.__supported([
+            ("defer_accept", socket.IPPROTO_TCP, TCP_DEFER_ACCEPT, s.listen_defer_accept),
+            ("fastopen",     socket.IPPROTO_TCP, TCP_FASTOPEN,     s.listen_fastopen),
+        ] + peer)
+
+        # i.e., quickack is not sticky, the kernel drops back to delayed acks on its own
+        self.client = self.__supported([
+            ("quickack", socket.IPPROTO_TCP, TCP_QUICKACK, int(s.tcp_quickack)),
+        ])
+
+        self.upstream = self.__supported(peer + [
+            ("quickack",         socket.IPPROTO_TCP, TCP_QUICKACK,         int(s.tcp_quickack)),
+            ("fastopen_connect", socket.IPPROTO_TCP, TCP_FASTOPEN_CONNECT, int(s.tcp_fastopen)),
+        ])
+
+        self.effective = dict() # i.e., as read back once in place, see report()
+
+    @staticmethod
+    def __supported(options):
+        for name, _, option, value in options:
+            if value and option is None:
+                koemyd.logger.warn("tuning", "%s:%d:not supported on %s" % (name, value, sys.platform))
+
+        return [o for o in options if o[3] and o[2] is not None]
+
+    @staticmethod
+    def __apply(sock, options):
+        for o in list(options):
+            name, level, option, value = o
+            try:
+                sock.setsockopt(level, option, value)
+            except socket.error as (_, m):
+                if o in options: options.remove(o) # i.e., the kernel won't have it, not tried again
+                koemyd.logger.warn("tuning", "%s:%d:could not set (%s)" % (name, value, m.lower()))
+
+        return sock
+
+    def tune_listener(self, sock): return self.__apply(sock, self.listener)
+    def tune_client(self, sock): return self.__apply(sock, self.client)
+    def tune_upstream(self, sock): return self.__apply(sock, self.upstream)
+
+    @staticmethod
+    def __read(sock, names):
+        values = dict()
+        for name, level, option in names:
+            if option is None: continue
+            try: values[name] = sock.getsockopt(level, option)
+            except socket.error: pass
+
+        return values
+
+    def report(self, sock, backlog): # i.e., what the kernel made of it, e.g., it doubles buffer sizes
+        names = [
+            ("nodelay",   socket.IPPROTO_TCP, socket.TCP_NODELAY),
+            ("rcvbuf",    socket.SOL_SOCKET,  socket.SO_RCVBUF),
+            ("sndbuf",    socket.SOL_SOCKET,  socket.SO_SNDBUF),
+            ("keepidle",  socket.IPPROTO_TCP, TCP_KEEPIDLE),
+            ("keepintvl", socket.IPPROTO_TCP, TCP_KEEPINTVL),
+            ("keepcnt",   socket.IPPROTO_TCP, TCP_KEEPCNT),
+        ]
+
+        listener = self.__read(sock, [
+            ("defer_accept", socket.IPPROTO_TCP, TCP_DEFER_ACCEPT),
+            ("fastopen",     socket.IPPROTO_TCP, TCP_FASTOPEN),
+        ])
+        listener["backlog"] = min(backlog, somaxconn() or backlog) # i.e., silently capped by the kernel
+
+        client = self.__read(sock, names) # i.e., inherited on accept(2)
+        client["quickack"] = int(any(o[0] == "quickack" for o in self.client)) # i.e., set per connection, not read back
+
+        probe = self.tune_upstream(socket.socket(socket.AF_INET, socket.SOCK_STREAM))
+        try:
+            upstream = self.__read(probe, names + [("fastopen_connect", socket.IPPROTO_TCP, TCP_FASTOPEN_CONNECT)])
+        finally:
+            probe.close()
+        upstream["quickack"] = int(any(o[0] == "quickack" for o in self.upstream))
+
+        for side, values in [("listener", listener), ("client", client), ("upstream", upstream)]:
+            koemyd.logger.info("daemon", "tuning:%s:%s" % (side, ",".join("%s=%d" % kv for kv in sorted(values.items()))))
+            self.effective.update(("%s_%s" % (side, k), v) for k, v in values.iteritems())
+
+def somaxconn():
+    try:
+        with open(SOMAXCONN_PATH) as f: return int(f.read())
+    except (EnvironmentError, ValueError):
+        return None
+
+profile = Profile()
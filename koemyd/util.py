@@ -2,11 +2,44 @@
 
 import os
 import sys
+import errno
+import select
 
 import traceback
 
 def dump(d): return ':'.join("%02x" % ord(d_b) for d_b in str(d))
 
+class HexDump(object): # i.e., dump(), deferred to when the record gets formatted
+    def __init__(self, d, default=str()):
+        self.d = d
+        self.default = default
+
+    def __str__(self): return dump(self.d) or self.default
+
+POLL_RX = select.POLLIN | select.POLLPRI | select.POLLHUP | select.POLLERR
+POLL_TX = select.POLLOUT | select.POLLHUP | select.POLLERR
+
+def wait(rsocks, wsocks, timeout=None): # i.e., select(2) as is, without its FD_SETSIZE ceiling, cf. poll(2)
+    p, socks = select.poll(), dict()
+    for s in rsocks:
+        socks[s.fileno()] = s
+        p.register(s, select.POLLIN | select.POLLPRI)
+    for s in wsocks:
+        socks[s.fileno()] = s
+        p.register(s, (select.POLLIN | select.POLLPRI if s in rsocks else 0) | select.POLLOUT) # i.e., registered again, modified
+
+    while True:
+        try:
+            events = p.poll(timeout * 1000 if timeout is not None else None)
+            break
+        except select.error as (e_n, _):
+            if e_n != errno.EINTR: raise
+
+    r = [socks[fd] for fd, ev in events if ev & POLL_RX and socks[fd] in rsocks]
+    w = [socks[fd] for fd, ev in events if ev & POLL_TX and socks[fd] in wsocks]
+
+    return r, w
+
 def hook(exc_type, value, tb):
     exc = traceback.format_exception(exc_type, value, tb)
     sys.stderr.write(os.linesep.join(exc))
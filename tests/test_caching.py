@@ -0,0 +1,165 @@
+# vi:ts=4:sw=4:syn=python
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import email.utils
+
+import koemyd.const
+koemyd.const.SETTINGS_PROGRAM_CONFIG_FILE = os.devnull # i.e., defaults, rather than a koemyd.conf left in the working directory
+
+import koemyd.caching
+import koemyd.messaging
+
+T = 1500000000.0
+
+def request(*headers, **kwargs):
+    lines = ["%s http://example.com/a HTTP/1.1" % kwargs.get("method", "GET"), "Host: example.com"]
+    return koemyd.messaging.ClientRequest.parse_head(lines + list(headers))
+
+def response(*headers, **kwargs):
+    return koemyd.messaging.ServerResponse.parse_head(["HTTP/1.1 %d OK" % kwargs.get("code", 200)] + list(headers))
+
+def date(t): return email.utils.formatdate(t, usegmt=True)
+
+class FreshnessTest(unittest.TestCase):
+    def entry(self, *headers, **kwargs):
+        time_requested = kwargs.get("time_requested", T)
+        return koemyd.caching.CacheEntry("k", request(), response(*headers), time_requested, T, 0x1000)
+
+    def test_max_age(self):
+        entry = self.entry("Cache-Control: max-age=60")
+        self.assertEqual(entry.lifetime, 60)
+        self.assertTrue(entry.is_fresh(request(), T + 59))
+        self.assertFalse(entry.is_fresh(request(), T + 60))
+
+    def test_s_maxage(self):
+        self.assertEqual(self.entry("Cache-Control: max-age=60, s-maxage=10").lifetime, 10)
+
+    def test_no_cache(self):
+        self.assertEqual(self.entry("Cache-Control: no-cache, max-age=60").lifetime, 0)
+        self.assertEqual(self.entry("Cache-Control: max-age=-1").lifetime, 0)
+
+    def test_expires(self):
+        entry = self.entry("Date: %s" % date(T - 10), "Expires: %s" % date(T + 20))
+        self.assertEqual(entry.lifetime, 30)
+        self.assertEqual(entry.initial_age, 10)
+        self.assertTrue(entry.is_fresh(request(), T + 19))
+        self.assertFalse(entry.is_fresh(request(), T + 20))
+
+        self.assertEqual(self.entry("Expires: 0").lifetime, 0)
+
+    def test_heuristic(self):
+        entry = self.entry("Date: %s" % date(T), "Last-Modified: %s" % date(T - 1000))
+        self.assertEqual(entry.lifetime, 100)
+
+    def test_age(self):
+        entry = self.entry("Cache-Control: max-age=60", "Age: 50", time_requested=T - 2)
+        self.assertEqual(entry.initial_age, 52)
+        self.assertEqual(entry.age(T + 5), 57)
+        self.assertFalse(entry.is_fresh(request(), T + 8))
+
+    def test_request_directives(self):
+        entry = self.entry("Cache-Control: max-age=60")
+        self.assertFalse(entry.is_fresh(request("Cache-Control: no-cache"), T))
+        self.assertFalse(entry.is_fresh(request("Pragma: no-cache"), T))
+        self.assertFalse(entry.is_fresh(request("Cache-Control: max-age=10"), T + 10))
+        self.assertTrue(entry.is_fresh(request("Cache-Control: max-age=10"), T + 9))
+        self.assertFalse(entry.is_fresh(request("Cache-Control: min-fresh=30"), T + 30))
+
+    def test_freshen(self):
+        entry = self.entry("Cache-Control: max-age=60", "ETag: \"a\"", "Content-Length: 5")
+        entry.freshen(response("Cache-Control: max-age=120", "Content-Length: 0", code=304), T + 100, T + 100)
+        self.assertEqual(entry.lifetime, 120)
+        self.assertEqual(entry.headers["ETag"], "\"a\"")
+        self.assertEqual(entry.headers["Content-Length"], "5")
+        self.assertTrue(entry.is_fresh(request(), T + 219))
+
+class CacheTest(unittest.TestCase):
+    def setUp(self): self.disk_path = tempfile.mkdtemp()
+
+    def tearDown(self): shutil.rmtree(self.disk_path, True)
+
+    def store(self, cache, path, body, *headers):
+        r = koemyd.messaging.ClientRequest.parse_head(["GET http://example.com%s HTTP/1.1" % path, "Host: example.com"])
+        now = time.time() # i.e., lookup() tells freshness by the clock
+        entry = cache.store(r, response("Cache-Control: max-age=60", "Content-Length: %d" % len(body), *headers), now, now)
+        entry.write(body)
+        self.assertTrue(cache.commit(entry))
+        return r
+
+    def test_not_stored(self):
+        cache = koemyd.caching.Cache(0x1000, 0x100)
+        for r, s in [(request(method="POST"), response("Cache-Control: max-age=60")),
+                     (request(), response("Cache-Control: max-age=60", code=500)),
+                     (request(), response("Cache-Control: no-store")),
+                     (request(), response("Cache-Control: private, max-age=60")),
+                     (request("Cache-Control: no-store"), response("Cache-Control: max-age=60")),
+                     (request(), response("Cache-Control: max-age=60", "Set-Cookie: a=1")),
+                     (request(), response("Cache-Control: max-age=60", "Vary: *")),
+                     (request("Authorization: x"), response("Cache-Control: max-age=60")),
+                     (request(), response("Cache-Control: max-age=60", "Content-Length: 4096")),
+                     (request(), response())]:
+            self.assertEqual(cache.store(r, s, T, T), None, s.headers.wire())
+
+    def test_incomplete(self):
+        cache = koemyd.caching.Cache(0x1000, 0x100)
+        entry = cache.store(request(), response("Cache-Control: max-age=60", "Content-Length: 5"), T, T)
+        entry.write("hell")
+        self.assertFalse(cache.commit(entry))
+
+        entry = cache.store(request(), response("Cache-Control: max-age=60"), T, T)
+        entry.write("x" * 0x101)
+        self.assertFalse(cache.commit(entry))
+
+    def test_lookup(self):
+        cache = koemyd.caching.Cache(0x1000, 0x100)
+        r = self.store(cache, "/a", "hello", "Vary: Accept-Encoding")
+
+        entry, is_fresh = cache.lookup(r)
+        self.assertTrue(is_fresh)
+        self.assertEqual(str(entry.open()), "hello")
+
+        self.assertEqual(cache.lookup(request("Accept-Encoding: gzip")), (None, False))
+        self.assertEqual(cache.lookup(request("If-None-Match: \"a\"")), (None, False))
+
+        cache.invalidate(r)
+        self.assertEqual(cache.lookup(r), (None, False))
+
+    def test_lru(self):
+        cache = koemyd.caching.Cache(10, 0x100)
+        a = self.store(cache, "/a", "aaaa")
+        b = self.store(cache, "/b", "bbbb")
+        cache.lookup(a) # i.e., b is the least recently used now
+        c = self.store(cache, "/c", "cccc")
+
+        self.assertEqual(cache.lookup(b), (None, False))
+        self.assertTrue(cache.lookup(a)[0] and cache.lookup(c)[0])
+        self.assertEqual(cache.memory_bytes, 8)
+        self.assertEqual(cache.evictions, 1)
+
+    def test_disk(self):
+        cache = koemyd.caching.Cache(4, 0x100, self.disk_path, 8)
+        a = self.store(cache, "/a", "aaaa")
+        e = self.store(cache, "/e", "")
+        b = self.store(cache, "/b", "bbbb") # i.e., a is demoted
+
+        entry, _ = cache.lookup(a)
+        self.assertTrue(entry.path)
+        body = entry.open()
+        self.assertEqual(body[:], "aaaa")
+        entry.close(body)
+
+        self.assertEqual(cache.lookup(e)[0].open(), "")
+        self.assertEqual((cache.memory_bytes, cache.disk_bytes), (4, 4))
+
+        self.store(cache, "/c", "cccc") # i.e., b is demoted too
+        self.store(cache, "/d", "dddd") # i.e., and then c, a is dropped off the disk tier
+        self.assertEqual(cache.lookup(a), (None, False))
+        self.assertEqual(cache.lookup(b)[0].open()[:], "bbbb")
+        self.assertEqual((cache.memory_bytes, cache.disk_bytes), (4, 8))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,179 @@
+# vi:ts=4:sw=4:syn=python
+
+import os
+import errno
+import socket
+import unittest
+
+import koemyd.const
+koemyd.const.SETTINGS_PROGRAM_CONFIG_FILE = os.devnull # i.e., defaults, rather than a koemyd.conf left in the working directory
+
+import koemyd.fetching
+
+class Clock(object):
+    def __init__(self, t): self.t = t
+
+    def time(self): return self.t
+
+class OutputQueueTest(unittest.TestCase):
+    def test_watermarks(self):
+        queue = koemyd.fetching.OutputQueue(8, 4)
+        self.assertFalse(queue.push(["abc", "", "de"]))
+        self.assertEqual(len(queue), 5)
+        self.assertFalse(queue.is_full)
+
+        self.assertTrue(queue.push(["fgh"])) # i.e., just filled up
+        self.assertFalse(queue.push(["i"]))
+        self.assertTrue(queue.is_full)
+
+        queue.pop(4) # i.e., 5 left, above low water
+        self.assertTrue(queue.is_full)
+        queue.pop(1)
+        self.assertFalse(queue.is_full)
+        self.assertEqual(queue.clear(), "fghi")
+        self.assertEqual(len(queue), 0)
+
+    def test_pop_tee(self):
+        queue, seen = koemyd.fetching.OutputQueue(0x100, 0x80), []
+        queue.push(["abc", bytearray("def"), "g"])
+
+        queue.pop(4, seen.append)
+        self.assertEqual(str().join(str(b) for b in seen), "abcd")
+        self.assertEqual(queue.clear(), "efg")
+
+    def test_gatherable(self):
+        queue = koemyd.fetching.OutputQueue(0x100, 0x80)
+        queue.push(["abc"])
+        self.assertTrue(queue.is_gatherable)
+        queue.push([bytearray("def")])
+        self.assertFalse(queue.is_gatherable)
+
+class RingBufferTest(unittest.TestCase):
+    def test_wrap(self):
+        ring = koemyd.fetching.RingBuffer(8)
+        self.assertEqual(ring.write("abcdef"), 6)
+        self.assertEqual(ring.skip(4), 4)
+        self.assertEqual(ring.write("ghijklmn"), 6) # i.e., wrapped around, 2 dropped for want of room
+        self.assertEqual(ring.free, 0)
+        self.assertEqual(ring.read(), "efghijkl")
+        self.assertEqual((len(ring), ring.free), (0, 8))
+
+    def test_socket(self):
+        a, b = socket.socketpair()
+        try:
+            ring, seen = koemyd.fetching.RingBuffer(8), []
+            ring.write("abcdef")
+            ring.skip(4)
+
+            a.sendall("012345")
+            self.assertEqual(ring.recv_into(b, 0x100), 2) # i.e., up to the end of the buffer, not around it
+            self.assertEqual(ring.recv_into(b, 0x100), 4)
+            self.assertEqual(ring.free, 0)
+
+            self.assertEqual(ring.send(a, 0x100, seen.append), 4)
+            self.assertEqual(ring.send(a, 3, seen.append), 3)
+            self.assertEqual(b.recv(0x100), "ef01234")
+            self.assertEqual(str().join(m.tobytes() for m in seen), "ef01234")
+            self.assertEqual(ring.read(), "5")
+        finally:
+            a.close()
+            b.close()
+
+class CircuitBreakerTest(unittest.TestCase):
+    def setUp(self):
+        self.time, koemyd.fetching.time = koemyd.fetching.time, Clock(1000.0)
+        self.breaker = koemyd.fetching.CircuitBreaker(2, 10)
+        self.address = ("a", 80)
+
+    def tearDown(self): koemyd.fetching.time = self.time
+
+    def test_transitions(self):
+        breaker, address = self.breaker, self.address
+
+        breaker.failure(address)
+        breaker.check(address) # i.e., closed, below threshold
+        breaker.failure(address, True)
+        self.assertRaises(koemyd.fetching.ConnectionTimeoutError, breaker.check, address)
+        self.assertEqual(breaker.stats["open"], 1)
+
+        koemyd.fetching.time.t += 10
+        breaker.check(address) # i.e., cooled down, the one probe let through
+        self.assertEqual(breaker.stats["half_open"], 1)
+        self.assertRaises(koemyd.fetching.ConnectionSocketError, breaker.check, address)
+
+        breaker.failure(address) # i.e., the probe failed, open again
+        self.assertRaises(koemyd.fetching.ConnectionSocketError, breaker.check, address)
+        self.assertEqual(breaker.trips, 2)
+
+        koemyd.fetching.time.t += 10
+        breaker.check(address)
+        breaker.success(address)
+        breaker.check(address)
+        self.assertEqual(breaker.stats, {"open": 0, "half_open": 0, "trips": 2, "rejections": 3, "probes": 2})
+
+    def test_success_resets(self):
+        self.breaker.failure(self.address)
+        self.breaker.success(self.address)
+        self.breaker.failure(self.address)
+        self.breaker.check(self.address)
+
+    def test_lost_probe(self):
+        for _ in xrange(2): self.breaker.failure(self.address)
+
+        koemyd.fetching.time.t += 10
+        self.breaker.check(self.address)
+        koemyd.fetching.time.t += 10
+        self.breaker.check(self.address) # i.e., a probe that never reported back, another one let through
+
+    def test_disabled(self):
+        breaker = koemyd.fetching.CircuitBreaker(0, 10)
+        for _ in xrange(10): breaker.failure(self.address)
+        breaker.check(self.address)
+
+class ResolverTest(unittest.TestCase):
+    def setUp(self):
+        self.getaddrinfo, self.calls = socket.getaddrinfo, []
+        socket.getaddrinfo = self.lookup
+
+    def tearDown(self): socket.getaddrinfo = self.getaddrinfo
+
+    def lookup(self, host, port, *args):
+        self.calls.append(host)
+        if host == "overflow": raise OverflowError("port out of range")
+        if host == "missing": raise socket.gaierror(socket.EAI_NONAME, "Name or service not known")
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, "", ("127.0.0.1", port))]
+
+    def test_cache(self):
+        resolver = koemyd.fetching.Resolver(2, 60, 5)
+        self.assertEqual(resolver.peek(("a", 80)), None)
+        self.assertEqual(resolver.resolve(("a", 80)), ("127.0.0.1", 80))
+        self.assertEqual(resolver.resolve(("a", 80)), ("127.0.0.1", 80))
+        self.assertEqual(resolver.peek(("a", 80)), ("127.0.0.1", 80))
+        self.assertEqual(self.calls, ["a"])
+
+        resolver.resolve(("b", 80))
+        resolver.resolve(("c", 80)) # i.e., a, the least recently used, is dropped
+        self.assertEqual(resolver.peek(("a", 80)), None)
+
+    def test_negative(self):
+        resolver = koemyd.fetching.Resolver(2, 60, 5)
+        for address in [("missing", 80), ("overflow", 80)]:
+            for _ in xrange(2):
+                self.assertRaises(socket.error, resolver.resolve, address)
+            self.assertRaises(socket.error, resolver.peek, address)
+
+        self.assertEqual(self.calls, ["missing", "overflow"])
+        self.assertEqual(resolver.stats["failures"], 2)
+
+    def test_unexpected(self): # i.e., released all the same, not waited on until connect_timeout
+        resolver = koemyd.fetching.Resolver(2, 60, 0)
+        for _ in xrange(2):
+            try:
+                resolver.resolve(("overflow", 80))
+            except socket.error as e:
+                self.assertEqual(e.errno, errno.EINVAL)
+
+        self.assertEqual(self.calls, ["overflow", "overflow"])
+
+if __name__ == "__main__":
+    unittest.main()
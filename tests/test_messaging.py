@@ -0,0 +1,90 @@
+# vi:ts=4:sw=4:syn=python
+
+import unittest
+
+import koemyd.trans
+import koemyd.struct
+import koemyd.messaging
+
+def request(line, *headers): return koemyd.messaging.ClientRequest.parse_head([line] + list(headers))
+
+def response(line, *headers): return koemyd.messaging.ServerResponse.parse_head([line] + list(headers))
+
+class ClientRequestTest(unittest.TestCase):
+    def test_address(self):
+        for line, address in [("GET http://Example.com/a?b HTTP/1.1", ("example.com", 80)),
+                              ("GET http://a:8080 HTTP/1.1", ("a", 8080)),
+                              ("GET http://u:p@[::1]:8080/ HTTP/1.1", ("::1", 8080)),
+                              ("GET http://a:/ HTTP/1.1", ("a", 80)),
+                              ("CONNECT A:443 HTTP/1.1", ("a", 443))]:
+            self.assertEqual(request(line).address, address)
+
+        self.assertEqual(request("GET http://a/b?c=d HTTP/1.1").path, "/b?c=d")
+        self.assertEqual(request("GET http://a HTTP/1.1").path, "/")
+
+    def test_bad_address(self):
+        for line, code in [("GET http://a:70000/ HTTP/1.1", 400), ("GET http://a:+80/ HTTP/1.1", 400),
+                           ("GET http://a:x/ HTTP/1.1", 400), ("GET https://a/ HTTP/1.1", 400),
+                           ("GET http:/// HTTP/1.1", 400), ("GET /a HTTP/1.1", 403),
+                           ("CONNECT a HTTP/1.1", 400), ("CONNECT a:-1 HTTP/1.1", 400),
+                           ("CONNECT a:99999999999999999999 HTTP/1.1", 400), ("CONNECT a:1:2 HTTP/1.1", 400)]:
+            try:
+                request(line)
+            except koemyd.messaging.ClientRequestError as e:
+                self.assertEqual(e.code, code, line)
+            else:
+                self.fail(line)
+
+    def test_body(self):
+        self.assertFalse(request("GET http://a/ HTTP/1.1").has_body)
+        self.assertTrue(request("POST http://a/ HTTP/1.1", "Content-Length: 5").has_body)
+
+        chunked = request("POST http://a/ HTTP/1.1", "Transfer-Encoding: Chunked")
+        self.assertTrue(chunked.is_chunked and chunked.has_body)
+        self.assertTrue(isinstance(chunked.coder, koemyd.trans.ChunkScanner))
+
+        try:
+            request("POST http://a/ HTTP/1.1", "Transfer-Encoding: gzip, chunked")
+        except koemyd.messaging.ClientRequestError as e:
+            self.assertEqual(e.code, 501)
+        else:
+            self.fail()
+
+    def test_expect(self):
+        self.assertTrue(request("POST http://a/ HTTP/1.1", "Expect: 100-Continue").is_expecting)
+        self.assertFalse(request("POST http://a/ HTTP/1.0", "Expect: 100-continue").is_expecting)
+        self.assertRaises(koemyd.messaging.ClientRequestError, request, "POST http://a/ HTTP/1.1", "Expect: x")
+
+    def test_persistent(self):
+        self.assertTrue(request("GET http://a/ HTTP/1.1").is_persistent)
+        self.assertFalse(request("GET http://a/ HTTP/1.0").is_persistent)
+        self.assertTrue(request("GET http://a/ HTTP/1.0", "Proxy-Connection: keep-alive").is_persistent)
+        self.assertFalse(request("GET http://a/ HTTP/1.1", "Connection: close").is_persistent)
+        self.assertFalse(request("CONNECT a:443 HTTP/1.1").is_persistent)
+
+class ServerResponseTest(unittest.TestCase):
+    def test_expects_body(self):
+        get, head = request("GET http://a/ HTTP/1.1"), request("HEAD http://a/ HTTP/1.1")
+
+        self.assertTrue(response("HTTP/1.1 200 OK", "Content-Length: 5").expects_body(get))
+        self.assertFalse(response("HTTP/1.1 200 OK", "Content-Length: 5").expects_body(head))
+        for code in [204, 304]:
+            self.assertFalse(response("HTTP/1.1 %d X" % code).expects_body(get))
+
+    def test_coder(self):
+        self.assertEqual(response("HTTP/1.1 200 OK", "Content-Length: 5").coder, None)
+
+        self.assertTrue(isinstance(response("HTTP/1.1 200 OK", "Transfer-Encoding: chunked").coder, koemyd.trans.ChunkDecoder))
+        passthrough = koemyd.messaging.ServerResponse.parse_head(["HTTP/1.1 200 OK", "Transfer-Encoding: chunked"], True)
+        self.assertTrue(isinstance(passthrough.coder, koemyd.trans.ChunkScanner))
+
+        unframed = response("HTTP/1.1 200 OK")
+        self.assertTrue(isinstance(unframed.coder, koemyd.trans.ChunkEncoder))
+        self.assertEqual(unframed.headers["Transfer-Encoding"], "chunked")
+
+    def test_bad_content_length(self):
+        self.assertRaises(koemyd.struct.HTTPHeaderError, response, "HTTP/1.1 200 OK", "Content-Length: 5", "Content-Length: 6")
+        self.assertRaises(koemyd.struct.HTTPResponseError, response, "HTTP/1.1 abc OK")
+
+if __name__ == "__main__":
+    unittest.main()
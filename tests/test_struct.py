@@ -0,0 +1,116 @@
+# vi:ts=4:sw=4:syn=python
+
+import unittest
+
+import koemyd.struct
+
+class HTTPHeadersTest(unittest.TestCase):
+    def test_case_insensitive(self):
+        headers = koemyd.struct.HTTPHeaders()
+        headers["Content-Type"] = " text/plain "
+
+        self.assertTrue("content-type" in headers)
+        self.assertEqual(headers["CONTENT-TYPE"], "text/plain")
+        self.assertEqual(headers.get("x-missing", "-"), "-")
+
+        headers["content-type"] = "text/html" # i.e., the first spelling is kept
+        self.assertEqual(headers.keys(), ["Content-Type"])
+        self.assertEqual(headers["Content-Type"], "text/html")
+
+        del headers["CONTENT-type"]
+        self.assertFalse("Content-Type" in headers)
+        self.assertEqual(len(headers), 0)
+
+    def test_add_getall(self):
+        headers = koemyd.struct.HTTPHeaders()
+        headers.add("Set-Cookie", "a=1")
+        headers.add("set-cookie", "b=2")
+
+        self.assertEqual(headers.getall("SET-COOKIE"), ["a=1", "b=2"])
+        self.assertEqual(headers["Set-Cookie"], "a=1, b=2")
+        self.assertEqual(headers.getall("Vary"), [])
+        self.assertEqual(len(headers), 1)
+
+    def test_wire(self):
+        headers = koemyd.struct.HTTPHeaders()
+        headers["X-B"] = "2"
+        headers["Keep-Alive"] = "timeout=5"
+        headers["X-A"] = "1"
+        headers["Host"] = "example.com"
+
+        self.assertEqual(headers.wire(), "Host: example.com\r\nKeep-Alive: timeout=5\r\nX-A: 1\r\nX-B: 2\r\n")
+        self.assertEqual(headers.wire(frozenset(["keep-alive"])), "Host: example.com\r\nX-A: 1\r\nX-B: 2\r\n")
+
+    def test_wire_invalidated(self):
+        headers = koemyd.struct.HTTPHeaders()
+        headers["X-A"] = "1"
+        self.assertEqual(headers.wire(), "X-A: 1\r\n")
+
+        headers.add("X-A", "2")
+        self.assertEqual(headers.wire(), "X-A: 1\r\nX-A: 2\r\n")
+
+        del headers["X-A"]
+        self.assertEqual(headers.wire(), "")
+
+    def test_parse(self):
+        self.assertEqual(koemyd.struct.HTTPHeaders.parse("Host: a:80"), ("Host", " a:80"))
+        self.assertRaises(koemyd.struct.HTTPHeaderError, koemyd.struct.HTTPHeaders.parse, "Host")
+
+class HTTPHeadParserTest(unittest.TestCase):
+    def test_incremental(self):
+        parser, buffer = koemyd.struct.HTTPHeadParser(), bytearray()
+        for data in ["GET / HTTP/1.1\r\nHo", "st: a\r\n\r", "\nbody"]:
+            buffer += data
+            lines = parser.parse(buffer)
+
+        self.assertEqual(lines, ["GET / HTTP/1.1", "Host: a"])
+        self.assertEqual(str(buffer), "body")
+
+    def test_bare_lf(self):
+        buffer = bytearray("\r\nGET / HTTP/1.1\nHost: a\n\n")
+        self.assertEqual(koemyd.struct.HTTPHeadParser().parse(buffer), ["GET / HTTP/1.1", "Host: a"])
+        self.assertEqual(len(buffer), 0)
+
+    def test_incomplete(self):
+        buffer = bytearray("GET / HTTP/1.1\r\nHost: a\r\n")
+        self.assertEqual(koemyd.struct.HTTPHeadParser().parse(buffer), None)
+        self.assertEqual(str(buffer), "GET / HTTP/1.1\r\nHost: a\r\n")
+
+    def test_max_head_length(self):
+        parser = koemyd.struct.HTTPHeadParser(max_head_length=32, max_line_length=32)
+        self.assertRaises(koemyd.struct.HTTPHeaderError, parser.parse, bytearray("GET / HTTP/1.1\r\n" + "X: y\r\n" * 8))
+
+        parser = koemyd.struct.HTTPHeadParser(max_head_length=32, max_line_length=32)
+        self.assertRaises(koemyd.struct.HTTPHeaderError, parser.parse, bytearray("GET / HTTP/1.1\r\n" + "X: y\r\n" * 8 + "\r\n"))
+
+    def test_max_line_length(self):
+        parser = koemyd.struct.HTTPHeadParser(max_line_length=16)
+        self.assertRaises(koemyd.struct.HTTPHeaderError, parser.parse, bytearray("GET /" + "a" * 16))
+
+        parser = koemyd.struct.HTTPHeadParser(max_line_length=16)
+        self.assertRaises(koemyd.struct.HTTPHeaderError, parser.parse, bytearray("GET / HTTP/1.1\r\nX: " + "y" * 16 + "\r\n\r\n"))
+
+class HTTPMessageTest(unittest.TestCase):
+    def parse(self, *lines): return koemyd.struct.HTTPRequest.parse_head(["POST / HTTP/1.1"] + list(lines))
+
+    def test_content_length(self):
+        self.assertEqual(self.parse("Content-Length: 5").headers["Content-Length"], "5")
+        self.assertEqual(self.parse("Content-Length: 5", "Content-Length: 5").headers["Content-Length"], "5")
+        self.assertEqual(self.parse("Content-Length: 5, 5").headers.getall("Content-Length"), ["5"])
+
+    def test_bad_content_length(self):
+        for lines in [["Content-Length: 5", "Content-Length: 6"], ["Content-Length: 5, 6"],
+                      ["Content-Length: -5"], ["Content-Length: +5"], ["Content-Length: 0x5"], ["Content-Length:"]]:
+            try:
+                self.parse(*lines)
+            except koemyd.struct.HTTPHeaderError as e:
+                self.assertEqual(e.code, 400)
+            else:
+                self.fail(lines)
+
+    def test_request_line(self):
+        self.assertRaises(koemyd.struct.HTTPRequestError, koemyd.struct.HTTPRequest, "GET /")
+        self.assertRaises(koemyd.struct.HTTPRequestError, koemyd.struct.HTTPRequest, "PATCH / HTTP/1.1")
+
+if __name__ == "__main__":
+    unittest.main()
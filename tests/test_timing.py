@@ -0,0 +1,130 @@
+# vi:ts=4:sw=4:syn=python
+
+import os
+import unittest
+
+import koemyd.const
+koemyd.const.SETTINGS_PROGRAM_CONFIG_FILE = os.devnull # i.e., defaults, rather than a koemyd.conf left in the working directory
+
+import koemyd.logger
+import koemyd.timing
+
+T = 1000.0
+
+class Clock(object):
+    def __init__(self, t): self.t = t
+
+    def time(self): return self.t
+
+class TimingTest(unittest.TestCase):
+    def setUp(self):
+        self.time, self.clock = koemyd.timing.time, Clock(T)
+        koemyd.timing.time = self.clock
+
+        self.wheel = koemyd.timing.TimerWheel(1.0, 2, 3) # i.e., 4 slots a level, 63 ticks across the three
+        self.fired = dict()
+
+    def tearDown(self): koemyd.timing.time = self.time
+
+    def run_until(self, t):
+        while self.clock.t < T + t:
+            self.clock.t += 1
+            self.wheel.advance()
+
+    def fire(self, name): self.fired[name] = self.clock.t - T
+
+class TimerWheelTest(TimingTest):
+    def test_cascade(self):
+        delays = [1, 3, 4, 5, 15, 16, 17, 63, 64, 100, 200] # i.e., each level, its edges, and past the span
+        for d in delays: self.wheel.schedule(d, self.fire, d)
+        self.assertEqual(self.wheel.pending, len(delays))
+
+        self.run_until(250)
+        self.assertEqual(self.fired, dict((d, d) for d in delays))
+        self.assertEqual((self.wheel.pending, self.wheel.fired), (0, len(delays)))
+
+    def test_late(self): # i.e., ticks missed are all run, in one advance()
+        for d in [2, 30]: self.wheel.schedule(d, self.fire, d)
+
+        self.clock.t += 40
+        self.assertEqual(self.wheel.advance(), 2)
+        self.assertEqual(sorted(self.fired), [2, 30])
+
+    def test_cancel(self):
+        timer = self.wheel.schedule(20, self.fire, "a")
+        self.wheel.schedule(20, self.fire, "b")
+
+        self.assertTrue(self.wheel.cancel(timer))
+        self.assertFalse(self.wheel.cancel(timer))
+
+        self.run_until(30)
+        self.assertEqual(self.fired, {"b": 20})
+        self.assertFalse(self.wheel.cancel(timer))
+
+    def test_failing_timer(self): # i.e., the others in its batch still fire
+        self.wheel.schedule(2, lambda: 1 / 0)
+        self.wheel.schedule(2, self.fire, "a")
+
+        oops, koemyd.logger.oops = koemyd.logger.oops, lambda module, *args: self.fire(module)
+        try:
+            self.run_until(2)
+        finally:
+            koemyd.logger.oops = oops
+
+        self.assertEqual(self.fired, {"a": 2, "timing": 2})
+
+class DeadlinesTest(TimingTest):
+    def test_phase(self):
+        deadlines = koemyd.timing.Deadlines(self.wheel, self.fire)
+        deadlines.arm("header", 10)
+
+        self.run_until(9)
+        deadlines.time_last_op = self.clock.t # i.e., progress doesn't push back a phase deadline
+        self.run_until(11)
+        self.assertEqual(self.fired, {"header": 10})
+        self.assertEqual(deadlines.expired, "header")
+
+    def test_idle(self):
+        deadlines = koemyd.timing.Deadlines(self.wheel, self.fire)
+        deadlines.arm("transfer", 10, True)
+
+        self.run_until(8)
+        deadlines.time_last_op = self.clock.t # i.e., pushed back to 18
+        self.run_until(17)
+        self.assertEqual(self.fired, {})
+
+        self.run_until(20)
+        self.assertEqual(self.fired, {"transfer": 18})
+
+    def test_rearm(self):
+        deadlines = koemyd.timing.Deadlines(self.wheel, self.fire)
+        deadlines.arm("header", 10)
+        self.run_until(5)
+        deadlines.arm("keepalive", 30) # i.e., the pending timer goes off first and picks up the new one
+
+        self.run_until(40)
+        self.assertEqual(self.fired, {"keepalive": 35})
+
+    def test_disarm_close(self):
+        deadlines = koemyd.timing.Deadlines(self.wheel, self.fire, lifetime=50)
+        deadlines.arm("header", 10)
+        deadlines.disarm()
+        self.run_until(20)
+        self.assertEqual(self.fired, {})
+
+        deadlines.close()
+        self.run_until(60)
+        self.assertEqual(self.fired, {})
+        self.assertEqual(self.wheel.pending, 0)
+
+    def test_lifetime(self):
+        deadlines = koemyd.timing.Deadlines(self.wheel, self.fire, lifetime=50)
+        deadlines.arm("transfer", 10, True)
+        for _ in xrange(60):
+            self.run_until(self.clock.t - T + 1)
+            deadlines.time_last_op = self.clock.t
+
+        self.assertEqual(self.fired, {"lifetime": 50})
+
+if __name__ == "__main__":
+    unittest.main()
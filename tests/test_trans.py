@@ -0,0 +1,58 @@
+# vi:ts=4:sw=4:syn=python
+
+import unittest
+
+import koemyd.trans
+
+class ChunkScannerTest(unittest.TestCase):
+    def scan(self, data):
+        scanner = koemyd.trans.ChunkScanner()
+        n = scanner.feed(data)
+        return scanner, n
+
+    def test_sizes(self):
+        for size, data in [("5", "hello"), ("05", "hello"), ("a", "0123456789"), ("A", "0123456789"),
+                           ("5;name=value", "hello"), ("5;", "hello")]:
+            scanner, _ = self.scan("%s\r\n%s\r\n0\r\n\r\n" % (size, data))
+            self.assertFalse(scanner.keep_feeding, size)
+
+    def test_body(self):
+        data = "5\r\nhello\r\n5;ext\r\nworld\r\n0\r\n\r\n"
+        scanner, n = self.scan(data + "GET")
+        self.assertFalse(scanner.keep_feeding)
+        self.assertEqual(n, len(data))
+
+    def test_malformed_sizes(self):
+        for size in ["-5", "+5", "0x5", " 5", "5 ", "\t5", "5 ;ext", "", ";ext", "g", "5\x00"]:
+            self.assertRaises(koemyd.trans.ChunkScannerError, self.scan, "%s\r\nhello\r\n0\r\n\r\n" % size)
+
+    def test_data_crlf(self):
+        for data in ["3\r\nabcXX0\r\n\r\n", "3\r\nabc\rX0\r\n\r\n", "3\r\nabcd\r\n0\r\n\r\n", "3\r\nabc0\r\n\r\n"]:
+            self.assertRaises(koemyd.trans.ChunkScannerError, self.scan, data)
+
+    def test_data_crlf_split(self): # i.e., the CRLF in a later feed
+        scanner = koemyd.trans.ChunkScanner()
+        for data in ["3\r\nabc", "\r", "\n0\r\n", "\r\n"]: scanner.feed(data)
+        self.assertFalse(scanner.keep_feeding)
+
+        scanner = koemyd.trans.ChunkScanner()
+        scanner.feed("3\r\nabc")
+        self.assertRaises(koemyd.trans.ChunkScannerError, scanner.feed, "XX0\r\n\r\n")
+
+class ChunkDecoderTest(unittest.TestCase):
+    def test_body(self):
+        decoder = koemyd.trans.ChunkDecoder()
+        self.assertRaises(koemyd.trans.ChunksDecodedException, decoder.feed, "5;ext\r\nhello\r\n0\r\n\r\n")
+        self.assertEqual([c.data for c in decoder.flush()], ["hello", ""])
+
+    def test_malformed_sizes(self):
+        for size in ["-5", "+5", "0x5", " 5", "5 ", ""]:
+            decoder = koemyd.trans.ChunkDecoder()
+            self.assertRaises(koemyd.trans.ChunkDecoderError, decoder.feed, "%s\r\nhello\r\n0\r\n\r\n" % size)
+
+    def test_data_crlf(self):
+        decoder = koemyd.trans.ChunkDecoder()
+        self.assertRaises(koemyd.trans.ChunkDecoderError, decoder.feed, "3\r\nabcXX0\r\n\r\n")
+
+if __name__ == "__main__":
+    unittest.main()